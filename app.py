@@ -52,6 +52,12 @@ class PlayblastBase(Application):
         self.engine.register_command(self.get_setting("name", "Playblast..."),
                                      menu_callback)
 
+        # resume the media uploads a previous session left in the upload queue
+        try:
+            app_payload.playblast.start_uploads(self, self.sgtk)
+        except Exception as e:
+            logger.warning("Could not resume the queued uploads: {}".format(e))
+
     def create_playblast_manager(self):
         return self.import_module('playblast').PlayblastManager(
             self, self.engine.context)
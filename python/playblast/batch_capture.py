@@ -0,0 +1,351 @@
+"""
+Chunked playblast capture across headless mayapy workers.
+
+The frame range is split into contiguous chunks, each captured with offScreen=True by
+its own mayapy process opened on the saved scene. Chunk frames are merged into a single
+sequence as each worker finishes, so the result looks exactly like the output of one
+cmds.playblast call.
+
+Workers draw through a model panel of their own, looking through the camera with the
+display settings of the interactive panel, and with the same focal length HUD, see
+viewport and hud. A worker that can not create that panel, eg a maya.standalone without a
+viewport, fails its chunk with NO_PANEL_EXIT_CODE rather than capture through another camera,
+and ChunkedCapture.run raises CapturePanelError so the capture can run in the session instead.
+
+This module only depends on the standard library at import time so it can be run as the
+worker script itself:
+
+    mayapy batch_capture.py --scene shot.ma --camera shotCam --start 1001 --end 1100
+        --output /tmp/chunk_0/maya_playblast --params '{"width": 960, ...}'
+        --display '{"displayAppearance": "smoothShaded", ...}' --focal-length 35
+
+Passing --standin writes placeholder frames instead of starting maya, which lets the
+split/schedule/merge logic run without a maya licence.
+"""
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+# rough resident size of a mayapy process with a production shot loaded
+DEFAULT_WORKER_MEMORY = 4 * 1024 ** 3
+# below this many frames per chunk the scene load dominates the capture time
+MIN_CHUNK_FRAMES = 50
+
+# playblast flags forwarded to the workers, everything else is forced or irrelevant offscreen
+WORKER_PLAYBLAST_FLAGS = ('width', 'height', 'percent', 'quality', 'framePadding', 'compression',
+                          'showOrnaments', 'clearCache')
+# exit code of a worker that could not create its capture panel
+NO_PANEL_EXIT_CODE = 3
+
+
+class CapturePanelError(RuntimeError):
+    """
+    Raised when the workers can not draw through a model panel of their own.
+    """
+
+
+def split_frame_range(start, end, chunks):
+    """
+    Splits an inclusive frame range into contiguous, near equal chunks.
+    :param start: first frame
+    :param end: last frame
+    :param chunks: requested number of chunks
+    :return: list of (start, end) tuples covering the range in order
+    """
+    frame_count = end - start + 1
+    if frame_count <= 0:
+        return []
+    chunks = max(1, min(chunks, frame_count))
+    size, remainder = divmod(frame_count, chunks)
+
+    ranges = []
+    chunk_start = start
+    for i in range(chunks):
+        chunk_end = chunk_start + size - 1 + (1 if i < remainder else 0)
+        ranges.append((chunk_start, chunk_end))
+        chunk_start = chunk_end + 1
+    return ranges
+
+
+def get_available_memory():
+    """
+    Returns the physical memory currently available in bytes, None if it cannot be queried.
+    """
+    if os.name == 'nt':
+        import ctypes
+
+        class MEMORYSTATUSEX(ctypes.Structure):
+            _fields_ = [('dwLength', ctypes.c_ulong),
+                        ('dwMemoryLoad', ctypes.c_ulong),
+                        ('ullTotalPhys', ctypes.c_ulonglong),
+                        ('ullAvailPhys', ctypes.c_ulonglong),
+                        ('ullTotalPageFile', ctypes.c_ulonglong),
+                        ('ullAvailPageFile', ctypes.c_ulonglong),
+                        ('ullTotalVirtual', ctypes.c_ulonglong),
+                        ('ullAvailVirtual', ctypes.c_ulonglong),
+                        ('ullAvailExtendedVirtual', ctypes.c_ulonglong)]
+
+        status = MEMORYSTATUSEX()
+        status.dwLength = ctypes.sizeof(MEMORYSTATUSEX)
+        if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+            return status.ullAvailPhys
+        return None
+
+    try:
+        with open('/proc/meminfo') as fh:
+            for line in fh:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError, ValueError):
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def pick_worker_count(frame_count, cpu_count=None, available_memory=None,
+                      worker_memory=DEFAULT_WORKER_MEMORY, min_chunk_frames=MIN_CHUNK_FRAMES):
+    """
+    Picks how many mayapy workers to run for a capture.
+    Every worker evaluates with several threads, so half of the cores are used, and
+    each worker must fit in the memory that is currently free.
+    :param frame_count: number of frames to capture
+    :param cpu_count: available cores, queried when None
+    :param available_memory: free memory in bytes, queried when None
+    :param worker_memory: expected memory of one worker in bytes
+    :param min_chunk_frames: smallest chunk worth paying a scene load for
+    :return: number of workers, at least 1
+    """
+    if cpu_count is None:
+        cpu_count = multiprocessing.cpu_count()
+    if available_memory is None:
+        available_memory = get_available_memory()
+
+    limits = [max(1, cpu_count // 2),
+              max(1, int(math.ceil(float(frame_count) / min_chunk_frames)))]
+    if available_memory:
+        limits.append(max(1, int(available_memory // worker_memory)))
+    return max(1, min(limits))
+
+
+def get_mayapy():
+    """
+    Returns the mayapy executable that belongs to the running maya.
+    """
+    name = 'mayapy.exe' if os.name == 'nt' else 'mayapy'
+    return os.path.join(os.path.dirname(sys.executable), name)
+
+
+class ChunkedCapture(object):
+    """
+    Captures a frame range with several headless mayapy processes and merges the result.
+    """
+
+    POLL_INTERVAL = 0.25
+
+    def __init__(self, app, scene_path, camera, playblast_params, workers=None, mayapy=None, standin=False,
+                 emitter=None, display_settings=None, focal_length=None):
+        """
+        Construction
+        :param app: the playblast app, used for logging
+        :param scene_path: saved maya scene the workers open
+        :param camera: camera to capture through
+        :param playblast_params: the cmds.playblast params of the interactive capture,
+                                 startTime, endTime and filename are required
+        :param workers: number of workers, picked from cores and memory when None
+        :param mayapy: mayapy executable, the one next to the running maya when None
+        :param standin: write placeholder frames instead of running maya
+        :param emitter: callable receiving progress messages
+        :param display_settings: display settings of the interactive panel, see viewport.get_display_settings
+        :param focal_length: focal length the HUD shows without a camera
+        """
+        self._app = app
+        self.scene_path = scene_path
+        self.camera = camera
+        self.playblast_params = playblast_params
+        self.start = int(playblast_params['startTime'])
+        self.end = int(playblast_params['endTime'])
+        self.output = playblast_params['filename']
+        self.workers = workers or pick_worker_count(self.end - self.start + 1)
+        self.mayapy = mayapy or (sys.executable if standin else get_mayapy())
+        self.standin = standin
+        self.emitter = emitter or app.logger.info
+        self.display_settings = display_settings or {}
+        self.focal_length = focal_length
+
+    def get_worker_args(self, chunk_start, chunk_end, chunk_output):
+        """
+        Returns the command line that captures one chunk.
+        """
+        params = dict((key, self.playblast_params[key]) for key in WORKER_PLAYBLAST_FLAGS
+                      if key in self.playblast_params)
+        args = [self.mayapy, os.path.abspath(__file__).replace('.pyc', '.py'),
+                '--scene', self.scene_path,
+                '--camera', self.camera or '',
+                '--start', str(chunk_start),
+                '--end', str(chunk_end),
+                '--output', chunk_output,
+                '--params', json.dumps(params),
+                '--display', json.dumps(self.display_settings)]
+        if self.focal_length is not None:
+            args += ['--focal-length', str(self.focal_length)]
+        if self.standin:
+            args.append('--standin')
+        return args
+
+    def run(self):
+        """
+        Captures all chunks in parallel and merges their frames next to the requested output.
+        Raises CapturePanelError when the workers can not create a capture panel, RuntimeError
+        when a chunk fails otherwise.
+        :return: the output path in the form cmds.playblast returns it, eg /tmp/pb.####.jpg
+        """
+        chunks = split_frame_range(self.start, self.end, self.workers)
+        self._app.logger.debug("ChunkedCapture: {} workers, chunks = {}".format(len(chunks), chunks))
+        self.emitter('Capturing {} frames with {} workers..'.format(self.end - self.start + 1, len(chunks)))
+
+        output_dir = os.path.dirname(self.output)
+        if output_dir and not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+        chunks_root = tempfile.mkdtemp(prefix='maya_playblast_chunks_', dir=output_dir or None)
+
+        running = {}
+        try:
+            for index, (chunk_start, chunk_end) in enumerate(chunks):
+                chunk_dir = os.path.join(chunks_root, 'chunk_{}'.format(index))
+                os.makedirs(chunk_dir)
+                chunk_output = os.path.join(chunk_dir, os.path.basename(self.output))
+                log_file = open(os.path.join(chunk_dir, 'worker.log'), 'w+')
+                proc = subprocess.Popen(self.get_worker_args(chunk_start, chunk_end, chunk_output),
+                                        stdout=log_file, stderr=subprocess.STDOUT)
+                running[proc] = (chunk_start, chunk_end, chunk_dir, log_file)
+
+            finished = 0
+            while running:
+                for proc in list(running):
+                    if proc.poll() is None:
+                        continue
+                    chunk_start, chunk_end, chunk_dir, log_file = running.pop(proc)
+                    log_file.seek(0)
+                    log = log_file.read()
+                    log_file.close()
+                    if proc.returncode == NO_PANEL_EXIT_CODE:
+                        raise CapturePanelError("Workers can not create a capture panel, frames {}-{}:\n{}".format(
+                            chunk_start, chunk_end, log[-2000:]))
+                    if proc.returncode != 0:
+                        raise RuntimeError("Capture of frames {}-{} failed ({}):\n{}".format(
+                            chunk_start, chunk_end, proc.returncode, log[-2000:]))
+                    self.merge_chunk(chunk_dir)
+                    finished += 1
+                    self.emitter('Captured frames {}-{} ({}/{} chunks)'.format(chunk_start, chunk_end,
+                                                                              finished, len(chunks)))
+                time.sleep(self.POLL_INTERVAL)
+        finally:
+            for proc, (_, _, _, log_file) in running.items():
+                proc.kill()
+                log_file.close()
+            shutil.rmtree(chunks_root, ignore_errors=True)
+
+        return '{0}.{1}.{2}'.format(self.output, '#' * int(self.playblast_params.get('framePadding', 4)),
+                                    self.playblast_params.get('compression') or 'jpg')
+
+    def merge_chunk(self, chunk_dir):
+        """
+        Moves the frames of a finished chunk next to the requested output.
+        The chunk directories live inside the output directory so this is a rename per frame.
+        """
+        output_dir = os.path.dirname(self.output)
+        for name in os.listdir(chunk_dir):
+            if name.startswith(os.path.basename(self.output) + '.'):
+                os.rename(os.path.join(chunk_dir, name), os.path.join(output_dir, name))
+
+
+def _capture_standin(args, params):
+    padding = int(params.get('framePadding', 4))
+    ext = params.get('compression') or 'jpg'
+    for frame in range(args.start, args.end + 1):
+        frame_path = '{0}.{1}.{2}'.format(args.output, str(frame).zfill(padding), ext)
+        with open(frame_path, 'w') as fh:
+            fh.write('standin frame {} of {}\n'.format(frame, args.scene))
+
+
+def _capture_maya(args, params, display_settings):
+    try:
+        from .hud import FocalLengthHUD
+        from .viewport import create_capture_panel
+    except (ImportError, ValueError):
+        # run as the worker script
+        from hud import FocalLengthHUD
+        from viewport import create_capture_panel
+
+    import maya.standalone
+    maya.standalone.initialize(name='python')
+    import maya.cmds as cmds
+
+    cmds.file(args.scene, open=True, force=True, prompt=False)
+    window = None
+    if args.camera:
+        try:
+            window, panel = create_capture_panel(cmds, args.camera, params.get('width', 960),
+                                                 params.get('height', 540), display_settings)
+        except RuntimeError as e:
+            # without a panel of its own the playblast draws through whatever panel maya
+            # picks, maybe another camera: fail the chunk
+            sys.stderr.write('Warning: no capture panel through {} ({}), failing the chunk\n'.format(
+                args.camera, e))
+            maya.standalone.uninitialize()
+            sys.exit(NO_PANEL_EXIT_CODE)
+
+    params.update({
+        'startTime': args.start,
+        'endTime': args.end,
+        'filename': args.output,
+        'format': 'image',
+        'offScreen': True,
+        'viewer': False,
+        'forceOverwrite': True,
+        'sequenceTime': False,
+    })
+    # the HUD of the interactive capture, evaluated for the chunk
+    hud = FocalLengthHUD(args.camera, args.start, args.end, default=args.focal_length, cmds=cmds)
+    hud.install()
+    try:
+        cmds.playblast(**params)
+    finally:
+        hud.remove()
+        if window:
+            cmds.deleteUI(window)
+    maya.standalone.uninitialize()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Capture one chunk of a chunked playblast.')
+    parser.add_argument('--scene', required=True)
+    parser.add_argument('--camera', default='')
+    parser.add_argument('--start', type=int, required=True)
+    parser.add_argument('--end', type=int, required=True)
+    parser.add_argument('--output', required=True)
+    parser.add_argument('--params', default='{}')
+    parser.add_argument('--display', default='{}', help='display settings of the interactive panel')
+    parser.add_argument('--focal-length', default=None)
+    parser.add_argument('--standin', action='store_true')
+    args = parser.parse_args(argv)
+
+    params = json.loads(args.params)
+    if args.standin:
+        _capture_standin(args, params)
+    else:
+        _capture_maya(args, params, json.loads(args.display))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,365 @@
+"""
+Burn-in of the frame number, shot, project, artist, camera and date on playblast movies.
+
+BURNIN_LAYOUT is the single definition of the burn-in. It is rendered either by an ffmpeg
+drawtext chain (get_drawtext_filter) or by BurnIn, which rasterizes every label once into
+an alpha tile, blends the tiles onto the decoded frames with numpy and pipes rawvideo to
+ffmpeg, so ffmpeg only has to encode.
+
+numpy and OpenImageIO are only needed by BurnIn, the drawtext chain works without them.
+
+    python burnin.py benchmark --resolutions 1K 2K 4K --frames 48
+
+compares both paths on generated frames.
+"""
+import argparse
+import collections
+import datetime
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from distutils import spawn
+
+try:
+    from .compat import futures
+    from .ffmpeg_runner import FFmpegRunner
+except (ImportError, ValueError):
+    # run as a script for the benchmark
+    from compat import futures
+    from ffmpeg_runner import FFmpegRunner
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import OpenImageIO
+except ImportError:
+    OpenImageIO = None
+
+BURNIN_COLOR = 'DAF7A6'
+# field, relative x, relative y, horizontal alignment, font size offset
+BURNIN_LAYOUT = (
+    ('frame', 0.98, 0.92, 'right', 2),
+    ('shot_name', 0.50, 0.92, 'left', 0),
+    ('project_name', 0.50, 0.02, 'left', 0),
+    ('artist', 0.02, 0.92, 'left', 0),
+    ('camera', 0.02, 0.02, 'left', 0),
+    ('date', 0.90, 0.02, 'left', 0),
+)
+FRAME_CHARACTERS = '-0123456789'
+# frames decoded and composited ahead of the one being written to ffmpeg
+DEFAULT_READ_AHEAD = 8
+
+RESOLUTIONS = {'1K': (1024, 540), '2K': (2048, 1080), '4K': (4096, 2160)}
+DEFAULT_FONT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'resources',
+                                 'DroidSans.ttf')
+
+
+def is_available():
+    """
+    Returns True when the numpy burn-in can run.
+    """
+    return numpy is not None and OpenImageIO is not None
+
+
+def get_font_size(width):
+    if width > 2048:
+        return round(width / 100)
+    return 18
+
+
+def get_drawtext_filter(fields, first, font_file, font_size):
+    """
+    Builds the ffmpeg filter chain drawing the burn-in.
+    :param fields: {field: text} of the static fields of BURNIN_LAYOUT
+    :param first: frame number of the first image fed to ffmpeg
+    :param font_file: font path, escaped for the filter graph
+    :param font_size: font size in pixels
+    :return: ffmpeg -vf filter string
+    """
+    filters = ["pad=ceil(iw/2)*2:ceil(ih/2)*2", "select='gte(n\\,0)'"]
+    for field, x, y, align, size_offset in BURNIN_LAYOUT:
+        if field == 'frame':
+            text = "start_number={first}:fontfile='{font_file}':text='%{{n}}'".format(first=first,
+                                                                                    font_file=font_file)
+        else:
+            text = "fontfile='{font_file}':text='{text}'".format(font_file=font_file, text=fields[field])
+        filters.append("drawtext={text}:x=w*{x:.2f}{align}:y=h*{y:.2f}:fontsize={size}:fontcolor={color}".format(
+            text=text, x=x, align='-text_w' if align == 'right' else '', y=y,
+            size='{}+{}'.format(font_size, size_offset) if size_offset else font_size, color=BURNIN_COLOR))
+    return ','.join(filters)
+
+
+class BurnIn(object):
+    """
+    Composites the burn-in onto frames with numpy and encodes them with a single ffmpeg.
+    """
+
+    def __init__(self, fields, width, height, font_path, font_size=None, ffmpeg=None, read_ahead=DEFAULT_READ_AHEAD):
+        """
+        Construction
+        :param fields: {field: text} of the static fields of BURNIN_LAYOUT
+        :param width: width of the frames
+        :param height: height of the frames
+        :param font_path: path of the font file
+        :param font_size: font size in pixels, picked from the width when None
+        :param ffmpeg: ffmpeg executable
+        :param read_ahead: number of frames decoded ahead of the encoder
+        """
+        if not is_available():
+            raise RuntimeError("The numpy burn-in needs numpy and OpenImageIO")
+        self.width = width
+        self.height = height
+        # same padding as the drawtext chain, yuv420p needs even dimensions
+        self.out_width = width + width % 2
+        self.out_height = height + height % 2
+        self.font_path = font_path
+        self.font_size = font_size or get_font_size(width)
+        self.ffmpeg = ffmpeg or spawn.find_executable('ffmpeg')
+        self.read_ahead = read_ahead
+        self.color = numpy.array([int(BURNIN_COLOR[i:i + 2], 16) for i in (0, 2, 4)], dtype=numpy.uint16)
+
+        self.tiles = []
+        self.frame_glyphs = {}
+        self.frame_anchor = None
+        for field, x, y, align, size_offset in BURNIN_LAYOUT:
+            anchor_x = int(x * self.out_width)
+            anchor_y = int(y * self.out_height)
+            if field == 'frame':
+                self.frame_anchor = (anchor_x, anchor_y, align)
+                self.frame_glyphs = self._render_glyphs(FRAME_CHARACTERS, self.font_size + size_offset)
+                continue
+            alpha = self._render_alpha(str(fields[field]), self.font_size + size_offset)
+            if alpha is None:
+                continue
+            if align == 'right':
+                anchor_x -= alpha.shape[1]
+            self._add_tile(self.tiles, alpha, anchor_x, anchor_y)
+
+    def _render_alpha(self, text, font_size):
+        """
+        Rasterizes text into an 8 bit coverage mask, top left at the top of the text.
+        :return: (height, width) uint16 array, None for empty text
+        """
+        if not text.strip():
+            return None
+        roi = OpenImageIO.ImageBufAlgo.text_size(text, font_size, self.font_path)
+        if not roi.defined or roi.width <= 0 or roi.height <= 0:
+            return None
+        mask = OpenImageIO.ImageBuf(OpenImageIO.ImageSpec(roi.width, roi.height, 1, OpenImageIO.FLOAT))
+        OpenImageIO.ImageBufAlgo.render_text(mask, -roi.xbegin, -roi.ybegin, text, font_size, self.font_path,
+                                             (1.0,))
+        pixels = mask.get_pixels(OpenImageIO.FLOAT).reshape(roi.height, roi.width)
+        return numpy.round(numpy.clip(pixels, 0.0, 1.0) * 255).astype(numpy.uint16)
+
+    def _render_glyphs(self, characters, font_size):
+        """
+        Renders the characters as one strip, so they share a baseline, and slices it per
+        character at the advance of each prefix.
+        :return: {character: alpha}
+        """
+        strip = self._render_alpha(characters, font_size)
+        origin = OpenImageIO.ImageBufAlgo.text_size(characters, font_size, self.font_path).xbegin
+        glyphs = {}
+        start = 0
+        for i, character in enumerate(characters):
+            end = OpenImageIO.ImageBufAlgo.text_size(characters[:i + 1], font_size, self.font_path).xend - origin
+            glyphs[character] = strip[:, start:max(start + 1, end)]
+            start = end
+        return glyphs
+
+    def _add_tile(self, tiles, alpha, x, y):
+        """
+        Clips a tile to the frame and stores it premultiplied, ready to blend.
+        """
+        x0, y0 = max(x, 0), max(y, 0)
+        x1 = min(x + alpha.shape[1], self.out_width)
+        y1 = min(y + alpha.shape[0], self.out_height)
+        if x1 <= x0 or y1 <= y0:
+            return
+        alpha = alpha[y0 - y:y1 - y, x0 - x:x1 - x, numpy.newaxis]
+        tiles.append((slice(y0, y1), slice(x0, x1), 255 - alpha, alpha * self.color))
+
+    def get_frame_tiles(self, frame):
+        text = str(frame)
+        glyphs = [self.frame_glyphs[character] for character in text if character in self.frame_glyphs]
+        if not glyphs:
+            return []
+        alpha = numpy.concatenate(glyphs, axis=1)
+        x, y, align = self.frame_anchor
+        if align == 'right':
+            x -= alpha.shape[1]
+        tiles = []
+        self._add_tile(tiles, alpha, x, y)
+        return tiles
+
+    def read_frame(self, path):
+        """
+        Decodes a frame into a padded (height, width, 3) uint8 array.
+        """
+        buf = OpenImageIO.ImageBuf(str(path))
+        spec = buf.spec()
+        pixels = buf.get_pixels(OpenImageIO.UINT8).reshape(spec.height, spec.width, spec.nchannels)
+        if spec.nchannels == 1:
+            pixels = numpy.repeat(pixels, 3, axis=2)
+        frame = numpy.zeros((self.out_height, self.out_width, 3), dtype=numpy.uint8)
+        height = min(spec.height, self.out_height)
+        width = min(spec.width, self.out_width)
+        frame[:height, :width] = pixels[:height, :width, :3]
+        return frame
+
+    def composite(self, frame, frame_number):
+        """
+        Blends the burn-in onto a frame in place.
+        """
+        for rows, columns, inverse_alpha, premultiplied in self.tiles + self.get_frame_tiles(frame_number):
+            region = frame[rows, columns]
+            region[...] = (region * inverse_alpha + premultiplied + 127) // 255
+        return frame
+
+    def _render(self, item):
+        path, frame_number = item
+        return self.composite(self.read_frame(path), frame_number)
+
+    def iter_frames(self, items):
+        """
+        Yields the composited frames in order, decoding up to read_ahead frames in parallel.
+        OpenImageIO releases the GIL while decoding, so threads are enough.
+        """
+        with futures.ThreadPoolExecutor(max_workers=self.read_ahead) as executor:
+            pending = collections.deque()
+            for item in items:
+                pending.append(executor.submit(self._render, item))
+                if len(pending) >= self.read_ahead:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def get_ffmpeg_args(self, frame_rate, mov_path, output_args=(), review=None):
+        args = [self.ffmpeg,
+                '-y',
+                '-nostats',
+                '-loglevel', 'error',
+                '-f', 'rawvideo',
+                '-pix_fmt', 'rgb24',
+                '-s', '{}x{}'.format(self.out_width, self.out_height),
+                '-framerate', str(frame_rate),
+                '-i', '-',
+                ]
+        if review:
+            args += ['-filter_complex', review.get_filter_graph('0:v', 'movie'), '-map', '[movie]']
+        if '-pix_fmt' not in output_args:
+            args += ['-pix_fmt', 'yuv420p']
+        args += list(output_args) + [mov_path]
+        if review:
+            args += review.get_output_args()
+        return args
+
+    def encode(self, items, frame_rate, mov_path, startupinfo=None, output_args=(), review=None, emitter=None,
+               register=None):
+        """
+        Encodes the burnt-in frames.
+        :param items: (image path, burnt-in frame number) in encode order, eg the slate first
+        :param frame_rate: frame rate of the movie
+        :param mov_path: movie to write
+        :param startupinfo: passed to subprocess.Popen
+        :param output_args: extra output args, eg the codec settings of a segment
+        :param review: optional ReviewMedia written from the same frames
+        :param emitter: optional callable receiving progress messages
+        :param register: optional callable receiving the FFmpegRunner before it starts, eg to cancel it
+        :return: number of frames encoded
+        """
+        runner = FFmpegRunner(self.get_ffmpeg_args(frame_rate, mov_path, output_args, review),
+                              total_frames=len(items),
+                              emitter=emitter,
+                              outputs=[mov_path] + (review.paths if review else []),
+                              stdin=True,
+                              startupinfo=startupinfo)
+        if register:
+            register(runner)
+        runner.start()
+        count = 0
+        try:
+            for frame in self.iter_frames(items):
+                if runner.cancelled:
+                    break
+                runner.stdin.write(frame.data)
+                count += 1
+                runner.report()
+            runner.stdin.close()
+        except (IOError, OSError):
+            # ffmpeg went away, wait() reports why
+            pass
+        except Exception:
+            runner.cancel()
+            raise
+
+        runner.wait()
+        return count
+
+
+def _write_test_frames(pattern, count, width, height):
+    for frame in range(1, count + 1):
+        buf = OpenImageIO.ImageBuf(OpenImageIO.ImageSpec(width, height, 3, OpenImageIO.UINT8))
+        shade = float(frame) / count
+        OpenImageIO.ImageBufAlgo.fill(buf, (shade, 0.2, 0.4), (0.1, shade, 0.6), (0.8, 0.3, shade), (0.2, 0.9, 0.1))
+        buf.write(pattern % frame)
+
+
+def _run_benchmark(resolutions, frame_count, ffmpeg, font_path):
+    fields = {'shot_name': 'sh010', 'project_name': 'benchmark', 'artist': 'artist', 'camera': 'shotCam',
+              'date': datetime.date.today()}
+    font_file = font_path.replace('\\', '/').replace(':', '\\:')
+    print('{:>6} {:>8} {:>14} {:>12} {:>8}'.format('res', 'frames', 'drawtext (s)', 'numpy (s)', 'speedup'))
+    for name in resolutions:
+        width, height = RESOLUTIONS[name]
+        work_dir = tempfile.mkdtemp(prefix='burnin_benchmark_')
+        try:
+            pattern = os.path.join(work_dir, 'pb.%04d.jpg')
+            _write_test_frames(pattern, frame_count, width, height)
+
+            start = time.time()
+            subprocess.check_call([ffmpeg, '-y', '-loglevel', 'error', '-start_number', '1', '-i', pattern,
+                                   '-vf', get_drawtext_filter(fields, 1, font_file, get_font_size(width)),
+                                   os.path.join(work_dir, 'drawtext.mov')])
+            drawtext_time = time.time() - start
+
+            start = time.time()
+            BurnIn(fields, width, height, font_path, ffmpeg=ffmpeg).encode(
+                [(pattern % frame, frame) for frame in range(1, frame_count + 1)], 24,
+                os.path.join(work_dir, 'numpy.mov'))
+            numpy_time = time.time() - start
+
+            print('{:>6} {:>8} {:>14.2f} {:>12.2f} {:>7.1f}x'.format(name, frame_count, drawtext_time, numpy_time,
+                                                                    drawtext_time / max(numpy_time, 1e-6)))
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Playblast burn-in tools.')
+    subparsers = parser.add_subparsers(dest='command')
+    benchmark_parser = subparsers.add_parser('benchmark', help='compare the drawtext and numpy burn-in')
+    benchmark_parser.add_argument('--resolutions', nargs='+', choices=sorted(RESOLUTIONS), default=['1K', '2K', '4K'])
+    benchmark_parser.add_argument('--frames', type=int, default=48)
+    benchmark_parser.add_argument('--ffmpeg', default=spawn.find_executable('ffmpeg'))
+    benchmark_parser.add_argument('--font', default=os.path.normpath(DEFAULT_FONT_PATH))
+    args = parser.parse_args(argv)
+
+    if args.command != 'benchmark':
+        parser.print_help()
+        return 1
+    if not is_available():
+        print('The numpy burn-in needs numpy and OpenImageIO')
+        return 1
+    _run_benchmark(args.resolutions, args.frames, args.ffmpeg, args.font)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,98 @@
+"""
+Python 2 fallbacks of the standard library parts the playblast uses.
+
+The app still runs in python 2 mayas, where concurrent.futures is only there when the
+futures backport is installed. Without it the executor below runs every job in the calling
+thread when it is submitted: the work is done serially, with the same results.
+
+    from .compat import futures, replace
+"""
+import os
+
+try:
+    from concurrent import futures
+except ImportError:
+    futures = None
+
+
+class SerialFuture(object):
+    """
+    Result of a job run by SerialExecutor, always done.
+    """
+
+    def __init__(self, fn, args, kwargs):
+        self._result = None
+        self._exception = None
+        try:
+            self._result = fn(*args, **kwargs)
+        except Exception as e:
+            self._exception = e
+
+    def done(self):
+        return True
+
+    def cancel(self):
+        return False
+
+    def exception(self, timeout=None):
+        return self._exception
+
+    def result(self, timeout=None):
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+
+class SerialExecutor(object):
+    """
+    The part of concurrent.futures.ThreadPoolExecutor the playblast uses, running jobs on submit.
+    """
+
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers
+
+    def submit(self, fn, *args, **kwargs):
+        return SerialFuture(fn, args, kwargs)
+
+    def map(self, fn, *iterables):
+        return [fn(*args) for args in zip(*iterables)]
+
+    def shutdown(self, wait=True):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+
+
+class _SerialFutures(object):
+    """
+    Stands in for the concurrent.futures module.
+    """
+    FIRST_COMPLETED = 'FIRST_COMPLETED'
+    FIRST_EXCEPTION = 'FIRST_EXCEPTION'
+    ALL_COMPLETED = 'ALL_COMPLETED'
+    ThreadPoolExecutor = SerialExecutor
+
+    @staticmethod
+    def wait(fs, timeout=None, return_when=ALL_COMPLETED):
+        # serial futures are done once submitted
+        return set(fs), set()
+
+
+if futures is None:
+    futures = _SerialFutures()
+
+
+def replace(source, dest):
+    """
+    os.replace, python 2 has no atomic rename over an existing file on windows.
+    """
+    if hasattr(os, 'replace'):
+        os.replace(source, dest)
+        return
+    if os.name == 'nt' and os.path.lexists(dest):
+        os.remove(dest)
+    os.rename(source, dest)
@@ -15,7 +15,7 @@ import glob
 import os
 import sys
 import tabulate
-import traceback
+import time
 import subprocess
 from functools import partial
 
@@ -32,6 +32,7 @@ import maya.cmds as cmds
 
 from .ui.dialog import Ui_Dialog
 from .playblast import PlayblastManager
+from .worker import LookupWorker, PostCaptureWorker
 
 logger = sgtk.platform.get_logger(__name__)
 camera_utils = sgtk.platform.import_framework("tvfx-maya-utils", "camera_utils")
@@ -69,6 +70,7 @@ class AppDialog(QtGui.QWidget):
         """
         Constructor
         """
+        self._open_time = time.time()
         # first, call the base class and let it do its thing.
         QtGui.QWidget.__init__(self, parent=parent)
 
@@ -80,6 +82,10 @@ class AppDialog(QtGui.QWidget):
         self.ui.status_bar.setSizeGripEnabled(False)
         self.ui.hl_control_layout_3.addWidget(self.ui.status_bar)
         self.ui.status_bar.showMessage('Ready to playblast', msecs=2000)
+        self.ui.lbl_upload_queue = QtGui.QLabel()
+        self.ui.status_bar.addPermanentWidget(self.ui.lbl_upload_queue)
+        self.ui.lbl_next_version = QtGui.QLabel()
+        self.ui.status_bar.addPermanentWidget(self.ui.lbl_next_version)
 
         # --- add resolution presets
         self.ui.tb_resolution_preset.hide()
@@ -88,6 +94,14 @@ class AppDialog(QtGui.QWidget):
         self.ui.cb_resolution.currentTextChanged.connect(self._toggle_custom_res_type)
         # self.ui.sb_res_w.valueChanged.connect(self.resolution_width_changed)
         self.ui.cb_pass_type.currentTextChanged.connect(self._toggle_custom_pass_type)
+        self.ui.cb_pass_type.currentTextChanged.connect(self._on_pass_type_change)
+        # the next version depends on the published path, looked up again once the fields settle
+        self._next_version_timer = QtCore.QTimer(self)
+        self._next_version_timer.setSingleShot(True)
+        self._next_version_timer.timeout.connect(self._on_next_version_fields_change)
+        self.ui.cb_format.currentIndexChanged.connect(lambda *args: self._next_version_timer.start(300))
+        self.ui.sb_res_w.valueChanged.connect(lambda *args: self._next_version_timer.start(300))
+        self.ui.sb_res_h.valueChanged.connect(lambda *args: self._next_version_timer.start(300))
         self.ui.cb_camera_type.currentTextChanged.connect(self._toggle_custom_camera_type)
         self.ui.le_pass_type_custom.setVisible(False)
         self.ui.le_camera_custom.setVisible(False)
@@ -103,6 +117,8 @@ class AppDialog(QtGui.QWidget):
         self.context = None
 
         self.pbMngr = PlayblastManager(self._app, self.context)
+        self._worker = None
+        self._pending_lookups = set()
         self.set_default_ui_data()
 
         # logging happens via a standard toolkit logger
@@ -120,6 +136,18 @@ class AppDialog(QtGui.QWidget):
         self._on_cb_auto_change()
         self._on_sb_change()
 
+        self._upload_timer = QtCore.QTimer(self)
+        self._upload_timer.timeout.connect(self._on_upload_timer)
+        self._upload_timer.start(2000)
+        self._on_upload_timer()
+
+        # runs once the window is shown and takes input
+        QtCore.QTimer.singleShot(0, self._on_interactive)
+
+    def _on_interactive(self):
+        self._app.logger.info("Playblast dialog interactive in {:.0f} ms".format(
+            (time.time() - self._open_time) * 1000))
+
     def _on_cb_anamorphic_change(self, val):
         self._app.logger.debug("Anamorphic: ".format(val))
         self.is_anamorphic = val
@@ -169,11 +197,33 @@ class AppDialog(QtGui.QWidget):
 
     def _on_cancel(self):
         """
-        Called when the cancel button is clicked
+        Called when the cancel button is clicked, cancels the running publish if there is one
         """
+        if self._worker:
+            self.ui.pb_cancel.setEnabled(False)
+            self.set_status('Cancelling playblast..', msecs=0)
+            self._worker.cancel()
+            return
+
         self._exit_code = QtGui.QDialog.Rejected
         self.close()
 
+    def _on_upload_timer(self):
+        """
+        Shows how many media uploads are still queued.
+        """
+        try:
+            counts = self.pbMngr.get_upload_counts()
+        except Exception as err:
+            self._app.logger.debug("Could not read the upload queue: {}".format(err))
+            counts = {}
+        depth = counts.get('pending', 0) + counts.get('uploading', 0)
+        message = 'Uploads queued: {}'.format(depth) if depth else ''
+        if counts.get('failed'):
+            message = '{}{}Uploads failed: {}'.format(message, ', ' if message else '', counts['failed'])
+        self.ui.lbl_upload_queue.setText(message)
+        self.ui.lbl_upload_queue.setVisible(bool(message))
+
     def set_status(self, message, msecs=1460, log=True):
         if self.ui.status_bar:
             if log:
@@ -265,30 +315,17 @@ class AppDialog(QtGui.QWidget):
     def set_default_ui_data(self):
         """
         method to set defaults in ui to minimize user input.
+        The maya side defaults are set at once, the Shotgun ones show placeholders until their
+        lookups, started by start_lookups, arrive.
         :return:
         """
         try:
-            # FRAME RANGE: from maya scene
-            start_frame, end_frame, self.is_anamorphic = self.pbMngr.get_frame_range()
-            if self.is_anamorphic:
-                self.ui.cb_anamorphic.setChecked(True)
-            self._app.logger.info("set_default_ui_data: start_frame, end_frame = {0}, {1}".format(start_frame,
-                                                                                                  end_frame))
-            self.ui.le_frame_start.setText(str(start_frame))
-
-            self.ui.le_frame_end.setText(str(end_frame))
-
-            # getting default values for yaml file
-            camera_type_value, pass_type, frame_padding, scale = self.pbMngr.get_defaults_values()
-
-            # SCALE:
-            self.ui.sb_scale.setValue(scale)
+            # FRAME RANGE: from the shot, see _apply_frame_range
+            self.is_anamorphic = False
+            self.ui.le_frame_start.setPlaceholderText('...')
+            self.ui.le_frame_end.setPlaceholderText('...')
             self.hide_elements()
 
-            # FRAME PADDING: how many frames before the start frame
-            self.ui.sb_padding.setValue(frame_padding)
-            # self.ui.sb_padding.setVisible(False)
-
             self.ui.le_focal_length.setText(self.pbMngr.get_focal_length_min_max())
             self.ui.le_focal_length.setEnabled(False)
 
@@ -299,14 +336,6 @@ class AppDialog(QtGui.QWidget):
             # FORMAT: default playblast format is set to movie as of now
             self.ui.cb_format.setCurrentIndex(0)
 
-            # pass type
-            self.ui.cb_pass_type.setCurrentText(pass_type)
-            self.pbMngr.set_pass_type(str(self.ui.cb_pass_type.currentText()).lower())
-
-            # camera type
-            self.ui.cb_camera_type.setCurrentText(camera_type_value)
-            self.pbMngr.set_camera_type(str(self.ui.cb_camera_type.currentText()))
-
             # description
             context = self.pbMngr.get_context()
 
@@ -318,8 +347,110 @@ class AppDialog(QtGui.QWidget):
                 "set_default_ui_data: playblast for {0}, {1}".format(context.entity, context.project))
 
         except Exception as err:
-            print(traceback.format_exc())
-            self._app.logger.debug("Could not set the ui defaults: {}".format(err))
+            self._app.logger.exception("Could not set the ui defaults: {}".format(err))
+
+        self.start_lookups()
+
+    def start_lookups(self):
+        """
+        Starts the Shotgun lookups of the dialog together on pool threads. The playblast button
+        waits for the frame range and the client defaults, the next version is looked up once the
+        pass type and the plate name are known.
+        """
+        self.ui.createPlayblast.setEnabled(False)
+        self.start_lookup('frame_range', self.pbMngr.get_shot_info)
+        self.start_lookup('defaults', self.pbMngr.get_defaults_values)
+        self.start_lookup('plate_name', self.pbMngr.get_plate_name)
+
+    def start_lookup(self, name, lookup):
+        worker = LookupWorker(name, lookup)
+        worker.signals.finished.connect(self._on_lookup_finished)
+        worker.signals.failed.connect(self._on_lookup_failed)
+        self._pending_lookups.add(name)
+        worker.start()
+
+    def get_next_version_fields(self):
+        """
+        Returns the ui values the published path of the next version depends on.
+        """
+        width, height = self.get_res()
+        return self.pass_type, str(self.ui.cb_format.currentText()), int(width), int(height)
+
+    def start_next_version_lookup(self):
+        # read on the gui thread, the lookup runs on a pool thread
+        fields = self.get_next_version_fields()
+        self.ui.lbl_next_version.setText('')
+        self.start_lookup('next_version', lambda: (fields, self.pbMngr.get_next_version(*fields)))
+
+    def _on_lookup_finished(self, name, result, seconds):
+        self._app.logger.debug("Lookup {} took {:.0f} ms".format(name, seconds * 1000))
+        try:
+            getattr(self, '_apply_{}'.format(name))(result)
+        except Exception as err:
+            self._app.logger.exception("Could not set the ui defaults of {}: {}".format(name, err))
+        self._on_lookup_done(name)
+
+    def _on_lookup_failed(self, name, message, seconds):
+        self._app.logger.debug("Could not look up {}: {}".format(name, message.strip().splitlines()[-1]))
+        self._on_lookup_done(name)
+
+    def _on_lookup_done(self, name):
+        self._pending_lookups.discard(name)
+        if name in ('defaults', 'plate_name') and not self._pending_lookups & {'defaults', 'plate_name'}:
+            self.start_next_version_lookup()
+        if not self._pending_lookups & {'frame_range', 'defaults'} and not self._worker:
+            self.ui.createPlayblast.setEnabled(True)
+        if not self._pending_lookups:
+            cache = self.pbMngr.sg_cache
+            self._app.logger.info("Playblast dialog defaults loaded in {:.0f} ms{}".format(
+                (time.time() - self._open_time) * 1000,
+                ', {} lookups from the cache'.format(cache.hits) if cache else ''))
+
+    def _apply_frame_range(self, shot_info):
+        start_frame, end_frame, self.is_anamorphic = self.pbMngr.get_frame_range(shot_info)
+        if self.is_anamorphic:
+            self.ui.cb_anamorphic.setChecked(True)
+        self._app.logger.info("set_default_ui_data: start_frame, end_frame = {0}, {1}".format(start_frame,
+                                                                                              end_frame))
+        self.ui.le_frame_start.setText(str(start_frame))
+        self.ui.le_frame_end.setText(str(end_frame))
+
+    def _apply_defaults(self, defaults):
+        # getting default values for yaml file
+        camera_type_value, pass_type, frame_padding, scale = defaults
+
+        # SCALE: the auto scale wins when on
+        self.ui.sb_scale.setValue(scale)
+        self._on_cb_auto_change()
+
+        # FRAME PADDING: how many frames before the start frame
+        self.ui.sb_padding.setValue(frame_padding)
+
+        # pass type
+        self.ui.cb_pass_type.setCurrentText(pass_type)
+        self.pbMngr.set_pass_type(str(self.ui.cb_pass_type.currentText()).lower())
+
+        # camera type
+        self.ui.cb_camera_type.setCurrentText(camera_type_value)
+        self.pbMngr.set_camera_type(str(self.ui.cb_camera_type.currentText()))
+
+    def _apply_plate_name(self, plate_name):
+        self.pbMngr.plate_name = plate_name
+
+    def _apply_next_version(self, result):
+        fields, version = result
+        # a lookup of fields changed since
+        if fields == self.get_next_version_fields():
+            self.ui.lbl_next_version.setText('Next version: v{:03d}'.format(version))
+
+    def _on_pass_type_change(self, val):
+        if val != 'Custom':
+            self._on_next_version_fields_change()
+
+    def _on_next_version_fields_change(self):
+        # the next version of the initial fields is looked up with the defaults
+        if not self._pending_lookups & {'defaults', 'plate_name'}:
+            self.start_next_version_lookup()
 
     @property
     def camera_type(self):
@@ -436,7 +567,36 @@ class AppDialog(QtGui.QWidget):
 
         # self.ui.status_bar.showMessage('User input gathered', msecs=2000)
         self.set_status('Playblast in process')
-        playblastFile, entity = self.pbMngr.createPlayblast(overridePlayblastParams)
+        capture = self.pbMngr.capture_playblast(overridePlayblastParams)
+        if self.pbMngr.publish_daemon:
+            job_id = self.pbMngr.submit_publish_job(capture)
+            self.set_status('')
+            QtGui.QMessageBox.information(self, 'Playblast queued:',
+                                          'Publishing {} in the background, Maya can be closed.\n\nJob: {}'.format(
+                                              os.path.basename(self.pbMngr.playblastPath), job_id))
+            return
+
+        # maya is free from here, the publish runs on a pool thread
+        self.set_status('Capture done, publishing playblast..')
+        self.ui.createPlayblast.setEnabled(False)
+        self._worker = PostCaptureWorker(self.pbMngr, capture)
+        self._worker.signals.progress.connect(self._on_publish_progress)
+        self._worker.signals.finished.connect(self._on_publish_finished)
+        self._worker.signals.failed.connect(self._on_publish_failed)
+        self._worker.signals.cancelled.connect(self._on_publish_cancelled)
+        self._worker.start()
+
+    def _on_publish_progress(self, message):
+        self.set_status(message, msecs=0)
+
+    def _on_publish_done(self):
+        self._worker = None
+        self.ui.createPlayblast.setEnabled(not self._pending_lookups & {'frame_range', 'defaults'})
+        self.ui.pb_cancel.setEnabled(True)
+
+    def _on_publish_finished(self, result):
+        self._on_publish_done()
+        playblastFile, entity = result
         self.set_status('')
         QtGui.QMessageBox.information(self, 'Playblast created:',
                                       'New Version: {}'.format(os.path.basename(playblastFile)))
@@ -453,6 +613,15 @@ class AppDialog(QtGui.QWidget):
         #     elif os.name == 'nt':
         #         os.startfile(url)
 
+    def _on_publish_failed(self, message):
+        self._on_publish_done()
+        self.set_status('Playblast failed', log=False)
+        QtGui.QMessageBox.critical(self, 'Playblast failed', message.strip().splitlines()[-1])
+
+    def _on_publish_cancelled(self):
+        self._on_publish_done()
+        self.set_status('Playblast cancelled')
+
     def hide_elements(self, value=False):
         self.ui.le_frame_start.setVisible(value)
         self.ui.le_frame_end.setVisible(value)
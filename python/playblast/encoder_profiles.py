@@ -0,0 +1,136 @@
+"""
+Named ffmpeg encoder profiles for the playblast movie.
+
+Profiles are declared under encoder_profiles in resources/defaults.yml and picked per
+client with the encoder_profile key of the client spec. A profile maps to ffmpeg output
+args once, the compiled args are cached by name and settings.
+
+    python encoder_profiles.py benchmark --frames 240 --size 1920x1080
+
+encodes a synthetic sequence with every profile and reports encode fps and file size.
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from distutils import spawn
+
+DEFAULT_PROFILE = 'review'
+DEFAULTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'resources', 'defaults.yml')
+
+# profile key, ffmpeg output option, in the order they are emitted
+PROFILE_OPTIONS = (
+    ('codec', '-c:v'),
+    ('preset', '-preset'),
+    ('tune', '-tune'),
+    ('profile', '-profile:v'),
+    ('crf', '-crf'),
+    ('qscale', '-q:v'),
+    ('bitrate', '-b:v'),
+    ('gop', '-g'),
+    ('pix_fmt', '-pix_fmt'),
+    ('threads', '-threads'),
+)
+
+_compiled_profiles = {}
+
+
+class EncoderProfile(object):
+    """
+    An encoder profile and its ffmpeg output args.
+    """
+
+    def __init__(self, name, settings):
+        """
+        Construction
+        :param name: profile name
+        :param settings: dict of PROFILE_OPTIONS keys, plus an optional extra_args list
+        """
+        self.name = name
+        self.settings = dict(settings or {})
+        self.args = self.compile(self.settings)
+
+    @staticmethod
+    def compile(settings):
+        args = []
+        for key, option in PROFILE_OPTIONS:
+            if settings.get(key) is not None:
+                args += [option, str(settings[key])]
+        args += [str(arg) for arg in settings.get('extra_args') or []]
+        return args
+
+    @property
+    def pix_fmt(self):
+        return self.settings.get('pix_fmt')
+
+    def __repr__(self):
+        return '<EncoderProfile {} {}>'.format(self.name, ' '.join(self.args))
+
+
+def get_profile(name, profiles):
+    """
+    Returns the compiled profile, an empty profile (ffmpeg defaults) when it is not declared.
+    :param name: profile name
+    :param profiles: the encoder_profiles mapping of defaults.yml
+    """
+    settings = (profiles or {}).get(name) or {}
+    key = (name, repr(sorted(settings.items())))
+    if key not in _compiled_profiles:
+        _compiled_profiles[key] = EncoderProfile(name, settings)
+    return _compiled_profiles[key]
+
+
+def load_profiles(path=DEFAULTS_PATH):
+    try:
+        from tank_vendor import yaml
+    except ImportError:
+        import yaml
+    with open(path) as fh:
+        return yaml.safe_load(fh).get('encoder_profiles') or {}
+
+
+def _run_benchmark(profiles, names, frame_count, size, frame_rate, ffmpeg):
+    print('{:<16} {:>10} {:>12} {:>12}'.format('profile', 'fps', 'size (MB)', 'seconds'))
+    work_dir = tempfile.mkdtemp(prefix='encoder_benchmark_')
+    try:
+        for name in names:
+            profile = get_profile(name, profiles)
+            mov_path = os.path.join(work_dir, '{}.mov'.format(name))
+            args = [ffmpeg, '-y', '-nostats', '-loglevel', 'error',
+                    '-f', 'lavfi',
+                    '-i', 'testsrc2=size={}:rate={}'.format(size, frame_rate),
+                    '-frames:v', str(frame_count)] + profile.args + [mov_path]
+            start = time.time()
+            subprocess.check_call(args)
+            seconds = time.time() - start
+            print('{:<16} {:>10.1f} {:>12.2f} {:>12.2f}'.format(name, frame_count / max(seconds, 1e-6),
+                                                                os.path.getsize(mov_path) / 1024.0 ** 2, seconds))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Playblast encoder profile tools.')
+    subparsers = parser.add_subparsers(dest='command')
+    benchmark_parser = subparsers.add_parser('benchmark', help='encode a synthetic sequence with each profile')
+    benchmark_parser.add_argument('--defaults', default=os.path.normpath(DEFAULTS_PATH))
+    benchmark_parser.add_argument('--profiles', nargs='+', help='profiles to run, all by default')
+    benchmark_parser.add_argument('--frames', type=int, default=240)
+    benchmark_parser.add_argument('--size', default='1920x1080')
+    benchmark_parser.add_argument('--frame-rate', type=int, default=24)
+    benchmark_parser.add_argument('--ffmpeg', default=spawn.find_executable('ffmpeg'))
+    args = parser.parse_args(argv)
+
+    if args.command != 'benchmark':
+        parser.print_help()
+        return 1
+    profiles = load_profiles(args.defaults)
+    _run_benchmark(profiles, args.profiles or sorted(profiles), args.frames, args.size, args.frame_rate, args.ffmpeg)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,230 @@
+"""
+Runs ffmpeg with machine readable progress.
+
+ffmpeg is started with -nostats -progress pipe:1, so it writes key=value blocks
+(frame, fps, speed, out_time, progress) to stdout. A reader thread parses them as they
+come and a second one keeps only the last lines of stderr for error reports, so a long
+encode never buffers its whole log in memory.
+
+Progress is reported through the emitter from the thread that waits on the runner,
+never from the reader threads, so an emitter that touches Qt widgets stays safe.
+
+cancel() kills the whole process tree and removes the partial outputs.
+"""
+import collections
+import os
+import signal
+import subprocess
+import threading
+import time
+
+PROGRESS_INTERVAL = 0.5
+POLL_INTERVAL = 0.1
+STDERR_LINES = 200
+
+
+class FFmpegError(RuntimeError):
+    """
+    ffmpeg exited with an error, the message holds the tail of its stderr.
+    """
+
+    def __init__(self, message, returncode=None, stderr=''):
+        super(FFmpegError, self).__init__(message)
+        self.returncode = returncode
+        self.stderr = stderr
+
+
+class FFmpegCancelled(FFmpegError):
+    """
+    The encode was cancelled.
+    """
+
+
+def format_duration(seconds):
+    seconds = int(max(0, seconds))
+    return '{}:{:02d}:{:02d}'.format(seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+class ProgressReporter(object):
+    """
+    Formats frame progress into throttled status messages.
+    """
+
+    def __init__(self, emitter, label, total_frames=None, interval=PROGRESS_INTERVAL):
+        """
+        Construction
+        :param emitter: callable receiving the messages
+        :param label: message prefix, eg Encoding movie
+        :param total_frames: frames expected, enables percentage and ETA
+        :param interval: minimum seconds between two messages
+        """
+        self.emitter = emitter
+        self.label = label
+        self.total_frames = total_frames
+        self.interval = interval
+        self.start_time = time.time()
+        self._last_report = 0
+        self._last_frame = None
+
+    def report(self, frame, fps=None, speed=None, force=False):
+        now = time.time()
+        if frame == self._last_frame or (not force and now - self._last_report < self.interval):
+            return
+        self._last_report = now
+        self._last_frame = frame
+
+        if fps is None:
+            elapsed = now - self.start_time
+            fps = frame / elapsed if elapsed > 0 else 0.0
+        message = '{}: {}'.format(self.label, frame)
+        if self.total_frames:
+            message += '/{} frames ({:.0f}%)'.format(self.total_frames, 100.0 * min(frame, self.total_frames) /
+                                                    self.total_frames)
+        else:
+            message += ' frames'
+        message += ', {:.1f} fps'.format(fps)
+        if speed:
+            message += ', {}'.format(speed)
+        if self.total_frames and fps > 0 and frame < self.total_frames:
+            message += ', ETA {}'.format(format_duration((self.total_frames - frame) / fps))
+        self.emitter(message)
+
+
+class FFmpegRunner(object):
+    """
+    One ffmpeg process with progress parsing, bounded stderr and cancellation.
+    """
+
+    def __init__(self, args, total_frames=None, emitter=None, label='Encoding movie', outputs=None, stdin=False,
+                 startupinfo=None, logger=None):
+        """
+        Construction
+        :param args: ffmpeg command line, executable first and the main output last
+        :param total_frames: frames the encode is expected to write
+        :param emitter: callable receiving progress messages, None for no progress
+        :param label: progress message prefix
+        :param outputs: files removed when the encode fails or is cancelled, the last arg by default
+        :param stdin: open a pipe to feed ffmpeg, see the stdin property
+        :param startupinfo: passed to subprocess.Popen
+        :param logger: optional logger
+        """
+        args = [arg for arg in args if arg != '-nostats']
+        self.args = args[:1] + ['-nostats', '-progress', 'pipe:1'] + args[1:]
+        self.outputs = outputs if outputs is not None else args[-1:]
+        self.use_stdin = stdin
+        self.startupinfo = startupinfo
+        self.logger = logger
+        self.reporter = ProgressReporter(emitter, label, total_frames) if emitter else None
+
+        self.proc = None
+        self.frame = 0
+        self.fps = None
+        self.speed = None
+        self.out_time = None
+        self.stderr_tail = collections.deque(maxlen=STDERR_LINES)
+        self.cancelled = False
+        self._readers = []
+
+    @property
+    def stdin(self):
+        return self.proc.stdin
+
+    def start(self):
+        if self.cancelled:
+            raise FFmpegCancelled("Encode cancelled")
+        if self.logger:
+            self.logger.debug("FFmpegRunner: {}".format(' '.join(self.args)))
+        kwargs = {}
+        if os.name == 'nt':
+            kwargs['creationflags'] = subprocess.CREATE_NEW_PROCESS_GROUP
+        else:
+            # own process group, so cancel can kill everything ffmpeg started
+            kwargs['preexec_fn'] = os.setsid
+        self.proc = subprocess.Popen(self.args,
+                                     startupinfo=self.startupinfo,
+                                     stdin=subprocess.PIPE if self.use_stdin else None,
+                                     stdout=subprocess.PIPE,
+                                     stderr=subprocess.PIPE,
+                                     **kwargs)
+        self._readers = [threading.Thread(target=self._read_progress, name='ffmpeg_progress'),
+                         threading.Thread(target=self._read_stderr, name='ffmpeg_stderr')]
+        for reader in self._readers:
+            reader.daemon = True
+            reader.start()
+        return self
+
+    def _read_progress(self):
+        block = {}
+        for line in iter(self.proc.stdout.readline, b''):
+            key, _, value = line.decode('utf-8', 'replace').strip().partition('=')
+            block[key] = value
+            if key != 'progress':
+                continue
+            try:
+                self.frame = int(block.get('frame', self.frame))
+                self.fps = float(block['fps']) if block.get('fps') else None
+            except ValueError:
+                pass
+            self.speed = block.get('speed', '').strip() or None
+            self.out_time = block.get('out_time')
+            block = {}
+
+    def _read_stderr(self):
+        for line in iter(self.proc.stderr.readline, b''):
+            self.stderr_tail.append(line.decode('utf-8', 'replace').rstrip())
+
+    def get_stderr(self):
+        return '\n'.join(self.stderr_tail)
+
+    def report(self, force=False):
+        if self.reporter:
+            self.reporter.report(self.frame, self.fps or None, self.speed, force)
+
+    def wait(self):
+        """
+        Waits for ffmpeg, reporting progress from the calling thread.
+        :return: number of frames ffmpeg reported
+        """
+        while self.proc.poll() is None:
+            time.sleep(POLL_INTERVAL)
+            self.report()
+        for reader in self._readers:
+            reader.join()
+
+        if self.cancelled:
+            raise FFmpegCancelled("Encode cancelled", self.proc.returncode, self.get_stderr())
+        if self.proc.returncode != 0:
+            self.remove_outputs()
+            raise FFmpegError("ffmpeg exited with {}:\n{}".format(self.proc.returncode, self.get_stderr()),
+                              self.proc.returncode, self.get_stderr())
+        self.report(force=True)
+        return self.frame
+
+    def run(self):
+        return self.start().wait()
+
+    def cancel(self):
+        """
+        Kills ffmpeg and anything it started, then removes the partial outputs.
+        """
+        self.cancelled = True
+        if self.proc is None or self.proc.poll() is not None:
+            return
+        if os.name == 'nt':
+            subprocess.call(['taskkill', '/F', '/T', '/PID', str(self.proc.pid)], startupinfo=self.startupinfo,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        else:
+            try:
+                os.killpg(self.proc.pid, signal.SIGKILL)
+            except OSError:
+                self.proc.kill()
+        self.proc.wait()
+        self.remove_outputs()
+
+    def remove_outputs(self):
+        for path in self.outputs:
+            try:
+                if os.path.exists(path):
+                    os.remove(path)
+            except OSError:
+                pass
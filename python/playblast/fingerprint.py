@@ -0,0 +1,313 @@
+"""
+Per-frame fingerprints of the evaluated scene, used to re-capture only the frames
+that changed since the previous playblast version.
+
+A frame fingerprint hashes, evaluated at that frame:
+
+    the world matrix and visibility of every DAG node     constraints, expressions, driven keys,
+                                                           anim layers and non-keyed edits of the
+                                                           hierarchy all end up in them
+    the plugs of other nodes driven by an anim curve,      eg deformer weights, shape and shader
+    an anim layer blend, a pair blend or an expression     attributes
+    the camera matrix and focal length
+
+and, once for the run, the bounding box of every shape and the keyable values of the
+deformers and materials, so non-keyed edits of those show up too. Scenes whose frames
+depend on something those can not see, eg a geometry cache or a simulation, have no
+fingerprints and are always captured in full.
+
+The values are read through the maya API in an evaluation context of each frame, a few
+microseconds per plug. maya.cmds is passed in rather than imported, and without the API
+the plugs are read with cmds.getAttr, so the fingerprints and the carry forward step
+can be exercised with a mocked cmds module, see tests/test_fingerprint.py.
+"""
+import hashlib
+import json
+import os
+
+from .transfer import build_transfer_plan
+
+FINGERPRINT_PRECISION = 6
+# nodes whose outputs change with time, the plugs they drive are hashed per frame
+DRIVER_TYPES = ('animCurve', 'animBlendNodeBase', 'pairBlend', 'expression')
+# nodes changing the image in ways the fingerprint can not see, the frames are always captured
+UNSUPPORTED_TYPES = ('cacheFile', 'AlembicNode', 'gpuCache', 'nucleus', 'particle', 'fluidShape', 'hairSystem')
+
+
+def _round_values(value):
+    if isinstance(value, float):
+        return round(value, FINGERPRINT_PRECISION)
+    if isinstance(value, (list, tuple)):
+        return [_round_values(v) for v in value]
+    return value
+
+
+def _ls(cmds, **kwargs):
+    try:
+        return cmds.ls(**kwargs) or []
+    except RuntimeError:
+        # a type of a plugin that is not loaded
+        return []
+
+
+class CmdsSampler(object):
+    """
+    Reads plugs at a frame with cmds.getAttr.
+    """
+
+    def __init__(self, cmds, plugs):
+        self.cmds = cmds
+        self.plugs = plugs
+
+    def sample(self, frame):
+        return [self.cmds.getAttr(plug, time=frame) for plug in self.plugs]
+
+
+class ApiSampler(object):
+    """
+    Reads plugs at a frame through the maya API, in a DG context of the frame.
+    """
+
+    def __init__(self, plugs):
+        import maya.api.OpenMaya as om
+
+        self.om = om
+        selection = om.MSelectionList()
+        for plug in plugs:
+            selection.add(plug)
+        self.plugs = [(selection.getPlug(index), plug.endswith('Matrix[0]')) for index, plug in enumerate(plugs)]
+
+    def _read(self, plug, is_matrix, context):
+        if is_matrix:
+            return list(self.om.MFnMatrixData(plug.asMObject(context)).matrix())
+        try:
+            return plug.asDouble(context)
+        except RuntimeError:
+            # not numeric, eg a string attribute driven by an expression
+            return plug.asString(context)
+
+    def sample(self, frame):
+        context = self.om.MDGContext(self.om.MTime(frame, self.om.MTime.uiUnit()))
+        return [self._read(plug, is_matrix, context) for plug, is_matrix in self.plugs]
+
+
+def get_sampler(cmds, plugs):
+    """
+    Returns the sampler of plugs, through the API in maya, cmds.getAttr otherwise.
+    """
+    try:
+        import maya.api.OpenMaya  # noqa: F401
+    except ImportError:
+        return CmdsSampler(cmds, plugs)
+    return ApiSampler(plugs)
+
+
+class FrameFingerprinter(object):
+    """
+    Hashes the evaluated DAG, the driven plugs and the camera at each frame.
+    """
+
+    def __init__(self, cmds, camera_shape, settings=None, sampler_factory=get_sampler):
+        """
+        Construction
+        :param cmds: the maya.cmds module (or a stand-in)
+        :param camera_shape: camera shape the playblast is captured through
+        :param settings: dict of capture settings, any change invalidates every frame
+        :param sampler_factory: callable(cmds, plugs) returning an object whose sample(frame) reads the plugs
+        """
+        self.cmds = cmds
+        self.camera_shape = camera_shape
+        self.settings = settings or {}
+        self.sampler_factory = sampler_factory
+        self._plugs = None
+        self._sampler = None
+        self._static_hash = None
+
+    @property
+    def settings_hash(self):
+        return hashlib.sha1(json.dumps(self.settings, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def get_unsupported_nodes(self):
+        """
+        Returns the nodes driving the image in ways the fingerprint can not see: caches,
+        simulations and other nodes reading the time but expressions.
+        """
+        nodes = set()
+        for node_type in UNSUPPORTED_TYPES:
+            nodes.update(_ls(self.cmds, type=node_type))
+        time_nodes = self.cmds.listConnections('time1.outTime', source=False, destination=True,
+                                               skipConversionNodes=True) or []
+        handled = set(_ls(self.cmds, type=list(DRIVER_TYPES)))
+        nodes.update(node for node in time_nodes if node not in handled)
+        return sorted(nodes)
+
+    def get_dag_plugs(self):
+        """
+        Returns the world matrix and visibility of the DAG: transforms and shapes that are not
+        intermediate objects.
+        """
+        plugs = []
+        for transform in sorted(_ls(self.cmds, type='transform', long=True)):
+            plugs += [transform + '.worldMatrix[0]', transform + '.visibility']
+        for shape in sorted(_ls(self.cmds, shapes=True, noIntermediate=True, long=True)):
+            plugs.append(shape + '.visibility')
+        return plugs
+
+    def get_driven_plugs(self):
+        """
+        Returns the plugs of nodes outside of the DAG hierarchy driven by anim curves, anim
+        layers, pair blends or expressions. Transforms are left out, their world matrix is hashed.
+        """
+        drivers = set(_ls(self.cmds, type=list(DRIVER_TYPES)))
+        plugs = set()
+        for driver in drivers:
+            plugs.update(self.cmds.listConnections(driver, plugs=True, source=False, destination=True,
+                                                   skipConversionNodes=True) or [])
+        skipped = drivers | set(_ls(self.cmds, type='transform'))
+        return sorted(plug for plug in plugs if plug.split('.')[0] not in skipped)
+
+    def get_plugs(self):
+        """
+        Returns every plug hashed per frame, sorted so the hash is stable.
+        """
+        if self._plugs is None:
+            plugs = self.get_dag_plugs() + self.get_driven_plugs()
+            if self.camera_shape:
+                plugs.append(self.camera_shape + '.focalLength')
+            self._plugs = plugs
+        return self._plugs
+
+    def get_static_hash(self):
+        """
+        Hashes, once for the run, the bounding box of every shape and the keyable values of the
+        deformers and materials, which sees the non-keyed edits of the geometry and shading.
+        """
+        if self._static_hash is None:
+            values = []
+            for shape in sorted(_ls(self.cmds, shapes=True, noIntermediate=True, long=True)):
+                values.append((shape, _round_values(self.cmds.getAttr(shape + '.boundingBoxMin')),
+                               _round_values(self.cmds.getAttr(shape + '.boundingBoxMax'))))
+            for node in sorted(set(_ls(self.cmds, type='geometryFilter') + _ls(self.cmds, materials=True))):
+                for attr in self.cmds.listAttr(node, keyable=True, scalar=True) or []:
+                    try:
+                        values.append((node, attr, _round_values(self.cmds.getAttr('{}.{}'.format(node, attr)))))
+                    except (RuntimeError, ValueError):
+                        continue
+            self._static_hash = hashlib.sha1(json.dumps(values).encode('utf-8')).hexdigest()
+        return self._static_hash
+
+    def fingerprint(self, frame):
+        """
+        Returns the fingerprint of one frame.
+        """
+        if self._sampler is None:
+            self._sampler = self.sampler_factory(self.cmds, self.get_plugs())
+        values = [self.settings_hash, self.get_static_hash()]
+        values += list(zip(self.get_plugs(), _round_values(self._sampler.sample(frame))))
+        return hashlib.sha1(json.dumps(values).encode('utf-8')).hexdigest()
+
+    def fingerprint_range(self, start, end):
+        """
+        Returns {frame: fingerprint} for the inclusive range, None when the scene has nodes
+        the fingerprint can not see, see get_unsupported_nodes.
+        """
+        if self.get_unsupported_nodes():
+            return None
+        return dict((frame, self.fingerprint(frame)) for frame in range(start, end + 1))
+
+
+class FingerprintStore(object):
+    """
+    The fingerprints of one playblast version, saved next to its .source frames.
+    """
+    FILE_NAME = '.fingerprints.json'
+
+    def __init__(self, fingerprints, frame_pattern, directory=None):
+        """
+        Construction
+        :param fingerprints: {frame: fingerprint}
+        :param frame_pattern: printf style basename of the frames, eg shot_v003.%04d.jpg
+        :param directory: directory holding the frames
+        """
+        self.fingerprints = dict((int(frame), value) for frame, value in fingerprints.items())
+        self.frame_pattern = frame_pattern
+        self.directory = directory
+
+    @classmethod
+    def load(cls, directory):
+        """
+        Loads the store of a version, None if the version has none.
+        """
+        if not directory:
+            return None
+        path = os.path.join(directory, cls.FILE_NAME)
+        if not os.path.isfile(path):
+            return None
+        try:
+            with open(path) as fh:
+                data = json.load(fh)
+            return cls(data['frames'], data['frame_pattern'], directory)
+        except (IOError, OSError, ValueError, KeyError):
+            return None
+
+    def save(self, directory=None):
+        self.directory = directory or self.directory
+        data = {
+            'frame_pattern': self.frame_pattern,
+            'frames': dict((str(frame), value) for frame, value in self.fingerprints.items()),
+        }
+        with open(os.path.join(self.directory, self.FILE_NAME), 'w') as fh:
+            json.dump(data, fh, indent=1, sort_keys=True)
+
+    def get_frame_path(self, frame):
+        return os.path.join(self.directory, self.frame_pattern % frame)
+
+    def split_frames(self, fingerprints):
+        """
+        Splits frames into the ones that need capturing and the ones that can be carried
+        forward from this version: same fingerprint and the frame is still on disk.
+        :param fingerprints: {frame: fingerprint} of the new run
+        :return: (changed frames, unchanged frames), both sorted
+        """
+        changed = []
+        unchanged = []
+        for frame in sorted(fingerprints):
+            if self.fingerprints.get(frame) == fingerprints[frame] and os.path.exists(self.get_frame_path(frame)):
+                unchanged.append(frame)
+            else:
+                changed.append(frame)
+        return changed, unchanged
+
+
+def carry_forward_frames(frames, capture_pattern, dest_pattern, copy_file, previous_store=None, unchanged=(),
+                         carry_file=None, runner=None):
+    """
+    Publishes the frames of a run: changed frames come from the fresh capture,
+    unchanged frames from the previous version.
+    :param frames: every frame of the range
+    :param capture_pattern: printf style path of the captured frames
+    :param dest_pattern: printf style path of the published frames
+    :param copy_file: callable(source, dest, size)
+    :param previous_store: FingerprintStore of the previous version
+    :param unchanged: frames taken from previous_store, see FingerprintStore.split_frames
+    :param carry_file: callable(source, dest, size) for the frames of the previous version,
+                       defaults to copy_file
+    :param runner: callable executing the transfer plan, eg BulkTransfer.run, serial by default
+    :return: number of frames carried forward
+    """
+    carried = set(unchanged) if previous_store is not None else set()
+    plan = []
+    if capture_pattern != dest_pattern:
+        plan += build_transfer_plan([frame for frame in frames if frame not in carried],
+                                    capture_pattern, dest_pattern, copy_file)
+    if carried:
+        plan += build_transfer_plan(sorted(carried),
+                                    os.path.join(previous_store.directory, previous_store.frame_pattern),
+                                    dest_pattern, carry_file or copy_file)
+
+    if runner:
+        runner(plan)
+    else:
+        for source, dest, size, publish in plan:
+            publish(source, dest, size)
+    return len(carried)
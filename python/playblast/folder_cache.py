@@ -0,0 +1,201 @@
+"""
+Session memo of the folder creation and template fields behind the publish paths.
+
+format_output_path ran create_filesystem_structure for the task and as_template_fields for
+its template on every call, twice per image playblast. Both walk the folder schema, query
+the path cache and stat the filesystem, and their results only change when folders are
+created or the configuration changes.
+
+FolderCache remembers, per tk instance:
+
+    ensure_folders()        the entities whose folders were created, and their folders
+    get_template_fields()   the fields of a context for a template
+
+Both are dropped when the path cache database or templates.yml change on disk, their
+modification times are checked on every call, which costs two stats. The folders of an
+entity are created again when one of them is gone from disk, one stat per folder.
+
+    python folder_cache.py benchmark --playblasts 10 --latency 0.05
+
+formats the output paths of image playblasts against stubs.StubTk and reports its calls with
+and without the memo.
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+import weakref
+
+
+def get_config_paths(tk):
+    """
+    Returns the files whose changes drop the memo: the path cache database and templates.yml.
+    Only the ones the pipeline configuration of tk can tell are returned.
+    """
+    config = getattr(tk, 'pipeline_configuration', None)
+    paths = []
+    for getter, file_name in (('get_path_cache_location', None), ('get_core_config_location', 'templates.yml')):
+        try:
+            path = getattr(config, getter)()
+        except Exception:
+            continue
+        paths.append(os.path.join(path, file_name) if file_name else path)
+    return paths
+
+
+def _get_mtime(path):
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+
+def _get_context_key(context):
+    return tuple((entity or {}).get('id') for entity in (
+        getattr(context, 'project', None), getattr(context, 'entity', None), getattr(context, 'step', None),
+        getattr(context, 'task', None)))
+
+
+class FolderCache(object):
+    """
+    Thread safe memo of the folder creation and template fields of a tk instance.
+    """
+
+    def __init__(self, tk, config_paths=None):
+        """
+        Construction
+        :param tk: toolkit instance
+        :param config_paths: optional files whose changes drop the memo, see get_config_paths
+        """
+        self.tk = tk
+        self.config_paths = get_config_paths(tk) if config_paths is None else config_paths
+        self._lock = threading.Lock()
+        self._signature = None
+        # (entity_type, entity_id): (folders created by the first call, paths of the entity)
+        self._folders = {}
+        # (template name, context key): template fields
+        self._fields = {}
+
+    def _check_signature(self):
+        signature = tuple(_get_mtime(path) for path in self.config_paths)
+        with self._lock:
+            if signature != self._signature:
+                self._folders.clear()
+                self._fields.clear()
+                self._signature = signature
+
+    def _update_signature(self):
+        # folders created by this process change the path cache, do not take that for a change of someone else
+        with self._lock:
+            self._signature = tuple(_get_mtime(path) for path in self.config_paths)
+
+    def _get_entity_paths(self, entity_type, entity_id):
+        try:
+            return self.tk.paths_from_entity(entity_type, entity_id)
+        except Exception:
+            return []
+
+    def ensure_folders(self, entity_type, entity_id):
+        """
+        Runs create_filesystem_structure for an entity once per session, and again when one of
+        its folders was removed from disk.
+        :return: number of folders created, 0 when they were already created in this session
+        """
+        self._check_signature()
+        key = (entity_type, entity_id)
+        with self._lock:
+            entry = self._folders.get(key)
+        if entry is not None and all(os.path.isdir(path) for path in entry[1]):
+            return 0
+        folders = self.tk.create_filesystem_structure(entity_type, entity_id)
+        paths = self._get_entity_paths(entity_type, entity_id)
+        self._update_signature()
+        with self._lock:
+            self._folders[key] = (folders, paths)
+        return folders
+
+    def get_template_fields(self, context, template):
+        """
+        Returns a copy of context.as_template_fields(template), computed once per session.
+        """
+        self._check_signature()
+        key = (getattr(template, 'name', None) or getattr(template, 'definition', None) or id(template),
+               _get_context_key(context))
+        with self._lock:
+            fields = self._fields.get(key)
+        if fields is None:
+            fields = context.as_template_fields(template)
+            with self._lock:
+                self._fields[key] = fields
+        return dict(fields)
+
+    def clear(self):
+        with self._lock:
+            self._folders.clear()
+            self._fields.clear()
+
+
+_caches = weakref.WeakKeyDictionary()
+_caches_lock = threading.Lock()
+
+
+def get_folder_cache(tk):
+    """
+    Returns the folder cache of a tk instance, shared by every playblast of the session.
+    """
+    with _caches_lock:
+        if tk not in _caches:
+            _caches[tk] = FolderCache(tk)
+        return _caches[tk]
+
+
+def _format_output_paths(tk, context, folder_cache):
+    # the calls format_output_path makes for an image playblast: the mov path then the frames path
+    for template_name in ('playblast_mov', 'playblast_image'):
+        if folder_cache:
+            folder_cache.ensure_folders('Task', context.task['id'])
+            fields = folder_cache.get_template_fields(context, tk.templates[template_name])
+        else:
+            tk.create_filesystem_structure('Task', context.task['id'])
+            fields = context.as_template_fields(tk.templates[template_name])
+        tk.templates[template_name].apply_fields(dict(fields, version=1))
+
+
+def _run_benchmark(playblasts, latency):
+    try:
+        from . import stubs
+    except (ImportError, ValueError):
+        import stubs
+
+    print('{:<12} {:>20} {:>20} {:>10}'.format('mode', 'folder creations', 'template fields', 'seconds'))
+    for memo in (False, True):
+        tk = stubs.StubTk(latency=latency)
+        context = stubs.StubContext(tk)
+        folder_cache = FolderCache(tk, config_paths=[]) if memo else None
+        start = time.time()
+        for _ in range(playblasts):
+            _format_output_paths(tk, context, folder_cache)
+        print('{:<12} {:>20} {:>20} {:>10.2f}'.format('memo' if memo else 'uncached',
+                                                     tk.calls['create_filesystem_structure'],
+                                                     tk.calls['as_template_fields'], time.time() - start))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Playblast folder cache tools.')
+    subparsers = parser.add_subparsers(dest='command')
+    benchmark_parser = subparsers.add_parser('benchmark', help='count the calls of formatting output paths')
+    benchmark_parser.add_argument('--playblasts', type=int, default=10)
+    benchmark_parser.add_argument('--latency', type=float, default=0.05,
+                                  help='seconds a folder creation or template field lookup takes')
+    args = parser.parse_args(argv)
+
+    if args.command != 'benchmark':
+        parser.print_help()
+        return 1
+    _run_benchmark(args.playblasts, args.latency)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,291 @@
+"""
+Content-addressed frame store shared across playblast versions.
+
+Frames are stored once under their content hash and every version's .source directory
+hardlinks into the store, so frames that are byte-identical to a previous version cost
+neither storage nor a copy. The store must live on the same volume as the publish area.
+
+Frames are moved or hardlinked into the store, never copied, unless the store is on
+another volume than the frame.
+
+Every blob has an empty .access side file whose mtime is the LRU clock, touched every time
+a version links to the blob. The blob itself is never touched, it is the inode of published
+frames. The side files keep the store free of any shared index file that concurrent sessions
+would fight over. Only blobs no version links to anymore are evicted, least recently used
+first, until they hold less than the size cap: they are the only space the store holds on
+its own. A blob still linked by a version is never evicted, the version would keep its inode alive
+and later versions would lose its dedup. A new frame is published before its blob is
+created, so a blob is never left unlinked between the two for a gc to evict, and a frame
+whose blob a gc evicts while it is linked is stored again.
+
+Garbage collection can be run from cron:
+
+    python frame_store.py gc --root /mnt/publish/.frame_store --max-size 500G
+"""
+import argparse
+import errno
+import hashlib
+import os
+import shutil
+import sys
+import time
+import uuid
+
+HASH_CHUNK_SIZE = 1024 * 1024
+SIZE_UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+# side file of a blob whose mtime is its LRU clock
+ACCESS_SUFFIX = '.access'
+
+
+def parse_size(value):
+    """
+    Parses sizes like 500G or 1048576 into bytes.
+    """
+    value = str(value).strip().upper().rstrip('B')
+    if value and value[-1] in SIZE_UNITS:
+        return int(float(value[:-1]) * SIZE_UNITS[value[-1]])
+    return int(value)
+
+
+class FrameStore(object):
+    """
+    Frames keyed by content hash, hardlinked into version directories.
+    """
+    OBJECTS_DIR = 'objects'
+
+    def __init__(self, root, max_size=0, logger=None):
+        """
+        Construction
+        :param root: store directory, on the same volume as the publish area
+        :param max_size: bytes the blobs no version links to may keep for reuse, enforced by evict/gc
+        :param logger: optional logger
+        """
+        self.root = root
+        self.max_size = max_size
+        self.logger = logger
+        self.linked = 0
+        self.reused = 0
+
+    @staticmethod
+    def hash_file(path):
+        sha1 = hashlib.sha1()
+        with open(path, 'rb') as fh:
+            for chunk in iter(lambda: fh.read(HASH_CHUNK_SIZE), b''):
+                sha1.update(chunk)
+        return sha1.hexdigest()
+
+    def get_blob_path(self, digest, ext=''):
+        return os.path.join(self.root, self.OBJECTS_DIR, digest[:2], digest[2:] + ext)
+
+    def get_access_path(self, blob_path):
+        return blob_path + ACCESS_SUFFIX
+
+    def touch(self, blob_path):
+        """
+        Marks a blob as used now. The clock is the mtime of a side file: the blob shares its
+        inode with the published frames, which must keep their own mtime.
+        """
+        access_path = self.get_access_path(blob_path)
+        try:
+            with open(access_path, 'a'):
+                pass
+            os.utime(access_path, None)
+        except (IOError, OSError) as err:
+            if self.logger:
+                self.logger.debug("FrameStore: cannot touch {} ({})".format(access_path, err))
+
+    def _bring(self, path, dest, move=False):
+        # renames when path may be consumed, hardlinks otherwise, copies across volumes
+        try:
+            if move:
+                os.rename(path, dest)
+            else:
+                os.link(path, dest)
+            return
+        except OSError as err:
+            if self.logger:
+                self.logger.debug("FrameStore: cannot {} {} ({}), copying".format('move' if move else 'link', path,
+                                                                                  err))
+        shutil.copyfile(path, dest)
+        if move:
+            os.remove(path)
+
+    def _store(self, path, blob_path, move=False):
+        """
+        Hardlinks path in as blob_path, renamed in place so readers never see a partial blob.
+        An existing blob is kept. Copies when the store is on another volume.
+        :param move: path may be consumed
+        """
+        blob_dir = os.path.dirname(blob_path)
+        if not os.path.isdir(blob_dir):
+            try:
+                os.makedirs(blob_dir)
+            except OSError as err:
+                if err.errno != errno.EEXIST:
+                    raise
+        temp_path = os.path.join(blob_dir, '.incoming_{}'.format(uuid.uuid4().hex))
+        try:
+            self._bring(path, temp_path, move=move)
+            os.rename(temp_path, blob_path)
+        except (IOError, OSError):
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            if not os.path.exists(blob_path):
+                raise
+        self.touch(blob_path)
+
+    def _link_blob(self, blob_path, dest):
+        """
+        Publishes an existing blob at dest, copying when dest is on another volume.
+        :return: False when there is no blob, eg evicted by a gc running meanwhile
+        """
+        try:
+            os.link(blob_path, dest)
+        except OSError as err:
+            if err.errno == errno.ENOENT:
+                return False
+            if self.logger:
+                self.logger.debug("FrameStore: cannot link {} ({}), copying".format(dest, err))
+            try:
+                shutil.copyfile(blob_path, dest)
+            except (IOError, OSError) as err:
+                if err.errno == errno.ENOENT:
+                    return False
+                raise
+        self.touch(blob_path)
+        return True
+
+    def add(self, path, move=False):
+        """
+        Adds a file to the store, renaming it in when it may be consumed, hardlinking it otherwise.
+        It is only copied when the store is on another volume. A blob nothing else links to may
+        be evicted by the next gc, link publishes a file without that window.
+        :param move: path may be consumed, it is gone once added
+        :return: path of the blob holding its content
+        """
+        blob_path = self.get_blob_path(self.hash_file(path), os.path.splitext(path)[1])
+        if os.path.exists(blob_path):
+            self.reused += 1
+            self.touch(blob_path)
+            if move:
+                os.remove(path)
+            return blob_path
+        self._store(path, blob_path, move=move)
+        return blob_path
+
+    def link(self, source, dest, move=False):
+        """
+        Publishes source at dest as a hardlink into the store, copying when the
+        destination is on another volume. Signature matches sgtk.util.filesystem.copy_file.
+        A new frame is published at dest before it is stored, so its blob is never left
+        without a link for gc to evict.
+        :param move: source may be consumed, see add
+        """
+        blob_path = self.get_blob_path(self.hash_file(source), os.path.splitext(source)[1])
+        if os.path.lexists(dest):
+            os.remove(dest)
+        if self._link_blob(blob_path, dest):
+            self.reused += 1
+            if move:
+                os.remove(source)
+        else:
+            self._bring(source, dest, move=move)
+            self._store(dest, blob_path)
+        self.linked += 1
+
+    def iter_blobs(self):
+        """
+        Yields (path, stat) of every blob in the store.
+        """
+        objects_dir = os.path.join(self.root, self.OBJECTS_DIR)
+        if not os.path.isdir(objects_dir):
+            return
+        for prefix in os.listdir(objects_dir):
+            prefix_dir = os.path.join(objects_dir, prefix)
+            if not os.path.isdir(prefix_dir):
+                continue
+            for name in os.listdir(prefix_dir):
+                if name.startswith('.incoming_') or name.endswith(ACCESS_SUFFIX):
+                    continue
+                path = os.path.join(prefix_dir, name)
+                try:
+                    yield path, os.stat(path)
+                except OSError:
+                    continue
+
+    def size(self):
+        return sum(stat.st_size for _, stat in self.iter_blobs())
+
+    def evict(self, max_size=None):
+        """
+        Removes the blobs no version links to, least recently used first, until they hold
+        less than max_size. Linked blobs are kept: removing them frees no space.
+        :param max_size: bytes the unlinked blobs may keep, 0 removes them all
+        :return: (number of blobs removed, bytes freed)
+        """
+        max_size = self.max_size if max_size is None else max_size
+        blobs = [(path, stat) for path, stat in self.iter_blobs() if stat.st_nlink <= 1]
+        total = sum(stat.st_size for _, stat in blobs)
+        blobs.sort(key=lambda blob: self.get_last_access(*blob))
+
+        removed = freed = 0
+        for path, stat in blobs:
+            if total <= max_size:
+                break
+            if self._remove_blob(path):
+                total -= stat.st_size
+                removed += 1
+                freed += stat.st_size
+        return removed, freed
+
+    def gc(self, max_size=None):
+        """
+        Evicts the blobs no version links to anymore down to the size cap, see evict.
+        :return: (number of blobs removed, bytes freed)
+        """
+        removed, freed = self.evict(max_size)
+        if self.logger:
+            self.logger.info("FrameStore gc: removed {} blobs, {} bytes".format(removed, freed))
+        return removed, freed
+
+    def get_last_access(self, blob_path, stat=None):
+        try:
+            return os.path.getmtime(self.get_access_path(blob_path))
+        except OSError:
+            return (stat or os.stat(blob_path)).st_mtime
+
+    def _remove_blob(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            return False
+        try:
+            os.remove(self.get_access_path(path))
+        except OSError:
+            pass
+        return True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Maintain the playblast frame store.')
+    subparsers = parser.add_subparsers(dest='command')
+    gc_parser = subparsers.add_parser('gc', help='evict unreferenced blobs down to the size cap')
+    gc_parser.add_argument('--root', required=True)
+    gc_parser.add_argument('--max-size', default='0',
+                           help='space unreferenced blobs may keep for reuse, eg 500G, 0 keeps none')
+    args = parser.parse_args(argv)
+
+    if args.command != 'gc':
+        parser.print_help()
+        return 1
+
+    store = FrameStore(args.root, parse_size(args.max_size))
+    start = time.time()
+    removed, freed = store.gc()
+    print('Removed {} blobs ({:.1f} MB) in {:.1f}s, store is now {:.1f} MB'.format(
+        removed, freed / 1024.0 ** 2, time.time() - start, store.size() / 1024.0 ** 2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
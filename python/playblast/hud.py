@@ -0,0 +1,175 @@
+"""
+Focal length heads up display of the playblast.
+
+The HUD used to run a cmds.getAttr of the camera focal length on every viewport refresh, and
+a CUSTOMHUD expression refreshed it on every frame evaluation, adding a python round trip
+and an extra DG evaluation to every captured frame.
+
+FocalLengthHUD evaluates the focal length of the whole frame range before the capture:
+
+    animated    the time anim curve driving the attribute is evaluated through the API in one pass
+    static      read once
+    otherwise   eg driven keys, an expression or a constraint, one getAttr per frame, still up front
+
+The HUD is attached to the refresh and its command only looks the current frame up in that
+table, there is no expression.
+
+    mayapy hud.py benchmark --scene shot.ma --camera shotCam --start 1001 --end 1100
+
+captures the range offscreen without a HUD, with the previous callback HUD and with the
+table, and prints the capture fps of each.
+"""
+import argparse
+import shutil
+import sys
+import tempfile
+import time
+
+HUD_NAME = 'FL99'
+HUD_SECTION = 9
+HUD_BLOCK = 9
+# anim curves with a time input, driven key curves (animCurveU*) are driven by another attribute
+TIME_CURVE_TYPES = ('animCurveTL', 'animCurveTA', 'animCurveTU')
+
+
+def format_focal_length(value):
+    return '%smm' % round(float(value), 2)
+
+
+def _evaluate_time_curve(curve, frames):
+    import maya.api.OpenMaya as om
+    import maya.api.OpenMayaAnim as oma
+
+    selection = om.MSelectionList()
+    selection.add(curve)
+    curve = oma.MFnAnimCurve(selection.getDependNode(0))
+    unit = om.MTime.uiUnit()
+    return dict((frame, curve.evaluate(om.MTime(frame, unit))) for frame in frames)
+
+
+def get_focal_length_table(cmds, camera_shape, start, end):
+    """
+    Evaluates the focal length of a camera shape over a frame range.
+    Only a time input anim curve connected straight to the attribute is evaluated through the
+    API, driven keys, conversions and any other input go through one getAttr per frame.
+    :return: {frame: focal length}
+    """
+    attr = '%s.focalLength' % camera_shape
+    frames = range(int(start), int(end) + 1)
+    sources = cmds.listConnections(attr, source=True, destination=False, skipConversionNodes=False) or []
+    if not sources:
+        value = cmds.getAttr(attr)
+        return dict((frame, value) for frame in frames)
+
+    if len(sources) == 1 and cmds.nodeType(sources[0]) in TIME_CURVE_TYPES:
+        return _evaluate_time_curve(sources[0], frames)
+
+    return dict((frame, cmds.getAttr(attr, time=frame)) for frame in frames)
+
+
+class FocalLengthHUD(object):
+    """
+    Focal length HUD reading a table precomputed for the captured range.
+    """
+
+    def __init__(self, camera_shape, start, end, default=None, cmds=None):
+        """
+        Construction
+        :param camera_shape: captured camera shape, None or False shows the default
+        :param start: first frame of the capture
+        :param end: last frame of the capture
+        :param default: focal length shown without a camera, and outside the range
+        :param cmds: maya.cmds, passed in so the table can be built against a stand-in
+        """
+        if cmds is None:
+            import maya.cmds as cmds
+        self.cmds = cmds
+        self.table = {}
+        self.default = '%smm' % default
+        if camera_shape:
+            self.table = dict((frame, format_focal_length(value)) for frame, value in
+                              get_focal_length_table(cmds, camera_shape, start, end).items())
+            self.default = format_focal_length(cmds.getAttr('%s.focalLength' % camera_shape))
+
+    def get_text(self, *args):
+        return self.table.get(int(round(self.cmds.currentTime(query=True))), self.default)
+
+    def install(self):
+        self.cmds.headsUpDisplay(rp=(HUD_SECTION, HUD_BLOCK))
+        self.cmds.headsUpDisplay(HUD_NAME, s=HUD_SECTION, b=HUD_BLOCK, p=20, bs='small', ba='right', da='right',
+                                 lfs='large', dfs='large', l='', c=self.get_text, atr=True)
+
+    def remove(self):
+        self.cmds.headsUpDisplay(rp=(HUD_SECTION, HUD_BLOCK))
+
+
+def _install_callback_hud(cmds, camera_shape):
+    # the HUD before the table, for the benchmark
+    cmds.headsUpDisplay(rp=(HUD_SECTION, HUD_BLOCK))
+    cmds.headsUpDisplay(HUD_NAME, s=HUD_SECTION, b=HUD_BLOCK, p=20, bs='small', ba='right', da='right', lfs='large',
+                        dfs='large', l='',
+                        c=lambda: format_focal_length(cmds.getAttr('%s.focalLength' % camera_shape)))
+    cmds.expression(n='CUSTOMHUD', s='headsUpDisplay -r {};'.format(HUD_NAME))
+
+
+def _remove_callback_hud(cmds):
+    cmds.headsUpDisplay(rp=(HUD_SECTION, HUD_BLOCK))
+    cmds.delete('CUSTOMHUD')
+
+
+def _run_benchmark(scene, camera, start, end, width, height):
+    import maya.standalone
+    maya.standalone.initialize(name='python')
+    import maya.cmds as cmds
+
+    cmds.file(scene, open=True, force=True, prompt=False)
+    camera_shape = (cmds.listRelatives(camera, shapes=True, path=True) or [camera])[0]
+    output_dir = tempfile.mkdtemp(prefix='hud_benchmark_')
+    print('{:<10} {:>10} {:>10}'.format('hud', 'seconds', 'fps'))
+    try:
+        for mode in ('none', 'callback', 'table'):
+            hud = None
+            start_time = time.time()
+            if mode == 'callback':
+                _install_callback_hud(cmds, camera_shape)
+            elif mode == 'table':
+                hud = FocalLengthHUD(camera_shape, start, end, cmds=cmds)
+                hud.install()
+            try:
+                cmds.playblast(startTime=start, endTime=end, filename='{}/{}'.format(output_dir, mode), format='image',
+                               compression='jpg', width=width, height=height, percent=100, offScreen=True,
+                               viewer=False, forceOverwrite=True, showOrnaments=True, framePadding=4)
+            finally:
+                if mode == 'callback':
+                    _remove_callback_hud(cmds)
+                elif hud:
+                    hud.remove()
+            # the table is built before the capture, it counts
+            seconds = time.time() - start_time
+            print('{:<10} {:>10.2f} {:>10.1f}'.format(mode, seconds, (end - start + 1) / seconds))
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+        maya.standalone.uninitialize()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Playblast focal length HUD tools.')
+    subparsers = parser.add_subparsers(dest='command')
+    benchmark_parser = subparsers.add_parser('benchmark', help='compare the capture fps of the HUDs, run with mayapy')
+    benchmark_parser.add_argument('--scene', required=True)
+    benchmark_parser.add_argument('--camera', required=True)
+    benchmark_parser.add_argument('--start', type=int, required=True)
+    benchmark_parser.add_argument('--end', type=int, required=True)
+    benchmark_parser.add_argument('--width', type=int, default=960)
+    benchmark_parser.add_argument('--height', type=int, default=540)
+    args = parser.parse_args(argv)
+
+    if args.command != 'benchmark':
+        parser.print_help()
+        return 1
+    _run_benchmark(args.scene, args.camera, args.start, args.end, args.width, args.height)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,210 @@
+"""
+Segment-parallel movie encoding.
+
+A single ffmpeg process does not keep a 32 core workstation busy on a playblast sized
+frame, so long sequences are split into segments that are encoded concurrently and
+joined with the concat demuxer without re-encoding.
+
+Segment boundaries fall on multiples of the GOP and every segment is encoded with a
+fixed GOP and scene cut detection off, so each segment starts exactly where the single
+process encode would have put a keyframe and the joined stream has the same structure.
+The joined movie is checked with ffprobe for the expected frame count.
+
+Only the standard library is used so the splitting logic can be exercised on its own.
+"""
+import math
+import multiprocessing
+import os
+import shutil
+import subprocess
+import tempfile
+from distutils import spawn
+
+from .compat import futures
+from .ffmpeg_runner import PROGRESS_INTERVAL, FFmpegRunner
+
+GOP_SIZE = 48
+# below this many frames per segment the process start up and join cost more than they save
+MIN_SEGMENT_FRAMES = 5 * GOP_SIZE
+# threads libx264 uses well for one playblast sized encode
+THREADS_PER_SEGMENT = 4
+
+
+def pick_segment_count(frame_count, cpu_count=None, min_segment_frames=MIN_SEGMENT_FRAMES,
+                       threads_per_segment=THREADS_PER_SEGMENT):
+    """
+    Picks how many segments to encode a sequence in.
+    :param frame_count: number of frames of the movie
+    :param cpu_count: available cores, queried when None
+    :param min_segment_frames: shortest segment worth a separate encode
+    :param threads_per_segment: cores one encode keeps busy
+    :return: number of segments, 1 when the sequence is too short to benefit
+    """
+    if cpu_count is None:
+        cpu_count = multiprocessing.cpu_count()
+    return max(1, min(cpu_count // threads_per_segment, frame_count // min_segment_frames))
+
+
+def split_segments(frame_count, segments, gop=GOP_SIZE):
+    """
+    Splits encode positions 0..frame_count-1 into contiguous segments starting on GOP boundaries.
+    :param frame_count: number of frames of the movie
+    :param segments: requested number of segments
+    :param gop: GOP size the segments are encoded with
+    :return: list of inclusive (start, end) positions in order
+    """
+    if frame_count <= 0:
+        return []
+    gops = int(math.ceil(float(frame_count) / gop))
+    segments = max(1, min(segments, gops))
+    size, remainder = divmod(gops, segments)
+
+    ranges = []
+    start = 0
+    for i in range(segments):
+        end = min(start + (size + (1 if i < remainder else 0)) * gop, frame_count) - 1
+        ranges.append((start, end))
+        start = end + 1
+    return ranges
+
+
+def get_codec_args(segments, gop=GOP_SIZE, cpu_count=None, encoder_args=()):
+    """
+    Returns the output args every segment is encoded with, so the segments can be joined
+    without re-encoding.
+    :param segments: number of segments encoded at once
+    :param gop: GOP size
+    :param cpu_count: available cores, queried when None
+    :param encoder_args: args of the encoder profile, they win over the segment defaults
+    """
+    if cpu_count is None:
+        cpu_count = multiprocessing.cpu_count()
+    encoder_args = list(encoder_args)
+    segment_args = [('-g', str(gop)),
+                    ('-keyint_min', str(gop)),
+                    ('-sc_threshold', '0'),
+                    ('-threads', str(max(1, cpu_count // segments)))]
+    for option, value in segment_args:
+        if option not in encoder_args:
+            encoder_args += [option, value]
+    return encoder_args
+
+
+def get_ffprobe(ffmpeg):
+    name = 'ffprobe.exe' if os.name == 'nt' else 'ffprobe'
+    ffprobe = os.path.join(os.path.dirname(ffmpeg or ''), name)
+    if os.path.isfile(ffprobe):
+        return ffprobe
+    return spawn.find_executable('ffprobe')
+
+
+def count_frames(path, ffprobe, startupinfo=None):
+    """
+    Counts the video frames of a movie by reading its packets, without decoding.
+    """
+    output = subprocess.check_output([ffprobe, '-v', 'error',
+                                      '-select_streams', 'v:0',
+                                      '-count_packets',
+                                      '-show_entries', 'stream=nb_read_packets',
+                                      '-of', 'csv=p=0',
+                                      path],
+                                     startupinfo=startupinfo)
+    return int(output.decode('utf-8').strip().split(',')[0])
+
+
+def concat_segments(ffmpeg, segment_paths, mov_path, startupinfo=None):
+    """
+    Joins segments encoded with identical settings into one movie without re-encoding.
+    """
+    list_path = os.path.join(os.path.dirname(segment_paths[0]), 'segments.txt')
+    with open(list_path, 'w') as fh:
+        fh.write('ffconcat version 1.0\n')
+        for path in segment_paths:
+            fh.write("file '{}'\n".format(path.replace('\\', '/').replace("'", "'\\''")))
+    FFmpegRunner([ffmpeg, '-y', '-loglevel', 'error',
+                  '-f', 'concat', '-safe', '0',
+                  '-i', list_path,
+                  '-c', 'copy',
+                  mov_path],
+                 startupinfo=startupinfo).run()
+
+
+class SegmentedEncode(object):
+    """
+    Encodes a movie in GOP aligned segments in parallel and joins them.
+    """
+
+    def __init__(self, encode_segment, frame_count, segments, ffmpeg, gop=GOP_SIZE, encoder_args=(), logger=None,
+                 startupinfo=None, progress=None, cancel=None):
+        """
+        Construction
+        :param encode_segment: callable(start, end, segment_path, codec_args) encoding the inclusive
+                               encode positions start..end to segment_path, appending codec_args to
+                               the output args of its ffmpeg
+        :param frame_count: number of frames of the movie
+        :param segments: number of segments, see pick_segment_count
+        :param ffmpeg: ffmpeg executable
+        :param gop: GOP size
+        :param encoder_args: args of the encoder profile
+        :param logger: optional logger
+        :param startupinfo: passed to subprocess.Popen
+        :param progress: optional callable, called periodically from the thread calling run
+        :param cancel: optional callable stopping the running segments when one of them fails
+        """
+        self.encode_segment = encode_segment
+        self.frame_count = frame_count
+        self.ranges = split_segments(frame_count, segments, gop)
+        self.ffmpeg = ffmpeg
+        self.gop = gop
+        self.encoder_args = encoder_args
+        self.logger = logger
+        self.startupinfo = startupinfo
+        self.progress = progress
+        self.cancel = cancel
+
+    def run(self, mov_path):
+        """
+        Encodes and joins the segments, then checks the movie holds every frame.
+        :return: mov_path
+        """
+        work_dir = tempfile.mkdtemp(prefix='playblast_segments_')
+        codec_args = get_codec_args(len(self.ranges), self.gop, encoder_args=self.encoder_args)
+        segment_paths = [os.path.join(work_dir, 'segment_{:03d}.mov'.format(i)) for i in range(len(self.ranges))]
+        if self.logger:
+            self.logger.debug("SegmentedEncode: {} frames in segments {}".format(self.frame_count, self.ranges))
+        try:
+            with futures.ThreadPoolExecutor(max_workers=len(self.ranges)) as executor:
+                jobs = [executor.submit(self.encode_segment, start, end, path, codec_args)
+                        for (start, end), path in zip(self.ranges, segment_paths)]
+                pending = jobs
+                while pending:
+                    done, pending = futures.wait(pending, timeout=PROGRESS_INTERVAL,
+                                                 return_when=futures.FIRST_EXCEPTION)
+                    if self.progress:
+                        self.progress()
+                    if any(job.exception() for job in done):
+                        if self.cancel:
+                            self.cancel()
+                        break
+                for job in jobs:
+                    job.result()
+
+            concat_segments(self.ffmpeg, segment_paths, mov_path, self.startupinfo)
+            self.verify(mov_path)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        return mov_path
+
+    def verify(self, mov_path):
+        """
+        Raises when the joined movie does not hold exactly the expected number of frames.
+        """
+        ffprobe = get_ffprobe(self.ffmpeg)
+        if not ffprobe:
+            if self.logger:
+                self.logger.warning("SegmentedEncode: ffprobe not found, {} not verified".format(mov_path))
+            return
+        frames = count_frames(mov_path, ffprobe, self.startupinfo)
+        if frames != self.frame_count:
+            raise RuntimeError("Segmented encode of {} holds {} frames, expected {}".format(
+                mov_path, frames, self.frame_count))
@@ -1,10 +1,10 @@
 # coding=utf-8
 import datetime
 import glob
-import pprint
 import shutil
 import subprocess
 import tempfile
+import uuid
 
 import os
 import re
@@ -23,11 +23,65 @@ try:
 except ImportError:
     from PyQt4 import QtCore, QtGui
 
-from .slate import Slate
+from . import encoder_profiles
+from . import publish_daemon
+from .batch_capture import CapturePanelError, ChunkedCapture, get_mayapy
+from .fingerprint import FrameFingerprinter, FingerprintStore, carry_forward_frames
+from .folder_cache import get_folder_cache
+from .frame_store import FrameStore, parse_size
+from .hud import FocalLengthHUD
+from .review_media import ReviewMedia
+from .sg_cache import PlateIndex, ShotgunCache, find_latest_plate
+from .slate import Slate, ffmpeg, get_startupinfo
+from .stream import StreamingEncoder
+from .transfer import BulkTransfer, FileTransfer, build_transfer_plan
+from .upload_queue import ShotgunTransport, UploadQueue, start_worker
+from .version_allocator import get_allocator as get_version_allocator
+from .version_publish import VersionPublisher
+from .viewport import get_display_settings
 
 BASE_DIR_PATH = os.path.dirname(__file__).replace('\\', '/')
 
 
+def get_upload_queue(app):
+    """
+    Returns the upload queue of this machine, None when the upload_queue setting is off.
+    """
+    if not app.get_setting('upload_queue', True):
+        return None
+    return UploadQueue(os.path.join(LocalFileStorageManager.get_global_root(LocalFileStorageManager.CACHE),
+                                    'playblast_uploads.sqlite'))
+
+
+def start_uploads(app, tk, upload_queue=None):
+    """
+    Starts sending the queued uploads of the site of tk in the background, unless already started.
+    Called after every publish and when the app starts, which resumes the uploads of a previous session.
+    """
+    upload_queue = upload_queue or get_upload_queue(app)
+    if upload_queue is None or not upload_queue.depth(tk.shotgun_url):
+        return None
+    return start_worker(upload_queue, tk.shotgun_url, ShotgunTransport(tk),
+                        workers=app.get_setting('upload_queue_workers', 2), logger=app.logger)
+
+
+def get_sg_cache(app, tk):
+    """
+    Returns the Shotgun lookup cache of this machine for the site of tk, None when the sg_cache setting is off.
+    """
+    if not app.get_setting('sg_cache', True):
+        return None
+    return ShotgunCache(os.path.join(LocalFileStorageManager.get_global_root(LocalFileStorageManager.CACHE),
+                                     'playblast_sg_cache.sqlite'),
+                        site=tk.shotgun_url, ttls=app.get_setting('sg_cache_ttls', None))
+
+
+class PlayblastCancelled(Exception):
+    """
+    The publish of a playblast was cancelled.
+    """
+
+
 class PlayblastManager(object):
     """
     Main playblast functionality
@@ -57,10 +111,33 @@ class PlayblastManager(object):
         self.camera_type = None
         self.note_type = 'Artist Version'
         self.focal_length = None
+        # set by the dialog once its prefetch has it, looked up when still None
+        self.plate_name = None
         self.mayaOutputPath = None
         self.playblastPath = None
         self.playblast_mov_path = None
         self.upload_to_sg = True
+        self.stream_encode = self._app.get_setting('stream_encode', False)
+        self.batch_capture = self._app.get_setting('batch_capture', False)
+        self.incremental = self._app.get_setting('incremental_playblast', False)
+        self.capture_to_publish = self._app.get_setting('capture_to_publish', False)
+        self.publish_daemon = self._app.get_setting('publish_daemon', False)
+        self.frame_fingerprints = None
+        self._frames_to_capture = None
+        self._previous_store = None
+        self._unchanged_frames = []
+        self.file_transfer = FileTransfer(logger=self._app.logger)
+        self.review_media = None
+        self.upload_queue = get_upload_queue(self._app)
+        self.sg_cache = get_sg_cache(self._app, self._tk)
+        self.plate_index = PlateIndex(self.sg_cache.path, self.sg_cache.site) if self.sg_cache else None
+        self.version_allocator = get_version_allocator(
+            os.path.join(LocalFileStorageManager.get_global_root(LocalFileStorageManager.CACHE),
+                         'playblast_versions.sqlite'))
+        self.folder_cache = get_folder_cache(self._tk)
+        self._version_reservation = None
+        self._defaults_data = None
+        self.cancelled = False
         self.playblastParams = {
             'offScreen': False,
             'percent': 50,
@@ -76,6 +153,8 @@ class PlayblastManager(object):
             'sequenceTime': False,
         }
         self.slate = Slate(self._app, self.playblastParams, self.playblastPath, self.focal_length)
+        self.slate.emitter = self.emitter
+        self._stream_encoder = None
         self.camera_shape = self.get_current_camera()
 
     def get_context(self):
@@ -121,9 +200,18 @@ class PlayblastManager(object):
         self._app.logger.debug("get_temp_output: ext= {0}, self.mayaOutputPath ={1}".format(ext, self.mayaOutputPath))
         return self.mayaOutputPath
 
-    def get_frame_range(self):
+    def get_shot_info(self):
+        """
+        Returns the cut range and image type of the context entity, only talks to Shotgun so it can run on any thread.
+        """
+        return self.sg_find_one(self._context.entity['type'],
+                                [['id', 'is', self._context.entity['id']]],
+                                ['sg_head_in', 'sg_tail_out', 'sg_original_pixel_aspect_ratio', 'sg_image_type'])
+
+    def get_frame_range(self, shot_info=None):
         """
         function to get frame range from current maya scene
+        :param shot_info: optional result of get_shot_info, looked up when not given
         :returns:
             start (int): start frame
             end (int): end frame
@@ -131,10 +219,8 @@ class PlayblastManager(object):
         start = int(cmds.playbackOptions(q=True, minTime=True))
         end = int(cmds.playbackOptions(q=True, maxTime=True))
         self.emitter("self._context.entity = {}".format(self._context.entity))
-        shot_info = self._context.sgtk.shotgun.find_one(self._context.entity['type'],
-                                                        [['id', 'is', self._context.entity['id']]],
-                                                        ['sg_head_in', 'sg_tail_out', 'sg_original_pixel_aspect_ratio',
-                                                         'sg_image_type'])
+        if shot_info is None:
+            shot_info = self.get_shot_info()
         if shot_info['sg_head_in'] and shot_info['sg_tail_out']:
             start_frame = int(shot_info['sg_head_in'])  # or start
             last_frame = int(shot_info['sg_tail_out'])  # or end
@@ -154,7 +240,23 @@ class PlayblastManager(object):
         :return:
             playblastPath: output playblast file path.
         """
+        capture = self.capture_playblast(override_playblast_params)
+        if self.publish_daemon:
+            self.submit_publish_job(capture)
+            return self.playblastPath, None
+        return self.finish_playblast(capture)
+
+    def capture_playblast(self, override_playblast_params):
+        """
+        Runs everything that needs maya: resolves the publish paths, captures the frames and
+        gathers the scene data the rest of the publish needs. Must run on the main thread.
+        :param
+            override_playblast_params (dict): user input from ui
+        :return:
+            dict of the capture state, to pass to finish_playblast
+        """
         self.emitter('Gathering user inputs..')
+        self.cancelled = False
 
         self.playblastParams.update(override_playblast_params)
         self._app.logger.debug("Playblast params: {}".format(self.playblastParams))
@@ -165,94 +267,538 @@ class PlayblastManager(object):
         else:
             self.playblastParams['showOrnaments'] = True
 
-        # adding the HUD For the FL
-        cmds.headsUpDisplay(rp=(9, 9))
-        cmds.headsUpDisplay('FL99', s=9, b=9, p=20, bs='small', ba='right', da='right', lfs='large', dfs='large', l='',
-                            c=self.get_focal_length)
-
-        cmds.expression(n='CUSTOMHUD', s='headsUpDisplay -r FL99;')
-
-        self.mayaOutputPath = cmds.playblast(**self.playblastParams)
-        self._app.logger.debug("createPlayblast: mayaOutputPath = {}".format(self.mayaOutputPath))
-
-        cmds.headsUpDisplay(rp=(9, 9))
-        cmds.delete('CUSTOMHUD')
-
         if self.playblastParams['format'] == 'image':
             extension = "jpg"
         else:
             extension = "avi"
 
-        self.playblastPath, playblast_version = self.format_output_path(extension)
-        self._app.logger.debug("formatted playblastPath = {}".format(self.playblastPath))
+        # resolve the publish paths and version before capturing so they are
+        # available to anything running alongside cmds.playblast
+        playblast_version = self.resolve_output_paths(extension)
+
+        self.file_transfer = FileTransfer(logger=self._app.logger)
+        self.review_media = None
+        self.slate.cancelled = False
+        encoder_profile = self.get_encoder_profile()
+        self.slate.encoder_args = encoder_profile.args
+        self._app.logger.debug("capture_playblast: encoder profile = {}".format(encoder_profile))
+
+        staging_dir = None
+        # the publish daemon copies the frames itself, the staging rename only works in this process
+        if self.capture_to_publish and self.playblastParams['format'] == 'image' and not self.publish_daemon:
+            staging_dir = self.prepare_staging_dir()
+
+        self.frame_fingerprints = None
+        self._frames_to_capture = None
+        self._previous_store = None
+        self._unchanged_frames = []
+        if self.incremental and self.playblastParams['format'] == 'image':
+            self.plan_incremental_capture()
+
+        stream_encoder = None
+        if (self.stream_encode and self.playblastParams['format'] == 'image'
+                and self._frames_to_capture is None and not self.publish_daemon):
+            stream_encoder = self.start_streaming_encoder(playblast_version)
+        self._stream_encoder = stream_encoder
+
+        # adding the HUD For the FL, evaluated for the whole range before capturing, see hud
+        focal_length_hud = None
+        try:
+            focal_length_hud = FocalLengthHUD(self.camera_shape, self.playblastParams['startTime'],
+                                              self.playblastParams['endTime'], default=self.focal_length)
+            focal_length_hud.install()
+            self.mayaOutputPath = self.capture()
+        except Exception:
+            self.release_version()
+            if stream_encoder:
+                stream_encoder.cancel()
+            if staging_dir:
+                shutil.rmtree(staging_dir, ignore_errors=True)
+            raise
+        finally:
+            if focal_length_hud:
+                focal_length_hud.remove()
+        self._app.logger.debug("capture_playblast: mayaOutputPath = {}".format(self.mayaOutputPath))
+
+        if stream_encoder:
+            stream_encoder.capture_finished()
+
+        return {
+            'playblast_version': playblast_version,
+            'staging_dir': staging_dir,
+            'stream_encoder': stream_encoder,
+            # the slate reads the scene frame rate, gather it while we are on the main thread
+            'slate_data': self.gather_slate_data(playblast_version),
+        }
 
-        if self.playblastParams['format'] == 'image':
-            pb_name, padding, file_ext = os.path.basename(self.playblastPath).split(".")
-            self._app.logger.debug("pb_name= {0}, padding= {1}, file_ext = {2}".format(pb_name, padding, file_ext))
-        else:
-            pb_name, file_ext = os.path.basename(self.playblastPath).split(".")
-            self.emitter('Getting latest version: {}'.format(playblast_version))
-            self._app.logger.debug("pb_name= {0}, file_ext = {1}".format(pb_name, file_ext))
+    def finish_playblast(self, capture):
+        """
+        Publishes a captured playblast: copies the frames, slates and encodes the movie,
+        then creates the Version, uploads and registers the publish.
+        Does not touch maya, so it can run on a worker thread, see worker.PostCaptureWorker.
+        Raises PlayblastCancelled when cancel() is called before the Version is created.
+        :param capture: the capture state returned by capture_playblast
+        :return: (playblastPath, version entity)
+        """
+        playblast_version = capture['playblast_version']
+        staging_dir = capture['staging_dir']
+        stream_encoder = capture['stream_encoder']
+        try:
+            self.check_cancelled()
+            if self.playblastParams['format'] == 'image':
+                pb_name, padding, file_ext = os.path.basename(self.playblastPath).split(".")
+                self._app.logger.debug("pb_name= {0}, padding= {1}, file_ext = {2}".format(pb_name, padding,
+                                                                                       file_ext))
+            else:
+                pb_name, file_ext = os.path.basename(self.playblastPath).split(".")
+                self.emitter('Getting latest version: {}'.format(playblast_version))
+                self._app.logger.debug("pb_name= {0}, file_ext = {1}".format(pb_name, file_ext))
+
+            self._app.logger.debug("self.mayaOutputPath = {}".format(self.mayaOutputPath))
+            self._app.logger.debug(os.path.exists(self.mayaOutputPath))
+
+            if file_ext == "avi":
+                self.file_transfer.move_file(self.mayaOutputPath, self.playblastPath)
+                self.check_cancelled()
+                self.review_media = self.build_review_media(self.playblastPath)
+            else:
+                pb_name, file_ext = self.publish_image_sequence(playblast_version, staging_dir, stream_encoder,
+                                                                capture['slate_data'])
+
+            self.emitter('Published media: {}'.format(self.file_transfer.summary()))
+            self.check_cancelled()
+        except Exception:
+            if stream_encoder:
+                stream_encoder.cancel()
+            if staging_dir:
+                shutil.rmtree(staging_dir, ignore_errors=True)
+            if self.review_media:
+                self.review_media.cleanup()
+            raise
 
-        self._app.logger.debug("self.mayaOutputPath = {}".format(self.mayaOutputPath))
-        self._app.logger.debug(os.path.exists(self.mayaOutputPath))
+        try:
+            if not self.upload_to_sg:
+                return self.playblastPath, None
 
-        if file_ext == "avi":
-            sgtk.util.filesystem.copy_file(self.mayaOutputPath, self.playblastPath)
-        else:
-            dir_path = os.path.dirname(self.mayaOutputPath)
-            base_seq_name, hashes, ext = os.path.basename(self.mayaOutputPath).split(".")
-            seq_name = os.path.join(dir_path, base_seq_name).replace("\\", "/")
-            padding = '.%0{}d.'.format(hashes.count('#'))
-            self.playblastParams['format'] = "mov"
-            self.playblast_mov_path, playblast_version = self.format_output_path('mov')
-            self.emitter('Getting latest version: {}'.format(playblast_version))
+            self._app.logger.debug("Uploading to sg = {}".format(self.playblast_mov_path))
+            version_entity = self.upload_to_shotgun(publish_name=pb_name[:-5],
+                                                    version_number=playblast_version)
+        finally:
+            if self.review_media:
+                self.review_media.cleanup()
 
-            self.mayaOutputPath = str(seq_name + padding + ext)
+        return self.playblastPath, version_entity
 
-            self.playblastPath = os.path.join(os.path.dirname(self.playblast_mov_path), '.source',
-                                              os.path.basename(self.playblastPath)).replace("\\", '/')
-            if not os.path.exists(os.path.dirname(self.playblastPath)):
-                os.makedirs(os.path.dirname(self.playblastPath))
+    def publish_image_sequence(self, playblast_version, staging_dir, stream_encoder, slate_data):
+        """
+        Publishes the captured frames into .source and encodes the slated movie.
+        :return: (pb_name, file_ext) of the published movie
+        """
+        self.emitter('Getting latest version: {}'.format(playblast_version))
+        self.mayaOutputPath = self.get_sequence_path(self.mayaOutputPath)
+        self._app.logger.debug("self.mayaOutputPath after formatting = {}".format(self.mayaOutputPath))
+
+        ffmpeg_mov = None
+        if stream_encoder:
+            # the encoder reads the captured frames by path, let it finish before they are renamed or moved
+            self.emitter('Finalizing streamed movie..')
+            ffmpeg_mov = stream_encoder.finish()
+        if staging_dir:
+            # frames were captured in place, only carried frames still need publishing
+            self.mayaOutputPath = self.rename_staged_frames(staging_dir)
+        carried = carry_forward_frames(range(self.playblastParams['startTime'],
+                                             self.playblastParams['endTime'] + 1),
+                                       self.mayaOutputPath,
+                                       self.get_staged_path(staging_dir) if staging_dir else self.playblastPath,
+                                       self.get_frame_publisher(move=True),
+                                       previous_store=self._previous_store,
+                                       unchanged=self._unchanged_frames,
+                                       carry_file=self.get_frame_publisher(),
+                                       runner=BulkTransfer(self._app.get_setting('transfer_workers', 16),
+                                                           emitter=self.emitter).run)
+        if carried:
+            self.emitter("{} unchanged frames carried forward from the previous version".format(carried))
+        if staging_dir:
+            self.publish_staging_dir(staging_dir)
+        if self.frame_fingerprints:
+            FingerprintStore(self.frame_fingerprints,
+                             os.path.basename(self.playblastPath)).save(os.path.dirname(self.playblastPath))
+
+        self.emitter("Playblast sequence copied to: {}".format(os.path.dirname(self.playblastPath)))
+        self.check_cancelled()
+
+        if not stream_encoder:
+            # Create slate
+            slate = self.slate.create_slate(self.playblastPath, slate_data)
+            ffmpeg_mov = self.slate.create_internal_mov(slate, self.playblastParams['startTime'])
+        self._app.logger.debug("publish_image_sequence: ffmpeg_mov = {}".format(ffmpeg_mov))
+        self.check_cancelled()
+        # the slate encode writes the review media in the same pass, the streamed mov needs one more
+        self.review_media = self.build_review_media(ffmpeg_mov) if stream_encoder else self.slate.review_media
 
-            self._app.logger.debug("self.mayaOutputPath after formatting = {}".format(self.mayaOutputPath))
-            self._app.logger.debug("seq_name= {0}, hashes= {1}, ext = {2}".format(seq_name, hashes, ext))
+        self.file_transfer.move_file(ffmpeg_mov, self.playblast_mov_path)
 
-            for i, frame_num in enumerate(range(self.playblastParams['startTime'],
-                                                self.playblastParams['endTime']+1)):
-                source = self.mayaOutputPath % frame_num
-                dest = self.playblastPath % frame_num
-                self._app.logger.debug('Copying {} -> {}'.format(os.path.basename(source), dest))
-                if os.path.exists(source):
-                    sgtk.util.filesystem.copy_file(source, dest)
+        self._app.logger.debug("self.playblast_mov_path(ffmpeg movie) = {}".format(self.playblast_mov_path))
+        return os.path.basename(self.playblast_mov_path).split(".")
 
-            self.emitter("Playblast sequence copied to: {}".format(os.path.dirname(self.playblastPath)))
+    def get_sequence_path(self, maya_output_path):
+        """
+        Returns the printf style path of a sequence cmds.playblast reports as eg /tmp/pb.####.jpg
+        """
+        dir_path = os.path.dirname(maya_output_path)
+        base_seq_name, hashes, ext = os.path.basename(maya_output_path).split(".")
+        seq_name = os.path.join(dir_path, base_seq_name).replace("\\", "/")
+        padding = '.%0{}d.'.format(hashes.count('#'))
+        return str(seq_name + padding + ext)
 
-            # format the movie path as per template with mov extension
-            # self.playblastParams['format'] = "mov"
-            # self.playblast_mov_path, playblast_version = self.format_output_path('mov')
-            # self.emitter('Getting latest version: {}'.format(playblast_version))
-            self.playblastParams['format'] = "image"
+    def build_publish_manifest(self, capture):
+        """
+        Serializes what finish_playblast needs into a json manifest the publish daemon runs
+        without maya, see publish_daemon.
+        :param capture: the capture state returned by capture_playblast
+        """
+        is_image = self.playblastParams['format'] == 'image'
+        movie_path = self.playblast_mov_path if is_image else self.playblastPath
+        try:
+            template_fields = self._tk.templates["playblast_mov"].get_fields(movie_path)
+        except Exception as err:
+            self._app.logger.debug("build_publish_manifest: {}".format(err))
+            template_fields = {}
+        user = sgtk.get_authenticated_user()
+
+        return {
+            'manifest_version': publish_daemon.MANIFEST_VERSION,
+            'job_id': '{}_{}'.format(os.path.basename(movie_path).split('.')[0], uuid.uuid4().hex[:8]),
+            'created': datetime.datetime.now().isoformat(),
+            'format': self.playblastParams['format'],
+            'playblast_params': dict(self.playblastParams),
+            'frames': {
+                'first': self.playblastParams['startTime'],
+                'last': self.playblastParams['endTime'],
+                'capture_path': self.get_sequence_path(self.mayaOutputPath) if is_image else self.mayaOutputPath,
+                'dest_path': self.playblastPath,
+                'previous_source_dir': self._previous_store.directory if self._previous_store else None,
+                'unchanged': self._unchanged_frames,
+                'fingerprints': self.frame_fingerprints,
+            },
+            'publish': {
+                'movie_path': movie_path,
+                'publish_name': os.path.basename(movie_path).split('.')[0][:-5],
+                'version_number': capture['playblast_version'],
+                'publish_type': self.publish_type,
+                'pass_type': self.pass_type,
+                'description': self.description,
+                'note_type': self.note_type,
+                'upload_to_sg': self.upload_to_sg,
+            },
+            'template_fields': template_fields,
+            'slate_data': capture['slate_data'],
+            'encoder_args': self.slate.encoder_args,
+            'settings': dict((name, self._app.get_setting(name, default)) for name, default in (
+                ('review_media', True),
+                ('numpy_burnin', True),
+                ('parallel_encode', True),
+                ('transfer_workers', 16),
+                ('frame_store_root', ''),
+                ('frame_store_max_size', '0'))),
+            'cache_location': self._app.cache_location,
+            'context': {
+                'entity': self._context.entity,
+                'project': self._context.project,
+                'user': self._context.user,
+                'task': self._context.task,
+            },
+            'sgtk': {
+                'python_path': os.path.dirname(os.path.dirname(os.path.abspath(sgtk.__file__))),
+                # the manifest stays on disk, the daemon authenticates from the session cache of the user
+                'context': self._context.serialize(with_user_credentials=False),
+                'host': user.host if user else None,
+                'login': user.login if user else None,
+            },
+        }
 
-            # Create slate
-            slate_data = self.gather_slate_data(playblast_version)
-            slate = self.slate.create_slate(self.playblastPath, slate_data)
-            ffmpeg_mov = self.slate.create_internal_mov(slate, self.playblastParams['startTime'])
-            self._app.logger.debug("createPlayblast: ffmpeg_mov = {}".format(ffmpeg_mov))
+    def get_publish_daemon_root(self):
+        return os.path.join(LocalFileStorageManager.get_global_root(LocalFileStorageManager.CACHE),
+                            'playblast_publish_daemon').replace("\\", '/')
 
-            sgtk.util.filesystem.copy_file(ffmpeg_mov, self.playblast_mov_path)
+    def submit_publish_job(self, capture):
+        """
+        Hands the publish of a captured playblast to the local publish daemon, starting it if
+        needed, so the publish completes even if maya is closed.
+        :param capture: the capture state returned by capture_playblast
+        :return: the job id
+        """
+        manifest = self.build_publish_manifest(capture)
+        root = self.get_publish_daemon_root()
+        publish_daemon.submit(root, manifest)
+        self.invalidate_sg_cache('PublishedFile')
+        if publish_daemon.start_daemon(root,
+                                       python=self._app.get_setting('publish_daemon_python', '') or get_mayapy(),
+                                       workers=self._app.get_setting('publish_daemon_workers', 2)):
+            self._app.logger.debug("submit_publish_job: started the publish daemon on {}".format(root))
+        self.emitter('Playblast queued for publishing: {}'.format(manifest['job_id']))
+        return manifest['job_id']
+
+    def set_emitter(self, emitter):
+        """
+        Routes the progress messages of the manager and its slate to emitter.
+        :return: the previous emitter
+        """
+        previous = self.emitter
+        self.emitter = emitter
+        self.slate.emitter = emitter
+        return previous
 
-            self._app.logger.debug("self.playblast_mov_path(ffmpeg movie) = {}".format(self.playblast_mov_path))
-            pb_name, file_ext = os.path.basename(self.playblast_mov_path).split(".")
+    def cancel(self):
+        """
+        Cancels the running publish: stops the encodes and makes finish_playblast raise
+        PlayblastCancelled at its next step. Once the Version is created the publish completes.
+        """
+        self.cancelled = True
+        self.cancel_encode()
 
-        if not self.upload_to_sg:
-            return self.playblastPath, None
+    def check_cancelled(self):
+        if self.cancelled:
+            raise PlayblastCancelled("Playblast cancelled")
 
-        self._app.logger.debug("Uploading to sg = {}".format(self.playblast_mov_path))
-        version_entity = self.upload_to_shotgun(publish_name=pb_name[:-5],
-                                                version_number=playblast_version)
+    def cancel_encode(self):
+        """
+        Stops the running encodes: kills their ffmpeg process trees and removes partial movies.
+        """
+        self.slate.cancel()
+        if self._stream_encoder:
+            self._stream_encoder.cancel()
 
-        return self.playblastPath, version_entity
+    def capture(self):
+        """
+        Runs the capture of the current playblast params, either in this maya or split in
+        chunks across headless mayapy workers for long image sequences.
+        :return: the maya output path as returned by cmds.playblast
+        """
+        if self._frames_to_capture is not None:
+            if not self._frames_to_capture:
+                self.emitter('No frames changed since the previous version, skipping capture..')
+                return self.get_capture_output()
+            params = dict(self.playblastParams)
+            params.pop('startTime')
+            params.pop('endTime')
+            params['frame'] = self._frames_to_capture
+            cmds.playblast(**params)
+            return self.get_capture_output()
+
+        frame_count = self.playblastParams['endTime'] - self.playblastParams['startTime'] + 1
+        if (self.batch_capture and self.playblastParams['format'] == 'image'
+                and frame_count >= self._app.get_setting('batch_capture_min_frames', 500)):
+            scene_path = cmds.file(query=True, sceneName=True)
+            if not scene_path or cmds.file(query=True, modified=True):
+                self.emitter('Scene has unsaved changes, capturing in this maya session..')
+            else:
+                chunked_capture = ChunkedCapture(self._app,
+                                                 scene_path,
+                                                 self.camera_shape,
+                                                 self.playblastParams,
+                                                 workers=self._app.get_setting('batch_capture_workers', 0) or None,
+                                                 emitter=self.emitter,
+                                                 display_settings=get_display_settings(
+                                                     cmds, cmds.getPanel(withFocus=True)),
+                                                 focal_length=self.focal_length)
+                try:
+                    return chunked_capture.run()
+                except CapturePanelError as e:
+                    self._app.logger.warning("Chunked capture unavailable, capturing in this maya session: "
+                                             "{}".format(e))
+                    self.emitter('Capturing in this maya session..')
+
+        return cmds.playblast(**self.playblastParams)
+
+    def get_capture_output(self):
+        """
+        Returns the output path of the current playblast params the way cmds.playblast
+        reports it, eg /tmp/maya_playblast_xyz.####.jpg
+        """
+        return '{0}.{1}.{2}'.format(self.playblastParams['filename'],
+                                    '#' * int(self.playblastParams['framePadding']),
+                                    self.playblastParams.get('compression') or 'jpg')
+
+    def get_capture_settings(self):
+        """
+        Capture settings that change every frame of a playblast when they change.
+        """
+        return dict((key, self.playblastParams.get(key)) for key in
+                    ('width', 'height', 'percent', 'quality', 'compression', 'showOrnaments')
+                    ) if self.playblastParams else {}
+
+    def get_frame_publisher(self, move=False):
+        """
+        Returns the callable(source, dest, size) that publishes a frame into the .source
+        directory: a hardlink into the shared frame store when one is configured, the
+        cheapest transfer the volumes allow otherwise.
+        :param move: the source frames may be consumed
+        """
+        frame_store_root = self._app.get_setting('frame_store_root', '')
+        if not frame_store_root:
+            return lambda source, dest, size: self.file_transfer.transfer(source, dest, move=move, size=size)
+
+        self._currentEngine.ensure_folder_exists(frame_store_root)
+        frame_store = FrameStore(frame_store_root,
+                                 parse_size(self._app.get_setting('frame_store_max_size', '0')),
+                                 logger=self._app.logger)
+        return lambda source, dest, size: frame_store.link(source, dest, move=move)
+
+    def get_previous_source_dir(self):
+        """
+        Returns the .source directory of the previous playblast version, None for v001.
+        """
+        template = self._tk.templates["playblast_mov"]
+        try:
+            fields = template.get_fields(self.playblast_mov_path)
+        except Exception as err:
+            self._app.logger.debug("get_previous_source_dir: {}".format(err))
+            return None
+        if int(fields.get('version') or 0) <= 1:
+            return None
+        fields['version'] = int(fields['version']) - 1
+        previous_mov_path = "".join(template.apply_fields(fields).split(" "))
+        return os.path.join(os.path.dirname(previous_mov_path), '.source').replace("\\", '/')
+
+    def plan_incremental_capture(self):
+        """
+        Fingerprints every frame of the range and compares them with the previous version,
+        so only the frames whose evaluated scene changed are captured again.
+        """
+        self.emitter('Fingerprinting frames..')
+        settings = self.get_capture_settings()
+        settings.update({'pass_type': self.pass_type, 'camera': self.camera_shape})
+        fingerprinter = FrameFingerprinter(cmds, self.camera_shape, settings)
+        self.frame_fingerprints = fingerprinter.fingerprint_range(self.playblastParams['startTime'],
+                                                                  self.playblastParams['endTime'])
+        if self.frame_fingerprints is None:
+            self.emitter('Scene has caches or simulations, capturing every frame..')
+            self._app.logger.debug("plan_incremental_capture: unsupported nodes {}".format(
+                fingerprinter.get_unsupported_nodes()))
+            return
+
+        self._previous_store = FingerprintStore.load(self.get_previous_source_dir())
+        if self._previous_store is None:
+            self._app.logger.debug("plan_incremental_capture: no fingerprints for the previous version")
+            return
+
+        changed, self._unchanged_frames = self._previous_store.split_frames(self.frame_fingerprints)
+        self._frames_to_capture = changed
+        self.emitter('{} of {} frames changed since the previous version'.format(len(changed),
+                                                                               len(self.frame_fingerprints)))
+
+    def resolve_output_paths(self, extension):
+        """
+        Formats the publish paths as per template and fetches the new version.
+        For image sequences this sets both the .source frames path and the mov path.
+        :param extension: jpg or avi
+        :return: the playblast version
+        """
+        if self.playblastParams['format'] != 'image':
+            self.playblastPath, playblast_version = self.format_output_path(extension)
+            self._app.logger.debug("formatted playblastPath = {}".format(self.playblastPath))
+            return playblast_version
+
+        # the frames carry the version of the movie, one reservation per playblast
+        self.playblastParams['format'] = "mov"
+        try:
+            self.playblast_mov_path, playblast_version = self.format_output_path('mov')
+        finally:
+            self.playblastParams['format'] = "image"
+        self.playblastPath, playblast_version = self.format_output_path(extension, version=playblast_version)
+        self._app.logger.debug("formatted playblastPath = {}".format(self.playblastPath))
+
+        self.playblastPath = os.path.join(os.path.dirname(self.playblast_mov_path), '.source',
+                                          os.path.basename(self.playblastPath)).replace("\\", '/')
+        if not os.path.exists(os.path.dirname(self.playblastPath)):
+            os.makedirs(os.path.dirname(self.playblastPath))
+
+        return playblast_version
+
+    def prepare_staging_dir(self):
+        """
+        Points the capture at a staging directory next to the .source directory, on the
+        same volume as the publish area, so publishing the sequence is a directory rename.
+        :return: the staging directory
+        """
+        source_dir = os.path.dirname(self.playblastPath)
+        staging_dir = os.path.join(os.path.dirname(source_dir), '.staging_{}'.format(uuid.uuid4().hex))
+        os.makedirs(staging_dir)
+        self.playblastParams['filename'] = os.path.join(staging_dir,
+                                                        os.path.basename(self.playblastPath).split('.')[0])
+        self._app.logger.debug("prepare_staging_dir: capturing into {}".format(staging_dir))
+        return staging_dir
+
+    def get_staged_path(self, staging_dir):
+        return os.path.join(staging_dir, os.path.basename(self.playblastPath)).replace("\\", '/')
+
+    def rename_staged_frames(self, staging_dir):
+        """
+        Renames captured frames whose padding differs from the publish template.
+        :return: printf style path of the captured frames
+        """
+        staged_path = self.get_staged_path(staging_dir)
+        capture_pattern = self.mayaOutputPath
+        if capture_pattern != staged_path:
+            for frame in range(self.playblastParams['startTime'], self.playblastParams['endTime'] + 1):
+                if os.path.exists(capture_pattern % frame):
+                    os.rename(capture_pattern % frame, staged_path % frame)
+        return staged_path
+
+    def publish_staging_dir(self, staging_dir):
+        """
+        Publishes the staged sequence by renaming the staging directory to .source.
+        """
+        source_dir = os.path.dirname(self.playblastPath)
+        if os.path.isdir(source_dir) and not os.listdir(source_dir):
+            os.rmdir(source_dir)
+
+        if not os.path.exists(source_dir):
+            os.rename(staging_dir, source_dir)
+        else:
+            self._app.logger.warning("publish_staging_dir: {} is not empty, moving frames".format(source_dir))
+            staged_path = self.get_staged_path(staging_dir)
+            BulkTransfer(self._app.get_setting('transfer_workers', 16), emitter=self.emitter).run(
+                build_transfer_plan(range(self.playblastParams['startTime'], self.playblastParams['endTime'] + 1),
+                                    staged_path, self.playblastPath,
+                                    lambda source, dest, size: self.file_transfer.transfer(source, dest, move=True,
+                                                                                          size=size)))
+            shutil.rmtree(staging_dir, ignore_errors=True)
+        self._app.logger.debug("publish_staging_dir: published {}".format(source_dir))
+
+    def get_capture_pattern(self):
+        """
+        Returns the printf style path of the frames cmds.playblast is about to write
+        for the current playblast params, eg /tmp/maya_playblast_xyz.%04d.jpg
+        """
+        return '{0}.%0{1}d.{2}'.format(self.playblastParams['filename'],
+                                       self.playblastParams['framePadding'],
+                                       self.playblastParams.get('compression') or 'jpg')
+
+    def start_streaming_encoder(self, playblast_version):
+        """
+        Starts encoding the mov from the frames maya writes while cmds.playblast is running.
+        :param playblast_version: version shown on the slate
+        :return: the running StreamingEncoder
+        """
+        slate_data = self.gather_slate_data(playblast_version)
+        self.slate.slate_data = slate_data
+        capture_pattern = self.get_capture_pattern()
+
+        stream_encoder = StreamingEncoder(
+            self._app,
+            capture_pattern,
+            self.playblastParams['startTime'],
+            self.playblastParams['endTime'],
+            self.slate.get_drawtext_string,
+            slate_factory=lambda first_frame_path: self.slate.create_slate(capture_pattern, slate_data),
+            encoder_args=self.slate.encoder_args,
+            frame_rate=slate_data['frame_rate']
+        )
+        stream_encoder.start()
+        self.emitter('Streaming frames to ffmpeg while capturing..')
+        return stream_encoder
 
     def get_resolution(self, res_w, res_h):
         """Reformat resolution to be limited with 2k"""
@@ -304,12 +850,13 @@ class PlayblastManager(object):
         height = cmds.getAttr('defaultResolution.height')
         return width, height
 
-    def format_output_path(self, ext):
+    def format_output_path(self, ext, version=None):
         """
         function to format output file path as per template.
             maya_playblast_publish_image
             maya_playblast_publish_mov
         in templates.yml in config
+        :param version: version of the path, the next one is reserved when not given
         :return:
              publishPath: formatted output file path
         """
@@ -319,15 +866,14 @@ class PlayblastManager(object):
         template = None
 
         try:
-            folders = self._tk.create_filesystem_structure("Task", self._context.task["id"])
+            # once per task and session, see folder_cache
+            folders = self.folder_cache.ensure_folders("Task", self._context.task["id"])
             self._app.logger.debug("folders created = {}".format(folders))
             self._app.logger.debug("create_filesystem_structure done")
-        except:
-            print(Exception)
-            self._app.logger.debug("create_filesystem_structure failed")
+        except Exception as e:
+            self._app.logger.debug("create_filesystem_structure failed: {}".format(e))
 
-        print("print in maya - self.playblastParams.keys()) = {}".format(self.playblastParams.keys()))
-        print("print in maya - self.playblastParams.values()) = {}".format(self.playblastParams.values()))
+        self._app.logger.debug("format_output_path: playblastParams = {}".format(self.playblastParams))
 
         if str(self.playblastParams.get('format')) == "image":
             template = self._tk.templates["playblast_image"]
@@ -336,27 +882,25 @@ class PlayblastManager(object):
         else:
             self._app.logger.error("playblast format not supported")
 
-        fields = self._context.as_template_fields(template)
-        pprint.pprint(fields)
+        fields = self.folder_cache.get_template_fields(self._context, template)
         self._app.logger.debug("fields: {}".format(fields))
 
         # TODO: generated path's ext
         fields["ext"] = ext
         fields["publish_type"] = self.publish_type
-        fields["plate_name"] = self.get_plate_name()
+        fields["plate_name"] = self.get_plate_name() if self.plate_name is None else self.plate_name
         fields["height"] = int(self.playblastParams['height'])
         fields["width"] = int(self.playblastParams['width'])
         fields["version"] = 0
         # self.get_next_version_number(template, fields)
         fields["pass_type"] = self.pass_type
-        print ("field values assigned", fields)
 
         self._app.logger.debug("fields assigned: {}".format(fields))
         publishPath = template.apply_fields(fields)
         self._app.logger.debug("get_playblast_ver(): 1) publishPath: {}".format(publishPath))
 
         # fetch latest publish version from shotgun and apply the incremented version to publish path
-        published_version = self.get_published_version(publishPath, self.publish_type)
+        published_version = version or self.get_published_version(publishPath, self.publish_type)
         fields["version"] = published_version
         publishPath = template.apply_fields(fields)
 
@@ -364,10 +908,12 @@ class PlayblastManager(object):
         # create folders and touch the publish file path
         try:
             self._app.logger.debug("trying sgtk to create the publishPath")
-            self._currentEngine.ensure_folder_exists(os.path.dirname(publishPath))
+            if not os.path.isdir(os.path.dirname(publishPath)):
+                self._currentEngine.ensure_folder_exists(os.path.dirname(publishPath))
             sgtk.util.filesystem.touch_file(publishPath % (self.playblastParams['startTime']))
             self._app.logger.debug("sgtk publishPath touched = {}".format(publishPath))
-        except:
+        except Exception as e:
+            self._app.logger.debug("Could not touch the publishPath with sgtk: {}".format(e))
             if not os.path.exists(os.path.dirname(publishPath)):
                 self._app.logger.debug("Creating publishPath directories using os module")
                 os.makedirs(os.path.dirname(publishPath))
@@ -382,6 +928,31 @@ class PlayblastManager(object):
 
         return publishPath, fields["version"]
 
+    def get_next_version(self, pass_type=None, playblast_format=None, width=None, height=None):
+        """
+        Looks up the version the next movie playblast of a pass type gets, without creating
+        folders or touching the publish path like format_output_path does. Only talks to
+        Shotgun so it can run on any thread.
+        :param pass_type: the current pass type when not given
+        :param playblast_format: format the playblast will be captured in, the playblastParams one when not given
+        :param width: width of the playblast, the playblastParams one when not given
+        :param height: height of the playblast, the playblastParams one when not given
+        """
+        playblast_format = playblast_format or self.playblastParams['format']
+        template = self._tk.templates["playblast_mov"]
+        fields = self.folder_cache.get_template_fields(self._context, template)
+        fields.update({
+            "ext": 'mov' if playblast_format == 'image' else playblast_format,
+            "publish_type": self.publish_type,
+            "plate_name": self.get_plate_name() if self.plate_name is None else self.plate_name,
+            "height": int(height or self.playblastParams['height']),
+            "width": int(width or self.playblastParams['width']),
+            "version": 0,
+            "pass_type": pass_type or self.pass_type,
+        })
+        path = "".join(template.apply_fields(fields).split(" "))
+        return self.get_published_version(path, self.publish_type, increment=False) + 1
+
     def get_published_version(self, path, publish_type=None, increment=True):
         """
         checks for existing versions of playblast path on shotgun and increments the value by 1,
@@ -411,17 +982,11 @@ class PlayblastManager(object):
                 ['project', 'is', self._context.project]
             )
         publish_type = self.publish_type
-        publisher = self._currentEngine.apps.get("tk-multi-publish2")
-        # ensure we have the publisher instance.
-        if not publisher:
-            raise Exception("The publisher is not configured for this context.")
-        path_info = publisher.util.get_file_path_components(path)
-        filename = path_info['filename']
+        filename = os.path.basename(path)
         self._app.logger.debug("filename = {0}".format(filename))
-        if self.playblastParams.get('format') == 'image':
-            name, padding, extension = filename.rsplit('.')
-        else:
-            name, extension = filename.rsplit('.')
+        # name.ext or name.%04d.ext
+        parts = filename.rsplit('.')
+        name, extension = parts[0], parts[-1]
         self._app.logger.debug("filename = {0}, name = {1}".format(filename, name[:-5]))
 
         # build filters now
@@ -440,23 +1005,65 @@ class PlayblastManager(object):
 
         self._app.logger.debug("get_playblast_ver: filters = {}".format(filters))
 
-        available_records = publisher.sgtk.shotgun.find_one(
-            entity_type='PublishedFile',
-            filters=filters,
-            fields=['version_number'],
-            order=[{'field_name': 'version_number', 'direction': 'desc'}]
-        )
-        self._app.logger.debug("available_records = {}".format(available_records))
-        if available_records:
-            latest_version = available_records['version_number']
-        else:
-            latest_version = 0
+        def lookup():
+            order = [{'field_name': 'version_number', 'direction': 'desc'}]
+            if increment:
+                # reservations need the published number as it is now, not the one in the lookup cache
+                available_records = self._context.sgtk.shotgun.find_one('PublishedFile', filters, ['version_number'],
+                                                                        order=order)
+            else:
+                available_records = self.sg_find_one('PublishedFile', filters, ['version_number'], order=order,
+                                                     scope=self._context.entity)
+            self._app.logger.debug("available_records = {}".format(available_records))
+            return available_records['version_number'] if available_records else 0
+
+        # one query per published file name, concurrent playblasts of the machine get their own numbers
+        key = (self._tk.shotgun_url, self._context.entity['type'], self._context.entity['id'], name[:-5], extension,
+               publish_type)
         if increment:
-            latest_version += 1
+            latest_version = self.version_allocator.reserve(key, lookup)
+            self._version_reservation = (key, latest_version)
+        else:
+            latest_version = self.version_allocator.latest(key, lookup)
 
         self._app.logger.debug("get_published_version: latest_version = {}".format(latest_version))
         return latest_version
 
+    def release_version(self):
+        """
+        Gives the version reserved by the last capture back, for captures that failed before publishing anything.
+        """
+        if self._version_reservation and self.version_allocator.release(*self._version_reservation):
+            self._app.logger.debug("release_version: released {}".format(self._version_reservation))
+        self._version_reservation = None
+
+    def sg_find_one(self, entity_type, filters, fields, order=None, scope=None, shotgun=None):
+        """
+        shotgun.find_one through the lookup cache, see sg_cache.ShotgunCache.find_one.
+        :param scope: the entity the lookup is about, dropped from the cache with it
+        :param shotgun: connection to query, the one of the context by default
+        """
+        shotgun = shotgun or self._context.sgtk.shotgun
+        if self.sg_cache is None:
+            return shotgun.find_one(entity_type, filters, fields, order=order)
+        return self.sg_cache.find_one(shotgun, entity_type, filters, fields, order=order, scope=scope)
+
+    def sg_find(self, entity_type, filters, fields, order=None, limit=0, scope=None, shotgun=None):
+        """
+        shotgun.find through the lookup cache, see sg_find_one.
+        """
+        shotgun = shotgun or self._context.sgtk.shotgun
+        if self.sg_cache is None:
+            return shotgun.find(entity_type, filters, fields, order=order, limit=limit)
+        return self.sg_cache.find(shotgun, entity_type, filters, fields, order=order, limit=limit, scope=scope)
+
+    def invalidate_sg_cache(self, query_type=None):
+        """
+        Drops the cached lookups about the context entity, optionally only those of one queried entity type.
+        """
+        if self.sg_cache is not None and self._context.entity:
+            self.sg_cache.invalidate(self._context.entity['type'], self._context.entity['id'], query_type)
+
     def get_next_version_number(self, template, fields):
         """
         # Get a list of existing file paths on disk that match the template and provided fields
@@ -506,26 +1113,20 @@ class PlayblastManager(object):
                 context: sgtk.Context, *Optional* if not provided
                     uses current entity
             Returns:
-                str: plate name parsed from PublishedFile of type Image
-        """
-        pass_name = 'Main'
-        # plates = get_plate_entity(context)
-        plates = self._context.sgtk.shotgun.find(
-            'PublishedFile',
-            [
-                ['entity', 'is', self._context.entity],
-                ['sg_pass_type', 'is', pass_name]
-            ],
-            ['sg_client_name', 'description'],
-            order=[{'field_name': 'sg_version_number', 'direction': 'desc'}]
-        ) or []
-
-        plate_names = list()
-        for plate in plates:
-            plate_names.append(self.get_plate_name_from_entity(plate))
-
-        self._app.logger.debug("plate_names = {}".format(plate_names))
-        return plate_names[0]
+                str: plate name parsed from the latest PublishedFile of pass type Main,
+                    kept in the plate index so repeat playblasts do not query it
+        """
+        shotgun = self._context.sgtk.shotgun
+        if self.plate_index:
+            plate_name = self.plate_index.get_plate_name(shotgun, self._context.entity, self.get_plate_name_from_entity)
+        else:
+            plate = find_latest_plate(shotgun, self._context.entity)
+            plate_name = self.get_plate_name_from_entity(plate) if plate else None
+        if plate_name is None:
+            raise IndexError("No Main plate published for {}".format(self._context.entity))
+
+        self._app.logger.debug("plate_name = {}".format(plate_name))
+        return plate_name
 
     def upload_to_shotgun(self, publish_name, version_number):
         """
@@ -533,9 +1134,6 @@ class PlayblastManager(object):
 
         :return:
         """
-        # register new Version entity in shotgun or update existing version
-        self.emitter('Uploading media to Shotgun entity')
-
         self._app.logger.debug('MOV PATH FOR VERSION ENTITY: format = {}'.format(self.playblastParams['format']))
         if self.playblastParams['format'] == 'image':
             self._app.logger.debug('self.playblast_mov_path: {}'.format(self.playblast_mov_path))
@@ -544,57 +1142,55 @@ class PlayblastManager(object):
             self._app.logger.debug('playblastPath: {}'.format(self.playblastPath))
             movie_to_upload = self.playblastPath
 
-        playblast_version_entity = self._context.sgtk.shotgun.create(
-            'Version',
-            {
-                'code': os.path.basename(movie_to_upload),
-                'entity': self._context.entity,
-                'project': self._context.project,
-                'user': self._context.user,
-                # 'description': self.description,  # 'Version creation from playblast tool',
-                'sg_path_to_movie': movie_to_upload,
-                'sg_path_to_frames': self.playblastPath,
-                'sg_version_type': 'Artist Version',
-                'sg_task': self._context.task or None,
-                'sg_first_frame': self.playblastParams['startTime'],
-                'sg_last_frame': self.playblastParams['endTime']
-            }
-        )
-
-        if self.description:
-            self._context.sgtk.shotgun.create(
-                'Note',
-                data={
-                    'note_links': [self._context.entity, playblast_version_entity] or None,
-                    'project': self._context.project,
-                    'subject': 'Playblast from {}'.format(os.path.basename(movie_to_upload)),
-                    'content': self.description,
-                    'sg_note_type': self.note_type
-                }
-            )
-
-        self._context.sgtk.shotgun.upload(
-            'Version', playblast_version_entity['id'], movie_to_upload, 'sg_uploaded_movie'
-        )
-        self._app.logger.debug('version_entity: {}', playblast_version_entity)
-
-        self.emitter('Registering playblast on shotgun as PublishedFile..')
-        sgtk.util.register_publish(
-            self._tk,
-            self._context,
+        # register new Version entity in shotgun or update existing version
+        playblast_version_entity = self.get_version_publisher().publish(
             movie_to_upload,
+            self.playblastPath,
+            self.playblastParams['startTime'],
+            self.playblastParams['endTime'],
             publish_name,
             version_number,
-            # comment=self.description,
-            published_file_type=self.publish_type,
-            version_entity=playblast_version_entity,
-            sg_fields={'sg_pass_type': self.pass_type.lower()}
-        )
-
+            self.publish_type,
+            self.pass_type,
+            description=self.description,
+            note_type=self.note_type,
+            review_media=self.review_media)
+        # the cached latest version of the shot is behind now
+        self.invalidate_sg_cache('PublishedFile')
+
+        if self.upload_queue:
+            start_uploads(self._app, self._tk, self.upload_queue)
         self._app.log_info("Playblast uploaded to shotgun")
 
         return playblast_version_entity
 
+    def get_version_publisher(self):
+        return VersionPublisher(self._tk, self._context, sgtk.util.register_publish, logger=self._app.logger,
+                                emitter=self.emitter, upload_queue=self.upload_queue)
+
+    def get_upload_counts(self):
+        """
+        Returns {state: number of uploads} of the upload queue for the current site.
+        """
+        if not self.upload_queue:
+            return {}
+        return self.upload_queue.counts(self._tk.shotgun_url)
+
+    def build_review_media(self, movie_path):
+        """
+        Derives the proxy, thumbnail and filmstrip from a finished movie.
+        :return: ReviewMedia, None when disabled or ffmpeg failed
+        """
+        if not self._app.get_setting('review_media', True):
+            return None
+        frame_count = self.playblastParams['endTime'] - self.playblastParams['startTime'] + 1
+        try:
+            return ReviewMedia(frame_count, ffmpeg).extract(movie_path, startupinfo=get_startupinfo(),
+                                                            emitter=self.emitter)
+        except Exception as e:
+            self._app.logger.warning("Could not build the review media: {}".format(e))
+            return None
+
     def gather_slate_data(self, playblast_version):
         context = self._context
         data = {
@@ -645,13 +1241,6 @@ class PlayblastManager(object):
         else:
             return '%s mm' % round(float(cmds.getAttr('%s.focalLength' % self.camera_shape)), 2)
 
-    def get_focal_length(self):
-        # self.emitter('self.camera_shape.. %s' % self.camera_shape)
-        if self.camera_shape:
-            return '%smm' % round(float(cmds.getAttr('%s.focalLength' % self.camera_shape)), 2)
-        else:
-            return '%smm' % self.focal_length
-
     def get_current_camera(self):
         panel = cmds.getPanel(withFocus=True)
 
@@ -678,17 +1267,35 @@ class PlayblastManager(object):
     @property
     def client_info(self):
 
-        client_info = self._context.sgtk.shotgun.find_one(
-            'CustomNonProjectEntity30', [['sg_projects', 'is', self._context.project]], ['sg_client_code'])
+        client_info = self.sg_find_one('CustomNonProjectEntity30', [['sg_projects', 'is', self._context.project]],
+                                       ['sg_client_code'], scope=self._context.project)
 
         return client_info
 
-    def get_defaults_values(self):
+    def get_client_defaults(self):
+        """
+        Returns the parsed defaults.yml and the client spec of the current project, defaults.yml is
+        read once per manager.
+        """
         from tank_vendor import yaml
         client_code = self.client_info['sg_client_code']
-        setting_yaml_file = BASE_DIR_PATH.replace('/python/playblast', '/resources/defaults.yml')
-        fopen = open(setting_yaml_file)
-        yaml_data = yaml.load(fopen)
+        if self._defaults_data is None:
+            setting_yaml_file = BASE_DIR_PATH.replace('/python/playblast', '/resources/defaults.yml')
+            with open(setting_yaml_file) as fopen:
+                self._defaults_data = yaml.load(fopen)
+        yaml_data = self._defaults_data
         client_data = yaml_data[client_code] if client_code in yaml_data else yaml_data['default_options']
+        return yaml_data, client_data
+
+    def get_defaults_values(self):
+        yaml_data, client_data = self.get_client_defaults()
 
         return client_data['camera_type'], client_data['pass_type'], client_data['frame_padding'], client_data['scale']
+
+    def get_encoder_profile(self):
+        """
+        Returns the compiled encoder profile of the current client, see encoder_profiles.
+        """
+        yaml_data, client_data = self.get_client_defaults()
+        name = client_data.get('encoder_profile', encoder_profiles.DEFAULT_PROFILE)
+        return encoder_profiles.get_profile(name, yaml_data.get('encoder_profiles'))
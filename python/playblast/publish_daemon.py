@@ -0,0 +1,766 @@
+"""
+Local publish daemon, finishes playblasts after maya is closed.
+
+With the publish_daemon setting on, maya only captures the frames. PlayblastManager writes
+a json job manifest holding everything the rest of the publish needs and hands it to a
+daemon process detached from maya. The daemon publishes the frames into .source, slates and
+encodes the movie, builds the review media and runs the Shotgun steps.
+
+The queue lives on disk under the daemon root:
+
+    queue/<job>.json      submitted, waiting for a worker
+    running/<job>.json    claimed by a worker, records the steps done so far
+    running/<job>.pid     process id of the daemon that claimed the job
+    done/<job>.json       published
+    failed/<job>.json     failed, the manifest holds the error
+    work/<job>/           review media kept between the encode and the upload
+    status.json           heartbeat of the daemon and the state of the jobs it ran
+    daemon.lock           held by the daemon serving the root, for its lifetime
+    daemon.log
+
+Jobs move between the directories with renames, so submitting and claiming a job are
+atomic. Only the daemon holding daemon.lock serves a root: one started while another holds
+it waits for it a little, in case it is exiting, then exits. The daemon holding the lock puts
+the jobs left in running/ by one that died back in the queue, they resume after their last
+finished step so a Version is never created twice. Jobs whose owner process is still alive
+are left alone. The daemon exits once it has been idle for a while, maya starts a new one on
+submit.
+
+Manifests hold no Shotgun credentials: the daemon authenticates as the submitting user from
+the session cache sgtk keeps for them on this machine. A published job drops its serialized
+context, and done and failed jobs are purged once older than FINISHED_MAX_AGE.
+
+    python publish_daemon.py serve --root ROOT [--workers 2] [--stub-shotgun calls.jsonl]
+    python publish_daemon.py submit --root ROOT manifest.json
+    python publish_daemon.py status --root ROOT
+    python publish_daemon.py retry --root ROOT [JOB ...]
+    python publish_daemon.py purge --root ROOT [--max-age DAYS]
+
+--stub-shotgun runs the Shotgun steps against stubs.StubShotgun and records its calls.
+"""
+import argparse
+import errno
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+import traceback
+import types
+
+if __name__ == '__main__' and not __package__:
+    # started as a script: load the sibling modules as the playblast package without
+    # running its __init__, which imports the maya dialog
+    _package = types.ModuleType('playblast')
+    _package.__path__ = [os.path.dirname(os.path.abspath(__file__))]
+    sys.modules['playblast'] = _package
+    __package__ = 'playblast'
+
+from .compat import futures, replace
+from .fingerprint import FingerprintStore, carry_forward_frames
+from .frame_store import FrameStore, parse_size
+from .transfer import BulkTransfer, FileTransfer
+
+MANIFEST_VERSION = 1
+DEFAULT_WORKERS = 2
+POLL_INTERVAL = 1.0
+# a daemon whose status is older than this is considered dead
+HEARTBEAT_TIMEOUT = 15.0
+# seconds a daemon waits for the lock of a daemon that is exiting
+LOCK_TIMEOUT = HEARTBEAT_TIMEOUT
+IDLE_TIMEOUT = 600.0
+# seconds done and failed jobs are kept
+FINISHED_MAX_AGE = 7 * 24 * 3600.0
+# finished jobs kept in status.json
+STATUS_HISTORY = 50
+STEPS = ('frames', 'movie', 'version', 'upload', 'publish')
+QUEUE_DIRS = ('queue', 'running', 'done', 'failed', 'work')
+
+logger = logging.getLogger('playblast.publish_daemon')
+
+
+def write_json(path, data):
+    """
+    Writes json atomically: readers never see a partial file.
+    """
+    tmp_path = '{}.{}.{}.tmp'.format(path, os.getpid(), threading.current_thread().ident)
+    with open(tmp_path, 'w') as fh:
+        json.dump(data, fh, indent=1, sort_keys=True)
+    replace(tmp_path, path)
+
+
+def read_json(path):
+    try:
+        with open(path) as fh:
+            return json.load(fh)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def make_dirs(root):
+    for name in QUEUE_DIRS:
+        path = os.path.join(root, name)
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+
+def submit(root, manifest):
+    """
+    Queues a job manifest.
+    :return: path of the queued manifest
+    """
+    make_dirs(root)
+    path = os.path.join(root, 'queue', '{}.json'.format(manifest['job_id']))
+    write_json(path, manifest)
+    return path
+
+
+def retry(root, job_ids=None):
+    """
+    Queues failed jobs again, they resume after their last finished step.
+    :param job_ids: jobs to retry, every failed job when None
+    :return: the queued job ids
+    """
+    failed_dir = os.path.join(root, 'failed')
+    queued = []
+    for name in sorted(os.listdir(failed_dir)):
+        job_id = name[:-len('.json')]
+        if not name.endswith('.json') or (job_ids and job_id not in job_ids):
+            continue
+        os.rename(os.path.join(failed_dir, name), os.path.join(root, 'queue', name))
+        queued.append(job_id)
+    return queued
+
+
+def purge(root, max_age=FINISHED_MAX_AGE):
+    """
+    Removes the done and failed jobs older than max_age seconds, with their work directory.
+    :return: the purged job ids
+    """
+    purged = []
+    limit = time.time() - max_age
+    for folder in ('done', 'failed'):
+        folder_path = os.path.join(root, folder)
+        if not os.path.isdir(folder_path):
+            continue
+        for name in sorted(os.listdir(folder_path)):
+            path = os.path.join(folder_path, name)
+            try:
+                if not name.endswith('.json') or os.path.getmtime(path) > limit:
+                    continue
+                os.remove(path)
+            except OSError:
+                continue
+            job_id = name[:-len('.json')]
+            shutil.rmtree(os.path.join(root, 'work', job_id), ignore_errors=True)
+            purged.append(job_id)
+    return purged
+
+
+def read_status(root):
+    return read_json(os.path.join(root, 'status.json'))
+
+
+def is_process_alive(pid):
+    """
+    True when a process of this machine with the pid runs.
+    """
+    if os.name == 'nt':
+        import ctypes
+        # PROCESS_QUERY_LIMITED_INFORMATION
+        handle = ctypes.windll.kernel32.OpenProcess(0x1000, False, pid)
+        if not handle:
+            return False
+        exit_code = ctypes.c_ulong()
+        ctypes.windll.kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code))
+        ctypes.windll.kernel32.CloseHandle(handle)
+        # STILL_ACTIVE
+        return exit_code.value == 259
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        # EPERM: alive, owned by another user
+        return e.errno == errno.EPERM
+    return True
+
+
+def is_running(root):
+    """
+    True when a daemon is serving root: its heartbeat is recent and its process alive.
+    A quick check before starting one, DaemonLock decides which daemon serves.
+    """
+    status = read_status(root)
+    if not status or status.get('stopped') or time.time() - status.get('updated', 0) > HEARTBEAT_TIMEOUT:
+        return False
+    return is_process_alive(status['pid'])
+
+
+class DaemonLock(object):
+    """
+    Exclusive lock of a daemon root, released by the system when its process dies.
+    The file holds the process id of the owner.
+    """
+
+    def __init__(self, root):
+        self.path = os.path.join(root, 'daemon.lock')
+        self._fh = None
+
+    def _lock(self):
+        if os.name == 'nt':
+            import msvcrt
+            self._fh.seek(0)
+            msvcrt.locking(self._fh.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(self._fh.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    def acquire(self, timeout=0):
+        """
+        :param timeout: seconds to wait for the owner to release it
+        :return: True when locked by this process
+        """
+        self._fh = open(self.path, 'a+')
+        deadline = time.time() + timeout
+        while True:
+            try:
+                self._lock()
+                break
+            except (IOError, OSError):
+                if time.time() >= deadline:
+                    self._fh.close()
+                    self._fh = None
+                    return False
+                time.sleep(min(POLL_INTERVAL, max(0.01, deadline - time.time())))
+        self._fh.seek(0)
+        self._fh.truncate()
+        self._fh.write(str(os.getpid()))
+        self._fh.flush()
+        return True
+
+    def release(self):
+        if self._fh is None:
+            return
+        if os.name == 'nt':
+            import msvcrt
+            self._fh.seek(0)
+            msvcrt.locking(self._fh.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(self._fh.fileno(), fcntl.LOCK_UN)
+        self._fh.close()
+        self._fh = None
+
+    def get_owner(self):
+        """
+        :return: process id written by the last owner, None when unknown
+        """
+        try:
+            with open(self.path) as fh:
+                return int(fh.read().strip())
+        except (IOError, OSError, ValueError):
+            return None
+
+
+def start_daemon(root, python=None, workers=DEFAULT_WORKERS, stub_shotgun=None):
+    """
+    Starts a daemon serving root, detached from the calling process so it outlives it.
+    :param python: python executable running the daemon, needs OpenImageIO and the sgtk core
+    :return: True when a daemon was started, False when one is already running
+    """
+    if is_running(root):
+        return False
+    make_dirs(root)
+    args = [python or sys.executable, os.path.abspath(__file__).replace('.pyc', '.py'),
+            'serve', '--root', root, '--workers', str(workers)]
+    if stub_shotgun:
+        args += ['--stub-shotgun', stub_shotgun]
+
+    kwargs = {}
+    if os.name == 'nt':
+        # DETACHED_PROCESS | CREATE_NEW_PROCESS_GROUP
+        kwargs['creationflags'] = 0x00000008 | 0x00000200
+    else:
+        kwargs['preexec_fn'] = os.setsid
+    with open(os.devnull, 'rb') as stdin, open(os.path.join(root, 'daemon.out'), 'ab') as out:
+        subprocess.Popen(args, stdin=stdin, stdout=out, stderr=subprocess.STDOUT, close_fds=True, **kwargs)
+    return True
+
+
+class ManifestContext(object):
+    """
+    The part of an sgtk Context the publish steps use, from the manifest.
+    """
+
+    def __init__(self, data):
+        self.entity = data.get('entity')
+        self.project = data.get('project')
+        self.user = data.get('user')
+        self.task = data.get('task')
+
+
+class JobApp(object):
+    """
+    The part of the toolkit app Slate uses, answered from the manifest.
+    """
+
+    def __init__(self, settings, logger, cache_location):
+        self.settings = settings
+        self.logger = logger
+        self.cache_location = cache_location
+
+    def get_setting(self, name, default=None):
+        return self.settings.get(name, default)
+
+
+def connect_shotgun(manifest):
+    """
+    Returns (tk, context, register_publish) of the site the manifest was submitted from.
+    The context is serialized without credentials, the submitting user is authenticated from
+    the session cache of this machine before it is deserialized.
+    """
+    python_path = manifest['sgtk']['python_path']
+    if python_path not in sys.path:
+        sys.path.insert(0, python_path)
+    import sgtk
+    from sgtk.authentication import ShotgunAuthenticator
+
+    authenticator = ShotgunAuthenticator()
+    if manifest['sgtk'].get('login'):
+        # reads the session token of the user from the session cache, raises when they are logged out
+        user = authenticator.create_session_user(manifest['sgtk']['login'], host=manifest['sgtk'].get('host'))
+    else:
+        user = authenticator.get_default_user()
+    if user is None:
+        raise RuntimeError("No Shotgun session cached for the daemon, log in to Shotgun and retry the job")
+    sgtk.set_authenticated_user(user)
+    context = sgtk.Context.deserialize(manifest['sgtk']['context'])
+    return context.sgtk, context, sgtk.util.register_publish
+
+
+def stub_shotgun_factory(record_path):
+    """
+    Returns a shotgun factory running every job against one recording StubShotgun.
+    """
+    from . import stubs
+    tk = stubs.StubTk(stubs.StubShotgun(record_path))
+    return lambda manifest: (tk, ManifestContext(manifest['context']), stubs.register_publish)
+
+
+class PublishJob(object):
+    """
+    Runs the steps of one manifest, recording each finished step so a restart resumes.
+    """
+
+    def __init__(self, manifest, path, work_dir, shotgun_factory, emitter=None):
+        """
+        Construction
+        :param manifest: the job manifest, see PlayblastManager.build_publish_manifest
+        :param path: file the manifest and its progress are saved to
+        :param work_dir: directory kept for the job until it is done
+        :param shotgun_factory: callable(manifest) returning (tk, context, register_publish)
+        :param emitter: optional callable receiving progress messages
+        """
+        self.manifest = manifest
+        self.path = path
+        self.work_dir = work_dir
+        self.shotgun_factory = shotgun_factory
+        self.emitter = emitter or logger.info
+        self.state = manifest.setdefault('state', {'steps': []})
+        self.step = None
+        self._publisher = None
+
+    @property
+    def job_id(self):
+        return self.manifest['job_id']
+
+    @property
+    def is_image(self):
+        return self.manifest['format'] == 'image'
+
+    @property
+    def frame_count(self):
+        frames = self.manifest['frames']
+        return frames['last'] - frames['first'] + 1
+
+    def save(self):
+        write_json(self.path, self.manifest)
+
+    def run(self):
+        for step in STEPS:
+            if step in self.state['steps']:
+                continue
+            self.step = step
+            self.emitter('{}: {}'.format(self.job_id, step))
+            getattr(self, 'run_{}'.format(step))()
+            self.state['steps'].append(step)
+            self.save()
+        self.step = None
+
+    def get_frame_publisher(self, move=False):
+        settings = self.manifest['settings']
+        if not settings.get('frame_store_root'):
+            transfer = FileTransfer(logger=logger)
+            return lambda source, dest, size: transfer.transfer(source, dest, move=move, size=size)
+        frame_store = FrameStore(settings['frame_store_root'], parse_size(settings.get('frame_store_max_size') or '0'),
+                                 logger=logger)
+        return lambda source, dest, size: frame_store.link(source, dest, move=move)
+
+    def run_frames(self):
+        frames = self.manifest['frames']
+        if not self.is_image:
+            # a restarted job finds the movie already moved
+            if os.path.exists(frames['capture_path']):
+                FileTransfer(logger=logger).move_file(frames['capture_path'], frames['dest_path'])
+            return
+
+        unchanged = frames.get('unchanged') or []
+        previous_store = FingerprintStore.load(frames.get('previous_source_dir')) if unchanged else None
+        carried = carry_forward_frames(range(frames['first'], frames['last'] + 1),
+                                       frames['capture_path'],
+                                       frames['dest_path'],
+                                       self.get_frame_publisher(move=True),
+                                       previous_store=previous_store,
+                                       unchanged=unchanged,
+                                       carry_file=self.get_frame_publisher(),
+                                       runner=BulkTransfer(self.manifest['settings'].get('transfer_workers', 16),
+                                                           emitter=self.emitter).run)
+        if carried:
+            self.emitter("{} unchanged frames carried forward from the previous version".format(carried))
+        if frames.get('fingerprints'):
+            FingerprintStore(frames['fingerprints'],
+                             os.path.basename(frames['dest_path'])).save(os.path.dirname(frames['dest_path']))
+
+    def get_review_media(self):
+        from .review_media import ReviewMedia
+        from .slate import ffmpeg
+        return ReviewMedia(self.frame_count, ffmpeg, directory=os.path.join(self.work_dir, 'review'))
+
+    def run_movie(self):
+        # the encode modules need OpenImageIO, only import them when a job runs
+        from .slate import Slate, get_startupinfo
+
+        settings = self.manifest['settings']
+        frames = self.manifest['frames']
+        publish = self.manifest['publish']
+        review_media = self.get_review_media()
+        if not os.path.isdir(review_media.directory):
+            os.makedirs(review_media.directory)
+
+        if not self.is_image:
+            if settings.get('review_media', True):
+                try:
+                    review_media.extract(publish['movie_path'], startupinfo=get_startupinfo(), emitter=self.emitter)
+                except Exception as e:
+                    logger.warning("{}: could not build the review media: {}".format(self.job_id, e))
+            return
+
+        slate = Slate(JobApp(settings, logger, self.manifest['cache_location']),
+                      dict(self.manifest['playblast_params']),
+                      frames['dest_path'],
+                      self.manifest['slate_data'].get('focal_length'))
+        slate.encoder_args = self.manifest['encoder_args']
+        slate.emitter = self.emitter
+        slate_path = slate.create_slate(frames['dest_path'], self.manifest['slate_data'])
+        mov_path = slate.create_internal_mov(slate_path, frames['first'])
+        if not mov_path:
+            raise RuntimeError("Encoding {} failed".format(publish['movie_path']))
+        if slate.review_media and slate.review_media.exists:
+            # keep the review media of the encode with the job, the upload may only run after a restart
+            for source, dest in zip(slate.review_media.paths, review_media.paths):
+                shutil.move(source, dest)
+            slate.review_media.cleanup()
+        FileTransfer(logger=logger).move_file(mov_path, publish['movie_path'])
+
+    def get_publisher(self):
+        if self._publisher is None:
+            from .version_publish import VersionPublisher
+            tk, context, register_publish = self.shotgun_factory(self.manifest)
+            self._publisher = VersionPublisher(tk, context, register_publish, logger=logger, emitter=self.emitter)
+        return self._publisher
+
+    def run_version(self):
+        if not self.manifest['publish']['upload_to_sg']:
+            return
+        publish = self.manifest['publish']
+        frames = self.manifest['frames']
+        self.state['version_entity'] = self.get_publisher().create_version(publish['movie_path'],
+                                                                           frames['dest_path'],
+                                                                           frames['first'],
+                                                                           frames['last'])
+
+    def run_upload(self):
+        if not self.manifest['publish']['upload_to_sg']:
+            return
+        review_media = self.get_review_media()
+        self.get_publisher().upload_media(self.state['version_entity'], self.manifest['publish']['movie_path'],
+                                          review_media if review_media.exists else None)
+
+    def run_publish(self):
+        publish = self.manifest['publish']
+        # manifests from before the batched publish record the note and register steps
+        if not publish['upload_to_sg'] or 'register' in self.state['steps']:
+            return
+        review_media = self.get_review_media()
+        description = None if 'note' in self.state['steps'] else publish.get('description')
+        self.get_publisher().create_note_and_publish(
+            self.state['version_entity'],
+            publish['movie_path'],
+            publish['publish_name'],
+            publish['version_number'],
+            publish['publish_type'],
+            publish['pass_type'],
+            description,
+            publish['note_type'],
+            thumbnail_path=review_media.thumbnail_path if review_media.exists else None
+        )
+
+
+class PublishDaemon(object):
+    """
+    Serves the queue of a root with a pool of workers and keeps status.json up to date.
+    """
+
+    def __init__(self, root, workers=DEFAULT_WORKERS, idle_timeout=IDLE_TIMEOUT, shotgun_factory=connect_shotgun,
+                 lock_timeout=LOCK_TIMEOUT):
+        """
+        Construction
+        :param root: daemon root, see the module docstring for its layout
+        :param workers: jobs run at once
+        :param idle_timeout: seconds without jobs after which serve returns
+        :param shotgun_factory: callable(manifest) returning (tk, context, register_publish)
+        :param lock_timeout: seconds serve waits for the lock of another daemon
+        """
+        self.root = root
+        self.workers = max(1, workers)
+        self.idle_timeout = idle_timeout
+        self.shotgun_factory = shotgun_factory
+        self.lock_timeout = lock_timeout
+        self.started = time.time()
+        self.jobs = {}
+        self._lock = threading.Lock()
+
+    def get_path(self, folder, job_id):
+        return os.path.join(self.root, folder, '{}.json'.format(job_id))
+
+    def list_jobs(self, folder):
+        """
+        Returns the job ids of a queue folder, oldest first.
+        """
+        folder_path = os.path.join(self.root, folder)
+        names = [name for name in os.listdir(folder_path) if name.endswith('.json')]
+        names.sort(key=lambda name: os.path.getmtime(os.path.join(folder_path, name)))
+        return [name[:-len('.json')] for name in names]
+
+    def get_owner(self, job_id):
+        """
+        :return: process id of the daemon that claimed a running job, None when unknown
+        """
+        try:
+            with open(os.path.join(self.root, 'running', '{}.pid'.format(job_id))) as fh:
+                return int(fh.read().strip())
+        except (IOError, OSError, ValueError):
+            return None
+
+    def move_job(self, job_id, folder):
+        """
+        Moves a running job to another folder, dropping its owner.
+        """
+        os.rename(self.get_path('running', job_id), self.get_path(folder, job_id))
+        try:
+            os.remove(os.path.join(self.root, 'running', '{}.pid'.format(job_id)))
+        except OSError:
+            pass
+
+    def recover(self):
+        """
+        Queues the jobs a previous daemon left running, they resume after their last finished step.
+        Jobs whose owner is still alive are left running.
+        """
+        for job_id in self.list_jobs('running'):
+            owner = self.get_owner(job_id)
+            if owner and owner != os.getpid() and is_process_alive(owner):
+                logger.warning("{}: still run by pid {}, not resumed".format(job_id, owner))
+                continue
+            logger.info("{}: resuming interrupted job".format(job_id))
+            self.move_job(job_id, 'queue')
+
+    def claim(self):
+        """
+        Moves the oldest queued job to running/ and records this process as its owner.
+        :return: its job id, None when the queue is empty
+        """
+        for job_id in self.list_jobs('queue'):
+            try:
+                os.rename(self.get_path('queue', job_id), self.get_path('running', job_id))
+            except OSError:
+                # claimed by another daemon
+                continue
+            with open(os.path.join(self.root, 'running', '{}.pid'.format(job_id)), 'w') as fh:
+                fh.write(str(os.getpid()))
+            return job_id
+        return None
+
+    def set_job(self, job_id, **values):
+        with self._lock:
+            job = self.jobs.setdefault(job_id, {})
+            job.update(values, updated=time.time())
+
+    def run_job(self, job_id):
+        path = self.get_path('running', job_id)
+        manifest = read_json(path)
+        if manifest is None:
+            logger.error("{}: unreadable manifest".format(job_id))
+            self.move_job(job_id, 'failed')
+            self.set_job(job_id, state='failed', error='unreadable manifest')
+            return
+
+        work_dir = os.path.join(self.root, 'work', job_id)
+        job = PublishJob(manifest, path, work_dir, self.shotgun_factory,
+                         emitter=lambda message: self.set_job(job_id, step=job.step, message=message))
+        self.set_job(job_id, state='running', movie=manifest['publish']['movie_path'], started=time.time())
+        logger.info("{}: publishing {}".format(job_id, manifest['publish']['movie_path']))
+        try:
+            job.run()
+        except Exception:
+            error = traceback.format_exc()
+            logger.error("{}: failed in step {}\n{}".format(job_id, job.step, error))
+            manifest['error'] = error
+            job.save()
+            self.move_job(job_id, 'failed')
+            self.set_job(job_id, state='failed', error=error.strip().splitlines()[-1])
+            return
+
+        # a published job is never run again, it does not need its context
+        manifest.pop('sgtk', None)
+        job.save()
+        self.move_job(job_id, 'done')
+        shutil.rmtree(work_dir, ignore_errors=True)
+        self.set_job(job_id, state='done', step=None, version_entity=manifest['state'].get('version_entity'))
+        logger.info("{}: published".format(job_id))
+
+    def write_status(self, stopped=False):
+        with self._lock:
+            finished = sorted((job_id for job_id, job in self.jobs.items() if job.get('state') in ('done', 'failed')),
+                              key=lambda job_id: self.jobs[job_id]['updated'])
+            for job_id in finished[:-STATUS_HISTORY]:
+                del self.jobs[job_id]
+            status = {
+                'pid': os.getpid(),
+                'started': self.started,
+                'updated': time.time(),
+                'stopped': stopped,
+                'workers': self.workers,
+                'queued': self.list_jobs('queue'),
+                'jobs': dict((job_id, dict(job)) for job_id, job in self.jobs.items()),
+            }
+        write_json(os.path.join(self.root, 'status.json'), status)
+
+    def serve(self):
+        """
+        Runs queued jobs until the daemon has been idle for idle_timeout seconds.
+        :return: exit code
+        """
+        make_dirs(self.root)
+        lock = DaemonLock(self.root)
+        if not lock.acquire(self.lock_timeout):
+            logger.info("A daemon is already serving {} (pid {})".format(self.root, lock.get_owner()))
+            return 0
+
+        try:
+            self.write_status()
+            logger.info("Publish daemon serving {} with {} workers".format(self.root, self.workers))
+            for job_id in purge(self.root):
+                logger.info("{}: purged".format(job_id))
+            self.recover()
+            active = {}
+            idle_since = time.time()
+            with futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+                while True:
+                    for job_id in [job_id for job_id, job in active.items() if job.done()]:
+                        del active[job_id]
+                    while len(active) < self.workers:
+                        job_id = self.claim()
+                        if not job_id:
+                            break
+                        self.set_job(job_id, state='queued')
+                        active[job_id] = executor.submit(self.run_job, job_id)
+
+                    self.write_status()
+                    if active:
+                        idle_since = time.time()
+                    elif time.time() - idle_since > self.idle_timeout:
+                        # jobs submitted while this daemon still looked alive started no other daemon
+                        self.write_status(stopped=True)
+                        if not self.list_jobs('queue'):
+                            break
+                        idle_since = time.time()
+                        continue
+                    time.sleep(POLL_INTERVAL)
+
+            logger.info("Publish daemon idle for {:.0f}s, exiting".format(self.idle_timeout))
+            return 0
+        finally:
+            lock.release()
+
+
+def format_status(status):
+    if not status:
+        return 'No daemon has run here'
+    lines = ['Daemon pid {} {}, updated {:.0f}s ago, {} queued'.format(
+        status['pid'], 'stopped' if status.get('stopped') else 'running', time.time() - status['updated'],
+        len(status.get('queued') or []))]
+    for job_id, job in sorted(status.get('jobs', {}).items(), key=lambda item: item[1].get('updated', 0)):
+        lines.append('  {} {:<8} {}'.format(job_id, job.get('state'), job.get('error') or job.get('message') or ''))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Publish playblasts in the background.')
+    subparsers = parser.add_subparsers(dest='command')
+    serve_parser = subparsers.add_parser('serve', help='run the queued jobs')
+    serve_parser.add_argument('--root', required=True)
+    serve_parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS)
+    serve_parser.add_argument('--idle-timeout', type=float, default=IDLE_TIMEOUT)
+    serve_parser.add_argument('--stub-shotgun', help='record the Shotgun calls to this file instead of publishing')
+    submit_parser = subparsers.add_parser('submit', help='queue a job manifest')
+    submit_parser.add_argument('--root', required=True)
+    submit_parser.add_argument('manifest')
+    status_parser = subparsers.add_parser('status', help='print the daemon status')
+    status_parser.add_argument('--root', required=True)
+    retry_parser = subparsers.add_parser('retry', help='queue failed jobs again')
+    retry_parser.add_argument('--root', required=True)
+    retry_parser.add_argument('jobs', nargs='*', help='job ids, every failed job by default')
+    purge_parser = subparsers.add_parser('purge', help='remove old done and failed jobs')
+    purge_parser.add_argument('--root', required=True)
+    purge_parser.add_argument('--max-age', type=float, default=FINISHED_MAX_AGE / (24 * 3600.0), help='days')
+    args = parser.parse_args(argv)
+
+    if args.command == 'serve':
+        make_dirs(args.root)
+        logging.basicConfig(filename=os.path.join(args.root, 'daemon.log'), level=logging.INFO,
+                            format='%(asctime)s %(threadName)s %(levelname)s %(message)s')
+        shotgun_factory = stub_shotgun_factory(args.stub_shotgun) if args.stub_shotgun else connect_shotgun
+        return PublishDaemon(args.root, args.workers, args.idle_timeout, shotgun_factory).serve()
+    if args.command == 'submit':
+        print(submit(args.root, read_json(args.manifest)))
+        return 0
+    if args.command == 'status':
+        print(format_status(read_status(args.root)))
+        return 0
+    if args.command == 'retry':
+        for job_id in retry(args.root, args.jobs):
+            print(job_id)
+        return 0
+    if args.command == 'purge':
+        for job_id in purge(args.root, args.max_age * 24 * 3600.0):
+            print(job_id)
+        return 0
+    parser.print_help()
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
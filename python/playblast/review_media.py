@@ -0,0 +1,106 @@
+"""
+Review media derived from the playblast movie in the same ffmpeg pass that encodes it.
+
+The burnt-in stream is split so a single decode of the sequence also writes:
+
+    proxy       small H.264 mp4 uploaded to the Version's sg_uploaded_movie
+    thumbnail   poster frame from the middle of the shot
+    filmstrip   frames tiled horizontally at 240px wide, the layout Shotgun expects
+
+When the movie is not encoded by a single ffmpeg (segmented or streamed encodes)
+extract() derives the same outputs from the finished movie in one extra pass.
+"""
+import os
+import shutil
+import tempfile
+
+from .ffmpeg_runner import FFmpegRunner
+
+PROXY_HEIGHT = 720
+PROXY_CRF = 23
+THUMBNAIL_WIDTH = 960
+FILMSTRIP_FRAMES = 20
+# shotgun slices filmstrips into frames of this width
+FILMSTRIP_FRAME_WIDTH = 240
+
+
+class ReviewMedia(object):
+    """
+    Paths and ffmpeg graph of the proxy, thumbnail and filmstrip of one movie.
+    """
+
+    def __init__(self, frame_count, ffmpeg, directory=None):
+        """
+        Construction
+        :param frame_count: number of frames of the movie, slate included
+        :param ffmpeg: ffmpeg executable
+        :param directory: directory the outputs are written to, a new temp directory when None
+        """
+        self.frame_count = max(1, int(frame_count))
+        self.ffmpeg = ffmpeg
+        self.directory = directory or tempfile.mkdtemp(prefix='playblast_review_')
+        self.proxy_path = os.path.join(self.directory, 'proxy.mp4')
+        self.thumbnail_path = os.path.join(self.directory, 'thumbnail.jpg')
+        self.filmstrip_path = os.path.join(self.directory, 'filmstrip.jpg')
+
+    @property
+    def paths(self):
+        return [self.proxy_path, self.thumbnail_path, self.filmstrip_path]
+
+    @property
+    def exists(self):
+        return all(os.path.isfile(path) for path in self.paths)
+
+    def get_filter_graph(self, source, movie_label=None):
+        """
+        Returns the filter graph splitting source into the review outputs.
+        :param source: label of the burnt-in stream, eg 0:v
+        :param movie_label: when set, one more branch is left under this label for the movie itself
+        """
+        step = -(-self.frame_count // FILMSTRIP_FRAMES)
+        strip_frames = -(-self.frame_count // step)
+        branches = ['proxy_in', 'thumbnail_in', 'filmstrip_in']
+        if movie_label:
+            branches.insert(0, movie_label)
+        return ("[{source}]split={count}{branches};"
+                "[proxy_in]scale=-2:'min({proxy_height},ih)':flags=bicubic[proxy];"
+                "[thumbnail_in]select='eq(n\\,{poster})',scale='min({thumbnail_width},iw)':-2[thumbnail];"
+                "[filmstrip_in]select='not(mod(n\\,{step}))',scale={strip_width}:-2,"
+                "tile={strip_frames}x1[filmstrip]").format(source=source,
+                                                           count=len(branches),
+                                                           branches=''.join('[{}]'.format(b) for b in branches),
+                                                           proxy_height=PROXY_HEIGHT,
+                                                           poster=self.frame_count // 2,
+                                                           thumbnail_width=THUMBNAIL_WIDTH,
+                                                           step=step,
+                                                           strip_width=FILMSTRIP_FRAME_WIDTH,
+                                                           strip_frames=strip_frames)
+
+    def get_output_args(self):
+        """
+        Returns the ffmpeg outputs writing the branches of get_filter_graph.
+        """
+        return ['-map', '[proxy]',
+                '-c:v', 'libx264', '-preset', 'veryfast', '-crf', str(PROXY_CRF),
+                '-pix_fmt', 'yuv420p', '-movflags', '+faststart',
+                self.proxy_path,
+                '-map', '[thumbnail]', '-frames:v', '1', '-q:v', '2', self.thumbnail_path,
+                '-map', '[filmstrip]', '-frames:v', '1', '-q:v', '3', self.filmstrip_path]
+
+    def extract(self, movie_path, startupinfo=None, emitter=None):
+        """
+        Derives the outputs from a finished movie in a single pass.
+        :param movie_path: the finished movie
+        :param startupinfo: passed to subprocess.Popen
+        :param emitter: optional callable receiving progress messages
+        :return: self
+        """
+        args = [self.ffmpeg, '-y', '-loglevel', 'error',
+                '-i', movie_path,
+                '-filter_complex', self.get_filter_graph('0:v')] + self.get_output_args()
+        FFmpegRunner(args, self.frame_count, emitter=emitter, label='Building review media', outputs=self.paths,
+                     startupinfo=startupinfo).run()
+        return self
+
+    def cleanup(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
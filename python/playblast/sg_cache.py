@@ -0,0 +1,331 @@
+"""
+Local time-to-live cache of the Shotgun lookups the playblast makes on every dialog open.
+
+The shot frame range, the client of the project, the plate name and the latest published
+version change rarely, yet every dialog open and every playblast queried them again. The
+cache keeps their results in a sqlite file shared by every maya session of the machine,
+so re-opening the dialog on the same shot makes no Shotgun request.
+
+Entries are keyed by the entity the lookup is about, the entity type and filters of the
+query and its fields:
+
+    (site, entity_type, entity_id, query_type, query, fields) -> value, expires
+
+A read of an entity by id has an empty query. Every field has its own time to live, an
+entry expires with its shortest lived field: a cut change shows up within minutes while the
+client of a project is kept for a day. invalidate() drops the entries of an entity, eg the
+PublishedFile lookups of a shot once a playblast of it is published.
+
+PlateIndex keeps the plate name parsed from the latest Main plate of each entity in the
+same database. It is used without a query for PLATE_TTL, then a single plate, with only its
+description, is queried again and only parsed when it is a new plate publish.
+
+    python sg_cache.py status --db playblast_sg_cache.sqlite
+    python sg_cache.py clear --db playblast_sg_cache.sqlite [--entity-type Shot --entity-id 1234]
+
+clear drops the plate names of the entities too, eg from a plate publish hook.
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+
+MINUTE = 60.0
+HOUR = 60 * MINUTE
+DAY = 24 * HOUR
+
+DEFAULT_TTL = HOUR
+FIELD_TTLS = {
+    'sg_head_in': 10 * MINUTE,
+    'sg_tail_out': 10 * MINUTE,
+    'sg_image_type': DAY,
+    'sg_original_pixel_aspect_ratio': DAY,
+    'sg_client_code': DAY,
+    'sg_client_name': HOUR,
+    'description': HOUR,
+    # other artists publish too, the version number is checked again soon
+    'version_number': MINUTE,
+}
+
+PLATE_TTL = HOUR
+PLATE_PASS_TYPE = 'Main'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    site TEXT NOT NULL,
+    entity_type TEXT NOT NULL,
+    entity_id INTEGER NOT NULL,
+    query_type TEXT NOT NULL,
+    query TEXT NOT NULL,
+    fields TEXT NOT NULL,
+    value TEXT NOT NULL,
+    stored REAL NOT NULL,
+    expires REAL NOT NULL,
+    PRIMARY KEY (site, entity_type, entity_id, query_type, query, fields)
+);
+CREATE TABLE IF NOT EXISTS plates (
+    site TEXT NOT NULL,
+    entity_type TEXT NOT NULL,
+    entity_id INTEGER NOT NULL,
+    published_file_id INTEGER NOT NULL,
+    plate_name TEXT NOT NULL,
+    checked REAL NOT NULL,
+    PRIMARY KEY (site, entity_type, entity_id)
+);
+"""
+
+
+class ShotgunCache(object):
+    """
+    sqlite backed cache of Shotgun find results, safe to share between threads and processes.
+    Values go through json, the cached fields must not hold dates.
+    """
+
+    def __init__(self, path, site='', ttls=None, default_ttl=DEFAULT_TTL):
+        """
+        Construction
+        :param path: sqlite database, created when missing
+        :param site: Shotgun site url, entries of other sites are never returned
+        :param ttls: optional {field: seconds} overriding FIELD_TTLS
+        :param default_ttl: seconds a field missing from the ttls is kept
+        """
+        self.path = path
+        self.site = site or ''
+        self.ttls = dict(FIELD_TTLS, **(ttls or {}))
+        self.default_ttl = default_ttl
+        self.hits = 0
+        self.misses = 0
+        if not os.path.isdir(os.path.dirname(os.path.abspath(path))):
+            os.makedirs(os.path.dirname(os.path.abspath(path)))
+        with self._connect() as connection:
+            connection.executescript(SCHEMA)
+
+    def _connect(self):
+        # one connection per call, sqlite connections can not be shared between threads
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        connection.execute('PRAGMA journal_mode=WAL')
+        return _Connection(connection)
+
+    def get_ttl(self, fields):
+        """
+        Seconds an entry holding the fields is kept, the time to live of its shortest lived field.
+        """
+        return min([self.ttls.get(field, self.default_ttl) for field in fields] or [self.default_ttl])
+
+    def _key(self, scope, query_type, query, fields):
+        return (self.site, scope['type'], scope['id'], query_type, query, json.dumps(sorted(fields)))
+
+    def get(self, scope, query_type, query, fields):
+        """
+        :return: (True, value) for a live entry, (False, None) otherwise
+        """
+        with self._connect() as connection:
+            row = connection.execute(
+                'SELECT value, expires FROM entries WHERE site = ? AND entity_type = ? AND entity_id = ? '
+                'AND query_type = ? AND query = ? AND fields = ?', self._key(scope, query_type, query, fields)
+            ).fetchone()
+        if row is None or row[1] <= time.time():
+            self.misses += 1
+            return False, None
+        self.hits += 1
+        return True, json.loads(row[0])
+
+    def set(self, scope, query_type, query, fields, value):
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO entries (site, entity_type, entity_id, query_type, query, fields, value, '
+                'stored, expires) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                self._key(scope, query_type, query, fields) + (json.dumps(value), now, now + self.get_ttl(fields)))
+
+    def _lookup(self, fetch, entity_type, filters, fields, order, limit, scope):
+        if scope is None:
+            if len(filters) != 1 or list(filters[0][:2]) != ['id', 'is']:
+                # nothing to invalidate it with, not cached
+                return fetch()
+            scope, query = {'type': entity_type, 'id': filters[0][2]}, ''
+        else:
+            query = json.dumps([filters, order, limit], sort_keys=True)
+        hit, value = self.get(scope, entity_type, query, fields)
+        if not hit:
+            value = fetch()
+            self.set(scope, entity_type, query, fields, value)
+        return value
+
+    def find_one(self, shotgun, entity_type, filters, fields, order=None, scope=None):
+        """
+        Cached shotgun.find_one.
+        :param shotgun: connection used on a miss
+        :param scope: the entity the lookup is about, invalidated with it. Lookups without one
+                      are not cached, except reads by id: [['id', 'is', id]].
+        """
+        return self._lookup(lambda: shotgun.find_one(entity_type, filters, fields, order=order),
+                            entity_type, filters, fields, order, 1, scope)
+
+    def find(self, shotgun, entity_type, filters, fields, order=None, limit=0, scope=None):
+        """
+        Cached shotgun.find, see find_one.
+        """
+        return self._lookup(lambda: shotgun.find(entity_type, filters, fields, order=order, limit=limit),
+                            entity_type, filters, fields, order, limit, scope)
+
+    def invalidate(self, entity_type=None, entity_id=None, query_type=None):
+        """
+        Drops the entries of the site, optionally only those about an entity or of a queried entity type.
+        :return: number of entries dropped
+        """
+        clauses, values = ['site = ?'], [self.site]
+        for column, value in (('entity_type', entity_type), ('entity_id', entity_id), ('query_type', query_type)):
+            if value is not None:
+                clauses.append('{} = ?'.format(column))
+                values.append(value)
+        with self._connect() as connection:
+            return connection.execute('DELETE FROM entries WHERE ' + ' AND '.join(clauses), values).rowcount
+
+    def purge(self):
+        """
+        Drops the expired entries of every site.
+        """
+        with self._connect() as connection:
+            return connection.execute('DELETE FROM entries WHERE expires <= ?', (time.time(),)).rowcount
+
+    def counts(self):
+        """
+        :return: {(entity_type, query_type): (live entries, expired entries)} of the site
+        """
+        now = time.time()
+        with self._connect() as connection:
+            rows = connection.execute(
+                'SELECT entity_type, query_type, SUM(expires > ?), SUM(expires <= ?) FROM entries WHERE site = ? '
+                'GROUP BY entity_type, query_type', (now, now, self.site)).fetchall()
+        return dict(((row[0], row[1]), (row[2], row[3])) for row in rows)
+
+
+def find_latest_plate(shotgun, entity, pass_type=PLATE_PASS_TYPE):
+    """
+    :return: the latest plate PublishedFile of an entity with only its description, None when there is none
+    """
+    return shotgun.find_one(
+        'PublishedFile',
+        [['entity', 'is', entity], ['sg_pass_type', 'is', pass_type]],
+        ['description'],
+        order=[{'field_name': 'sg_version_number', 'direction': 'desc'}]
+    )
+
+
+class PlateIndex(object):
+    """
+    Persistent index of the plate name of each entity, safe to share between threads and processes.
+    """
+
+    def __init__(self, path, site='', ttl=PLATE_TTL, pass_type=PLATE_PASS_TYPE):
+        """
+        Construction
+        :param path: sqlite database, shared with ShotgunCache
+        :param site: Shotgun site url
+        :param ttl: seconds a plate name is used before the latest plate is checked again
+        :param pass_type: sg_pass_type of the plates
+        """
+        self.path = path
+        self.site = site or ''
+        self.ttl = ttl
+        self.pass_type = pass_type
+        self.hits = 0
+        self.queries = 0
+        if not os.path.isdir(os.path.dirname(os.path.abspath(path))):
+            os.makedirs(os.path.dirname(os.path.abspath(path)))
+        with self._connect() as connection:
+            connection.executescript(SCHEMA)
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        connection.execute('PRAGMA journal_mode=WAL')
+        return _Connection(connection)
+
+    def get_plate_name(self, shotgun, entity, parse):
+        """
+        Returns the plate name of an entity, from the index while it is fresh.
+        :param shotgun: connection used when the index is stale
+        :param parse: callable returning the plate name of a plate PublishedFile
+        :return: the plate name, None when the entity has no plate
+        """
+        key = (self.site, entity['type'], entity['id'])
+        with self._connect() as connection:
+            row = connection.execute(
+                'SELECT published_file_id, plate_name, checked FROM plates WHERE site = ? AND entity_type = ? '
+                'AND entity_id = ?', key).fetchone()
+        if row and time.time() - row[2] < self.ttl:
+            self.hits += 1
+            return row[1]
+
+        self.queries += 1
+        plate = find_latest_plate(shotgun, entity, self.pass_type)
+        if plate is None:
+            self.invalidate(entity['type'], entity['id'])
+            return None
+        # the same plate as last time, only a new plate publish is parsed
+        plate_name = row[1] if row and row[0] == plate['id'] else parse(plate)
+        with self._connect() as connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO plates (site, entity_type, entity_id, published_file_id, plate_name, checked) '
+                'VALUES (?, ?, ?, ?, ?, ?)', key + (plate['id'], plate_name, time.time()))
+        return plate_name
+
+    def invalidate(self, entity_type=None, entity_id=None):
+        """
+        Drops the plate names of the site, optionally only the one of an entity, eg after a new plate publish.
+        :return: number of plate names dropped
+        """
+        clauses, values = ['site = ?'], [self.site]
+        for column, value in (('entity_type', entity_type), ('entity_id', entity_id)):
+            if value is not None:
+                clauses.append('{} = ?'.format(column))
+                values.append(value)
+        with self._connect() as connection:
+            return connection.execute('DELETE FROM plates WHERE ' + ' AND '.join(clauses), values).rowcount
+
+
+class _Connection(object):
+    """
+    Closes the sqlite connection on exit, sqlite3 connections used as context managers only commit.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        return self.connection
+
+    def __exit__(self, *exc_info):
+        self.connection.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Playblast Shotgun cache tools.')
+    subparsers = parser.add_subparsers(dest='command')
+    for name, help_text in (('status', 'print the entries of a cache'), ('clear', 'drop entries of a cache')):
+        command_parser = subparsers.add_parser(name, help=help_text)
+        command_parser.add_argument('--db', required=True)
+        command_parser.add_argument('--site', default='')
+    subparsers.choices['clear'].add_argument('--entity-type')
+    subparsers.choices['clear'].add_argument('--entity-id', type=int)
+    args = parser.parse_args(argv)
+
+    if args.command == 'status':
+        for (entity_type, query_type), (live, expired) in sorted(ShotgunCache(args.db, args.site).counts().items()):
+            print('{:<24} {:<24} {:>6} live {:>6} expired'.format(entity_type, query_type, live, expired))
+        return 0
+    if args.command == 'clear':
+        print('{} entries dropped'.format(ShotgunCache(args.db, args.site).invalidate(args.entity_type,
+                                                                                      args.entity_id)))
+        print('{} plate names dropped'.format(PlateIndex(args.db, args.site).invalidate(args.entity_type,
+                                                                                        args.entity_id)))
+        return 0
+    parser.print_help()
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,5 +1,5 @@
 import datetime
-import shutil
+import hashlib
 import subprocess
 
 import os
@@ -11,6 +11,11 @@ import OpenImageIO
 from distutils import spawn
 # from datetime import datetime
 
+from . import burnin
+from . import ffmpeg_runner
+from . import parallel_encode
+from . import review_media
+
 #
 ffmpeg = spawn.find_executable('ffmpeg')
 
@@ -21,12 +26,33 @@ if not ffmpeg:
         ffmpeg = os.path.dirname(__file__).replace('/python/playblast', '/resources/third-party/window/bin/ffmpeg.exe')
 
 
+def get_startupinfo():
+    """
+    Returns a STARTUPINFO that prevents the cmd.exe dialog from appearing on Windows,
+    None on other platforms.
+    """
+    if os.name != 'nt':
+        return None
+    startupinfo = subprocess.STARTUPINFO()
+    startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+    return startupinfo
+
+
 class Slate(object):
     BLANK_SLATE_PATH = os.path.abspath(BASE_DIR.replace('/python/playblast', '/resources/track_slate.png'))
-    FONT_FILE_PATH = BASE_DIR.replace('/python/playblast', '/resources/DroidSans.ttf').replace(":", "\:")
+    FONT_PATH = BASE_DIR.replace('/python/playblast', '/resources/DroidSans.ttf')
+    FONT_FILE_PATH = FONT_PATH.replace(":", "\:")
     FONT_SCALE = 0.0090
     LINE_SPACING = 60
     LINE_LENGTH = 70
+    # slate lines whose value is the same for every version of a shot, drawn once into the static layer
+    STATIC_SLATE_FIELDS = ('Shot Name: ', 'Project Name: ', 'FPS: ', 'Resolution: ', 'Artist: ')
+    # bump when the static layer layout changes to invalidate cached layers
+    STATIC_LAYER_VERSION = 1
+    MAX_STATIC_LAYERS = 8
+
+    _static_layers = {}
+    _blank_slate_sizes = {}
 
     def __init__(self, app, playblastParams, playblast_path, focal_length):
         """
@@ -38,6 +64,12 @@ class Slate(object):
         self.pb_path = playblast_path
         self.pb_focal_length = focal_length
         self.slate_data = None
+        self.review_media = None
+        # output args of the encoder profile, see encoder_profiles
+        self.encoder_args = []
+        self.emitter = app.logger.info
+        self.cancelled = False
+        self._runners = set()
 
     def create_slate(self, playblast_path, slate_data):
         self.slate_data = slate_data
@@ -46,260 +78,486 @@ class Slate(object):
         start_time = self.slate_data['start_time']
         self._app.logger.info("create_slate: start_time = {}".format(start_time))
         self._app.logger.info("create_slate: self.pb_path = {}".format(self.pb_path))
-        self._app.logger.info("create_slate: self.pb_path % start_time = {}".format(self.pb_path % start_time))
 
         first_frame_path = self.pb_path % start_time
         self._app.logger.debug("create_slate: first_frame_path = {}".format(first_frame_path))
 
         slate_path = os.path.join(tempfile.mkdtemp(), 'slate.jpg')
-        self._app.logger.debug("create_slate: slate_path (1) = {}".format(slate_path))
+        slate_buf = self.render_slate(first_frame_path)
+        slate_buf.set_write_format(OpenImageIO.UINT8)
+        if not slate_buf.write(slate_path):
+            raise RuntimeError("Could not write slate {}: {}".format(slate_path, slate_buf.geterror()))
 
-        internal_args = self._create_slate_args()
-        internal_args += self._generate_ffmpeg_stuff(categories=True, client=False)
-        internal_args += self._generate_ffmpeg_stuff(categories=False, client=False)
+        self._app.logger.debug("create_slate: slate_path = {}".format(slate_path))
 
-        if internal_args[-1] == ',':
-            internal_args = internal_args[:-1]
+        return slate_path
 
-        ffmpeg_args = [ffmpeg, '-y', '-i', self.BLANK_SLATE_PATH, '-i', first_frame_path,
-                       '-filter_complex', internal_args, slate_path]
+    def render_slate(self, first_frame_path):
+        """
+        Renders the slate at the resolution of the first frame in memory: the cached static
+        layer, the bordered thumbnail of the first frame and the values that change per version.
 
-        # Prevents the cmd.exe dialog from appearing on Windows.
-        startupinfo = subprocess.STARTUPINFO()
-        startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+        The layout is defined on the blank slate, which is scaled to a square of the frame
+        width and cropped to the frame height.
+        :param first_frame_path: first frame of the sequence
+        :return: RGB ImageBuf
+        """
+        frame_buf = OpenImageIO.ImageBuf(str(first_frame_path))
+        width = frame_buf.roi.width
+        height = frame_buf.roi.height
 
-        proc = subprocess.Popen(ffmpeg_args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, startupinfo=startupinfo)
-        stdout, stderr = proc.communicate()
+        slate_width, slate_height = self.get_blank_slate_size()
+        scale_x = width / slate_width
+        scale_y = width / slate_height
+        crop_y = (width - height) // 2
 
-        self._app.logger.debug("stdout = {}".format(stdout))
-        self._app.logger.debug("stderr = {}".format(stderr))
+        canvas = OpenImageIO.ImageBuf()
+        canvas.copy(self.get_static_layer(width, height))
 
-        slate_path = self._match_resolution(slate_path, first_frame_path)
+        self._paste_plate(canvas, frame_buf, slate_width, slate_height, scale_x, scale_y, crop_y)
+        self._render_lines(canvas, dynamic=True)
 
-        self._app.logger.debug("create_slate: slate_path (2) = {}".format(slate_path))
+        return canvas
 
-        return slate_path
+    def get_blank_slate_size(self):
+        if self.BLANK_SLATE_PATH not in self._blank_slate_sizes:
+            spec = OpenImageIO.ImageBuf(str(self.BLANK_SLATE_PATH)).spec()
+            self._blank_slate_sizes[self.BLANK_SLATE_PATH] = (float(spec.width), float(spec.height))
+        return self._blank_slate_sizes[self.BLANK_SLATE_PATH]
 
-    def create_internal_mov(self, slate, first_frame):
-        # self._create_internal_slate()
-        slate_frame_number = first_frame - 1
-        slate_path = self.pb_path % slate_frame_number
+    def get_static_layer_key(self, width, height):
+        """
+        Returns the cache key of the static layer: every static slate line, the resolution,
+        the font scale and the blank slate and font files it is drawn with.
+        """
+        key = [self.STATIC_LAYER_VERSION, width, height, self.FONT_SCALE, self.LINE_SPACING]
+        for path in (self.BLANK_SLATE_PATH, self.FONT_PATH):
+            stat = os.stat(path)
+            key.append((path, stat.st_size, stat.st_mtime))
+        key.extend((category, value) for category, value in self._set_internal_slate_lines()
+                   if category in self.STATIC_SLATE_FIELDS)
+        return hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+
+    def get_static_layer(self, width, height):
+        """
+        Returns the background with every line label and the values that do not change
+        between versions of a shot (shot, project, fps, resolution, artist) drawn on it.
+        Layers are cached in memory and under the app cache location, so only the first
+        playblast of a shot at a given resolution pays for the full render.
+        :param width: width of the playblast frames
+        :param height: height of the playblast frames
+        :return: RGB ImageBuf, treat as read only
+        """
+        key = self.get_static_layer_key(width, height)
+        if key in self._static_layers:
+            self._app.logger.debug("Slate static layer {} from memory".format(key))
+            return self._static_layers[key]
+
+        cache_path = None
+        cache_location = getattr(self._app, 'cache_location', None)
+        if cache_location:
+            cache_path = os.path.join(cache_location, 'slate_cache', key + '.png')
+            if os.path.isfile(cache_path):
+                layer = OpenImageIO.ImageBuf(str(cache_path))
+                if layer.read(force=True):
+                    self._app.logger.debug("Slate static layer {} from {}".format(key, cache_path))
+                    return self._remember_static_layer(key, layer)
+
+        layer = self._remember_static_layer(key, self._render_static_layer(width, height))
+
+        if cache_path:
+            self._write_static_layer(layer, cache_path)
+        return layer
+
+    def _remember_static_layer(self, key, layer):
+        if len(self._static_layers) >= self.MAX_STATIC_LAYERS:
+            self._static_layers.clear()
+        self._static_layers[key] = layer
+        return layer
+
+    def _render_static_layer(self, width, height):
+        background = OpenImageIO.ImageBuf(str(self.BLANK_SLATE_PATH))
+        crop_y = (width - height) // 2
+
+        layer = OpenImageIO.ImageBuf(OpenImageIO.ImageSpec(width, height, 3, OpenImageIO.FLOAT))
+        square = OpenImageIO.ImageBufAlgo.resize(background, roi=OpenImageIO.ROI(0, width, 0, width, 0, 1, 0, 3))
+        OpenImageIO.ImageBufAlgo.paste(layer, 0, -crop_y, 0, 0, square)
+        self._render_lines(layer, dynamic=False)
+        return layer
+
+    def _write_static_layer(self, layer, cache_path):
+        """
+        Writes the layer next to its final path and renames it, so concurrent sessions
+        never read a partial file.
+        """
+        try:
+            cache_dir = os.path.dirname(cache_path)
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            temp_path = '{}.{}.png'.format(os.path.splitext(cache_path)[0], os.getpid())
+            layer.set_write_format(OpenImageIO.UINT8)
+            if layer.write(str(temp_path)):
+                os.rename(temp_path, cache_path)
+            else:
+                self._app.logger.debug("Could not cache slate layer: {}".format(layer.geterror()))
+        except OSError as e:
+            self._app.logger.debug("Could not cache slate layer: {}".format(e))
 
-        shutil.copyfile(slate, slate_path)
-        internal_mov_path = self.create_mov_from_images(slate_frame_number)
+    def _render_lines(self, canvas, dynamic):
+        """
+        Draws the slate lines on the canvas.
+        :param dynamic: draw the values that change between versions, otherwise draw the
+                        labels and the static values
+        """
+        width = canvas.spec().width
+        height = canvas.spec().height
+        slate_width, slate_height = self.get_blank_slate_size()
+        scale_x = width / slate_width
+        scale_y = width / slate_height
+        crop_y = (width - height) // 2
+
+        for category, value, font_scale, offset in self._get_slate_layout():
+            y = int(round(slate_height * 0.425 * scale_y + offset * scale_y)) - crop_y
+            x = int(round(slate_width * 0.18 * scale_x))
+            font_size = max(1, int(round(font_scale * width)))
+            is_static = category in self.STATIC_SLATE_FIELDS
+            if not dynamic:
+                OpenImageIO.ImageBufAlgo.render_text(canvas, x, y, category, font_size, self.FONT_PATH,
+                                                     (1, 1, 1), alignx='right', aligny='top')
+            if is_static != dynamic:
+                OpenImageIO.ImageBufAlgo.render_text(canvas, x, y, value, font_size, self.FONT_PATH,
+                                                     (1, 1, 1), alignx='left', aligny='top')
+
+    def _paste_plate(self, canvas, frame_buf, slate_width, slate_height, scale_x, scale_y, crop_y):
+        """
+        Pastes the first frame with a thin white border on the right half of the slate.
+        """
+        aspect_ratio = float(self.pb_params['width']) / float(self.pb_params['height'])
+        frame_aspect = float(frame_buf.roi.width) / float(frame_buf.roi.height)
+        if aspect_ratio > 1:
+            plate_width = slate_width * 0.25
+            plate_height = plate_width / frame_aspect
+        else:
+            plate_height = slate_height * 0.25
+            plate_width = plate_height * frame_aspect
+
+        border_width = max(1, int(round(plate_width * scale_x)))
+        border_height = max(1, int(round(plate_height * scale_y)))
+        inner_width = max(1, int(round(border_width / 1.01)))
+        inner_height = max(1, int(round(border_height / 1.01)))
+
+        plate = OpenImageIO.ImageBuf(OpenImageIO.ImageSpec(border_width, border_height, 3, OpenImageIO.FLOAT))
+        OpenImageIO.ImageBufAlgo.fill(plate, (1, 1, 1))
+        thumbnail = OpenImageIO.ImageBufAlgo.resize(frame_buf,
+                                                    roi=OpenImageIO.ROI(0, inner_width, 0, inner_height, 0, 1, 0, 3))
+        OpenImageIO.ImageBufAlgo.paste(plate, (border_width - inner_width) // 2,
+                                       (border_height - inner_height) // 2, 0, 0, thumbnail)
+
+        x = int(round(slate_width * 0.775 * scale_x - border_width * 0.5))
+        y = int(round(slate_height * 0.5 * scale_y - border_height * 0.5)) - crop_y
+        OpenImageIO.ImageBufAlgo.paste(canvas, x, y, 0, 0, plate)
+
+    def _get_slate_layout(self):
+        """
+        Returns (category, value, font scale, vertical offset in blank slate pixels) per line.
+        The title line is drawn twice as large and followed by a blank line.
+        """
+        layout = []
+        for i, (category, value) in enumerate(self._set_internal_slate_lines()):
+            if i == 0:
+                layout.append((category, value, self.FONT_SCALE * 2, 0))
+            elif i == 1:
+                layout.append((category, value, self.FONT_SCALE, self.LINE_SPACING * 2))
+            else:
+                layout.append((category, value, self.FONT_SCALE, self.LINE_SPACING * (i + 1)))
+        return layout
 
-        os.remove(slate_path)
-        return internal_mov_path
+    def create_internal_mov(self, slate, first_frame):
+        """
+        Encodes the sequence with the slate as its first frame. The slate is a separate
+        ffmpeg input so the sequence directory is only read during the encode.
+        :param slate: path of the slate image, at the resolution of the frames
+        :param first_frame: first frame of the sequence
+        :return: path of the mov, None if ffmpeg could not be started
+        """
+        return self.create_mov_from_images(first_frame, slate_path=slate)
 
-    def create_mov_from_images(self, first):
+    def create_mov_from_images(self, first, slate_path=None):
+        """
+        Encodes the burnt-in movie of the sequence and, in the same pass, the review media
+        stored on self.review_media.
+        :param first: first frame of the sequence
+        :param slate_path: optional slate image encoded before the first frame
+        :return: path of the mov
+        """
         mov_path = os.path.join(tempfile.mkdtemp(), 'mov.mov')
-        frame_rate = self.slate_data['frame_rate']
-        self._app.logger.debug("frame_rate:{}".format(frame_rate))
-        camera = self.slate_data['camera']
-        focal = self.slate_data['focal_length']
-        artist = self.slate_data['artist']
-        shotname = self.slate_data['shot_name']
-        project = self.slate_data['project_name']
-
-        if self.pb_params['width'] > 2048:
-            font_size = round(self.pb_params['width']/100)
-        else:
-            font_size = 18
-
-        drawtext_string = ("pad=ceil(iw/2)*2:ceil(ih/2)*2,"
-                           "select='gte(n\,0)',drawtext=start_number={first}:"
-                           "fontfile='{font_file}':text='%{n}':"
-                           "x=w*0.98-text_w:y=h*0.92:fontsize={font_size}+2:fontcolor=DAF7A6,"
-                           "drawtext=fontfile='{font_file}':text='{shotname}':"
-                           "x=w*0.50:y=h*0.92:fontsize={font_size}:fontcolor=DAF7A6,"
-                           "drawtext=fontfile='{font_file}':text='{project}':"
-                           "x=w*0.50:y=h*0.02:fontsize={font_size}:fontcolor=DAF7A6,"
-                           "drawtext=fontfile='{font_file}':text='{artist}':"
-                           "x=w*0.02:y=h*0.92:fontsize={font_size}:fontcolor=DAF7A6," 
-                           "drawtext=fontfile='{font_file}':text='{camera}':"
-                           "x=w*0.02:y=h*0.02:fontsize={font_size}:fontcolor=DAF7A6," 
-                           "drawtext=fontfile='{font_file}':text='{date_time}':x=w*0.90:y=h*0.02:"
-                           "fontsize={font_size}:fontcolor=DAF7A6").format(first=first, n='{n}', focal=focal,
-                                                                           project=project, shotname=shotname,
-                                                                           artist=artist, camera=camera,
-                                                                           date_time=datetime.date.today(),
-                                                                           font_file=self.FONT_FILE_PATH,
-                                                                           font_size=font_size)
-        self._app.logger.debug("drawtext_string={}".format(drawtext_string))
-        ffmpeg_args = [ffmpeg,
-                       '-y',
-                       '-start_number', str(first),
-                       '-i', self.pb_path,
-                       '-vf',
-                       drawtext_string,
-                       mov_path,
-                       ]
-
-        self._app.logger.debug("Trying {}".format(' '.join(ffmpeg_args)))
-        self._app.logger.info("Creating slate frame for the media...")
-
+        self.review_media = None
+        if self._app.get_setting('review_media', True):
+            frame_count = int(self.pb_params['endTime']) - first + 1 + (1 if slate_path else 0)
+            self.review_media = review_media.ReviewMedia(frame_count, ffmpeg)
         try:
-            # Prevents the cmd.exe dialog from appearing on Windows.
-            startupinfo = subprocess.STARTUPINFO()
-            startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-
-            proc = subprocess.Popen(ffmpeg_args,  # shell=True,
-                                    startupinfo = startupinfo,
-                                    stdout=subprocess.PIPE,
-                                    stderr=subprocess.PIPE)
-            _stdout, _stderr = proc.communicate()
-            self._app.logger.debug('stdout is: {}'.format(_stdout))
-            self._app.logger.debug('stderr is: {}'.format(_stderr))
-        except Exception as e:
-            self._app.logger.debug("An exception was encountered:")
-            self._app.logger.debug(e)
-            mov_path = None
-
-        return mov_path
+            if burnin.is_available() and self._app.get_setting('numpy_burnin', True):
+                try:
+                    return self.create_burnin_mov(first, slate_path, mov_path)
+                except ffmpeg_runner.FFmpegCancelled:
+                    raise
+                except Exception as e:
+                    self._app.logger.warning("numpy burn-in failed, falling back to drawtext: {}".format(e))
+            return self.create_drawtext_mov(first, slate_path, mov_path)
+        finally:
+            self._runners.clear()
+
+    def cancel(self):
+        """
+        Kills the running ffmpeg processes and refuses to start new ones.
+        """
+        self.cancelled = True
+        for runner in list(self._runners):
+            runner.cancel()
 
-    def _generate_ffmpeg_stuff(self, categories, client):
-        ffmpeg_stuff = ''
-
-        template = ("drawtext="
-                    "text={text}:"
-                    "fontcolor=white:"
-                    "fontsize={font_scale}*h:"
-                    "fontfile='{font_file}':"
-                    "x=w*0.18{x_offset}:"
-                    "y=h*{y_offset}+{i}*{line_spacing},"
-                    )
-
-        if categories:
-            index = 0
-            x_offset = '-text_w'
-        else:
-            index = 1
-            x_offset = ''
+    def register_runner(self, runner):
+        if self.cancelled:
+            runner.cancelled = True
+        self._runners.add(runner)
 
-        lines = self._set_internal_slate_lines()
-        y_offset = 0.425
+    def run_ffmpeg(self, args, total_frames=None, label='Encoding movie', outputs=None, emit=True, register=None):
+        """
+        Runs ffmpeg with progress reported to the emitter, cancellable through cancel().
+        :param args: ffmpeg command line, main output last
+        :param total_frames: frames the command writes
+        :param label: progress message prefix
+        :param outputs: files removed on failure, the main output by default
+        :param emit: report progress, off for commands run on worker threads
+        :param register: optional callable receiving the runner
+        :return: number of frames ffmpeg reported
+        """
+        runner = ffmpeg_runner.FFmpegRunner(args, total_frames, emitter=self.emitter if emit else None, label=label,
+                                            outputs=outputs, startupinfo=get_startupinfo(), logger=self._app.logger)
+        self.register_runner(runner)
+        if register:
+            register(runner)
+        try:
+            return runner.run()
+        finally:
+            self._runners.discard(runner)
 
-        for i, line in enumerate(lines):
-            if i == 0:
-                scale = self.FONT_SCALE * 2
-                spacing = self.LINE_SPACING
-            elif i == 1:
-                scale = self.FONT_SCALE
-                spacing = self.LINE_SPACING * 2
-            else:
-                scale = self.FONT_SCALE
-                spacing = self.LINE_SPACING
-                i += 1
+    def get_segment_count(self, frame_count):
+        """
+        Returns how many segments to encode frame_count frames in, 1 for a single ffmpeg.
+        """
+        if not self._app.get_setting('parallel_encode', True):
+            return 1
+        return parallel_encode.pick_segment_count(frame_count)
 
-            ffmpeg_stuff += template.format(text=line[index],
-                                            font_scale=scale,
-                                            line_spacing=spacing,
-                                            x_offset=x_offset,
-                                            y_offset=y_offset,
-                                            i=i,
-                                            font_file=self.FONT_FILE_PATH)
+    def encode_segmented(self, encode_segment, frame_count, mov_path):
+        """
+        Encodes the movie in parallel segments when it is long enough to benefit.
+        :param encode_segment: callable(start, end, segment_path, codec_args, register), see
+                               parallel_encode.SegmentedEncode, register receives the ffmpeg runners
+        :return: mov_path, None when the movie should be encoded in a single process
+        """
+        segments = self.get_segment_count(frame_count)
+        if segments <= 1:
+            return None
+        self._app.logger.info("Encoding {} frames in {} parallel segments...".format(frame_count, segments))
 
-        return ffmpeg_stuff
+        segment_runners = []
+        reporter = ffmpeg_runner.ProgressReporter(self.emitter, 'Encoding movie', frame_count)
 
-    def _set_internal_slate_lines(self):
+        def register(runner):
+            self.register_runner(runner)
+            segment_runners.append(runner)
 
-        internal_slate_lines = [
-            # ("'Project ID\:\ '", "'{id}'".format(id=self.slate_data['project_id'])),
-            # ("'Shot ID\:\ '", "'{id}'".format(id=self.slate_data['shot_id'])),
-            ("'Shot Name\:\ '", "'{name}'".format(name=self.slate_data['shot_name'])),
-            ("'Project Name\:\ '", "'{name}'".format(name=self.slate_data['project_name'])),
-            ("'Version\:\ '", "'{version}'".format(version="v%s" % str(self.slate_data['playblast_version']).zfill(3))),
-            ("'Frames\:\ '", "'{first}-{last} ({range}f)'"
-             .format(first=self.pb_params['startTime'],
-                     last=self.pb_params['endTime'],
-                     range=self.pb_params['endTime'] - self.pb_params['startTime'] + 1)),
-            ("'FPS\:\ '", "'{frame_rate}'".format(frame_rate=self.slate_data['frame_rate'])),
-            ("'Resolution\:\ '", "'{w}x{h}'".format(w=self.pb_params['width'], h=self.pb_params['height'])),
-            ("'Focal Length\:\ '", "'{focal}'".format(focal=self.slate_data['focal_length'])),
-            # ("''", "''"),
-            ("'Artist\:\ '", "'{artist}'".format(artist=self.slate_data['artist'])),
-            ("'Date\:\ '", "'{date}'".format(date=datetime.date.today())),
-            # ("'Time Log\:\ '", "'{time_log} hours'".format(time_log=self._time_log)),
-            # ("''", "''"),
-            # ("'Notes\:\ '", "'{notes}'".format(notes=comment)),
-        ]
-        return internal_slate_lines
+        def cancel_segments():
+            for runner in list(segment_runners):
+                runner.cancel()
 
-    def _create_slate_args(self):
-        aspect_ratio = float(self.pb_params['width'] / self.pb_params['height'])
+        try:
+            parallel_encode.SegmentedEncode(
+                lambda start, end, segment_path, codec_args: encode_segment(start, end, segment_path, codec_args,
+                                                                            register),
+                frame_count, segments, ffmpeg,
+                encoder_args=self.encoder_args,
+                logger=self._app.logger,
+                startupinfo=get_startupinfo(),
+                progress=lambda: reporter.report(sum(runner.frame for runner in segment_runners)),
+                cancel=cancel_segments).run(mov_path)
+        except ffmpeg_runner.FFmpegCancelled:
+            raise
+        except Exception as e:
+            if self.cancelled:
+                raise ffmpeg_runner.FFmpegCancelled("Encode cancelled")
+            self._app.logger.warning("Segmented encode failed, encoding in a single process: {}".format(e))
+            return None
+        finally:
+            for runner in segment_runners:
+                self._runners.discard(runner)
+
+        if self.review_media:
+            # the segments never see the whole sequence, derive the review media from the joined movie
+            try:
+                self.review_media.extract(mov_path, startupinfo=get_startupinfo(), emitter=self.emitter)
+            except Exception as e:
+                self._app.logger.warning("Could not build the review media: {}".format(e))
+                self.review_media = None
+        return mov_path
 
-        if aspect_ratio > 1:
-            width = 'w=iw*0.25:'
-            height = 'h=ow/mdar:'
+    def get_drawtext_args(self, first, slate_path, mov_path, frame_count=None, output_args=(), review=None):
+        """
+        Returns the ffmpeg command encoding the sequence from first with the drawtext burn-in.
+        :param first: first frame read from the sequence
+        :param slate_path: optional slate image encoded before the first frame
+        :param mov_path: movie to write
+        :param frame_count: number of frames to encode, slate included, all when None
+        :param output_args: extra output args, eg the codec settings of a segment
+        :param review: optional ReviewMedia written from the same decode
+        """
+        frame_rate = str(self.slate_data['frame_rate'])
+        ffmpeg_args = [ffmpeg, '-y']
+        if slate_path:
+            # a single image input yields exactly one frame, numbered first-1 by the burn-in
+            ffmpeg_args += ['-framerate', frame_rate, '-i', slate_path]
+        ffmpeg_args += ['-framerate', frame_rate,
+                        '-start_number', str(first),
+                        '-i', self.pb_path]
+        if slate_path:
+            filter_graph = ('[0:v]setsar=1[slate];[1:v]setsar=1[frames];'
+                            '[slate][frames]concat=n=2:v=1:a=0,{}'.format(self.get_drawtext_string(first - 1)))
         else:
-            width = 'w=oh*mdar:'
-            height = 'h=ih*0.25:'
-
-        x = 0.775
-        y = 0.5
-
-        ffmpeg_args = (
-            # add white border to plate
-            "[1:v]"
-            "pad="
-            "iw*1.01:"
-            "ih*1.01:"
-            "iw/1.01:"
-            "ih/1.01:"
-            "color=white"
-            "[border_plate];"
-            # scale plate to correct size
-            "[border_plate][0:v]"
-            "scale2ref="
-            "{width}"
-            "{height}"
-            "[plate][slate];"
-            # add plate to slate
-            "[slate][plate]"
-            "overlay="
-            "main_w*{x}-overlay_w*0.5:"
-            "main_h*{y}-overlay_h*0.5,"
-        ).format(width=width, height=height, x=x, y=y)
-
+            filter_graph = '[0:v]{}'.format(self.get_drawtext_string(first))
+        if review:
+            ffmpeg_args += ['-filter_complex', '{}[burnt];{}'.format(filter_graph,
+                                                                     review.get_filter_graph('burnt', 'movie')),
+                            '-map', '[movie]']
+        elif slate_path:
+            ffmpeg_args += ['-filter_complex', filter_graph]
+        else:
+            ffmpeg_args += ['-vf', self.get_drawtext_string(first)]
+        if frame_count:
+            ffmpeg_args += ['-frames:v', str(frame_count)]
+        ffmpeg_args += list(output_args)
+        ffmpeg_args.append(mov_path)
+        if review:
+            ffmpeg_args += review.get_output_args()
         return ffmpeg_args
 
-    def _match_resolution(self, input_path, target_path):
-        output_path = os.path.join(tempfile.mkdtemp(), "resized_plate.jpg")
-        other_output_path = os.path.join(tempfile.mkdtemp(), "temp_resized_plate.jpg")
-        self._app.logger.debug("_match_resolution: output_path (1) = {}".format(output_path))
-        self._app.logger.debug("_match_resolution: other_output_path (1) = {}".format(other_output_path))
+    def create_drawtext_mov(self, first, slate_path, mov_path):
+        frame_count = int(self.pb_params['endTime']) - first + 1 + (1 if slate_path else 0)
 
-        input_buf = OpenImageIO.ImageBuf(str(input_path))
-        # OpenImageIO.ImageInput.open(str(input_path)).spec().width
+        def encode_segment(start, end, segment_path, codec_args, register):
+            if start == 0:
+                segment_args = self.get_drawtext_args(first, slate_path, segment_path, end + 1, codec_args)
+            else:
+                segment_first = first + start - (1 if slate_path else 0)
+                segment_args = self.get_drawtext_args(segment_first, None, segment_path, end - start + 1, codec_args)
+            self.run_ffmpeg(segment_args, end - start + 1, emit=False, register=register)
 
-        target_buf = OpenImageIO.ImageBuf(str(target_path))
-        target_width = target_buf.roi.width
-        target_height = target_buf.roi.height
+        if self.encode_segmented(encode_segment, frame_count, mov_path):
+            return mov_path
 
-        resize_width = target_width
-        resize_height = target_width
-        resize_spec = OpenImageIO.ImageSpec(resize_width,
-                                            resize_height,
-                                            input_buf.spec().nchannels,
-                                            input_buf.spec().format
-                                            )
+        ffmpeg_args = self.get_drawtext_args(first, slate_path, mov_path, output_args=self.encoder_args,
+                                             review=self.review_media)
+        self._app.logger.info("Creating slate frame for the media...")
 
-        resize_buf = OpenImageIO.ImageBuf(resize_spec)
+        try:
+            try:
+                self.run_ffmpeg(ffmpeg_args, frame_count,
+                                outputs=[mov_path] + (self.review_media.paths if self.review_media else []))
+            except ffmpeg_runner.FFmpegError as e:
+                if isinstance(e, ffmpeg_runner.FFmpegCancelled) or not self.review_media:
+                    raise
+                # eg an ffmpeg build without libx264 for the proxy, the movie alone still encodes
+                self._app.logger.warning("Encoding with review media failed, encoding the movie alone: {}".format(e))
+                self.review_media = None
+                self.run_ffmpeg(self.get_drawtext_args(first, slate_path, mov_path, output_args=self.encoder_args),
+                                frame_count)
+        except ffmpeg_runner.FFmpegCancelled:
+            raise
+        except Exception as e:
+            self._app.logger.error("An exception was encountered:")
+            self._app.logger.error(e)
+            mov_path = None
 
-        OpenImageIO.ImageBufAlgo.resize(resize_buf, input_buf)
+        return mov_path
 
-        resize_buf.write(other_output_path)
+    def get_burnin_fields(self):
+        """
+        Returns the static burn-in texts keyed by their BURNIN_LAYOUT field.
+        """
+        return {
+            'shot_name': self.slate_data['shot_name'],
+            'project_name': self.slate_data['project_name'],
+            'artist': self.slate_data['artist'],
+            'camera': self.slate_data['camera'],
+            'date': datetime.date.today(),
+        }
+
+    def get_drawtext_string(self, first):
+        """
+        Builds the burn-in filter chain applied to every frame of the mov.
+        :param first: frame number of the first image fed to ffmpeg (the slate frame)
+        :return: ffmpeg -vf filter string
+        """
+        self._app.logger.debug("frame_rate:{}".format(self.slate_data['frame_rate']))
+        drawtext_string = burnin.get_drawtext_filter(self.get_burnin_fields(), first, self.FONT_FILE_PATH,
+                                                     burnin.get_font_size(self.pb_params['width']))
+        self._app.logger.debug("drawtext_string={}".format(drawtext_string))
+        return drawtext_string
 
-        output_buf = OpenImageIO.ImageBuf()
+    def create_burnin_mov(self, first, slate_path=None, mov_path=None):
+        """
+        Encodes the sequence with the numpy burn-in: the labels are rasterized once and
+        blended onto the decoded frames, ffmpeg only encodes.
+        :param first: first frame of the sequence
+        :param slate_path: optional slate image encoded before the first frame
+        :param mov_path: movie to write, in a new temp directory when None
+        :return: path of the mov
+        """
+        mov_path = mov_path or os.path.join(tempfile.mkdtemp(), 'mov.mov')
+        items = [(self.pb_path % frame, frame) for frame in range(first, int(self.pb_params['endTime']) + 1)
+                 if os.path.exists(self.pb_path % frame)]
+        if slate_path:
+            items.insert(0, (slate_path, first - 1))
+
+        spec = OpenImageIO.ImageBuf(str(items[0][0])).spec()
+        burn_in = burnin.BurnIn(self.get_burnin_fields(), spec.width, spec.height, self.FONT_PATH,
+                                font_size=burnin.get_font_size(self.pb_params['width']), ffmpeg=ffmpeg)
+        frame_rate = self.slate_data['frame_rate']
+
+        def encode_segment(start, end, segment_path, codec_args, register):
+            burn_in.encode(items[start:end + 1], frame_rate, segment_path, startupinfo=get_startupinfo(),
+                           output_args=codec_args, register=register)
 
-        y = (resize_height - target_height) / 2
-        OpenImageIO.ImageBufAlgo.crop(output_buf, resize_buf,
-                                      OpenImageIO.ROI(0, resize_width,
-                                                      y, y + target_height
-                                                      )
-                                      )
+        if self.encode_segmented(encode_segment, len(items), mov_path):
+            return mov_path
 
-        output_buf.write(output_path)
+        self._app.logger.info("Creating slate frame for the media...")
+        count = burn_in.encode(items, frame_rate, mov_path, startupinfo=get_startupinfo(),
+                               output_args=self.encoder_args, review=self.review_media, emitter=self.emitter,
+                               register=self.register_runner)
+        self._app.logger.debug("create_burnin_mov: {} frames encoded to {}".format(count, mov_path))
+        return mov_path
 
-        return output_path
+    def _set_internal_slate_lines(self):
 
+        internal_slate_lines = [
+            # ('Project ID: ', '{id}'.format(id=self.slate_data['project_id'])),
+            # ('Shot ID: ', '{id}'.format(id=self.slate_data['shot_id'])),
+            ('Shot Name: ', '{name}'.format(name=self.slate_data['shot_name'])),
+            ('Project Name: ', '{name}'.format(name=self.slate_data['project_name'])),
+            ('Version: ', '{version}'.format(version="v%s" % str(self.slate_data['playblast_version']).zfill(3))),
+            ('Frames: ', '{first}-{last} ({range}f)'
+             .format(first=self.pb_params['startTime'],
+                     last=self.pb_params['endTime'],
+                     range=self.pb_params['endTime'] - self.pb_params['startTime'] + 1)),
+            ('FPS: ', '{frame_rate}'.format(frame_rate=self.slate_data['frame_rate'])),
+            ('Resolution: ', '{w}x{h}'.format(w=self.pb_params['width'], h=self.pb_params['height'])),
+            ('Focal Length: ', '{focal}'.format(focal=self.slate_data['focal_length'])),
+            # ('', ''),
+            ('Artist: ', '{artist}'.format(artist=self.slate_data['artist'])),
+            ('Date: ', '{date}'.format(date=datetime.date.today())),
+            # ('Time Log: ', '{time_log} hours'.format(time_log=self._time_log)),
+            # ('', ''),
+            # ('Notes: ', '{notes}'.format(notes=comment)),
+        ]
+        return internal_slate_lines
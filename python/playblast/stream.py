@@ -0,0 +1,169 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from .ffmpeg_runner import FFmpegRunner
+from .slate import ffmpeg, get_startupinfo
+
+
+class StreamingEncoder(threading.Thread):
+    """
+    Encodes a playblast image sequence while maya is still writing it.
+
+    The encoder polls the maya output pattern for each frame of the range in order,
+    feeds every finished jpg to a single long-lived ffmpeg process through stdin
+    (image2pipe) and finalizes the mov once the last frame has landed. A frame is
+    considered finished as soon as the next frame exists, once the capture has been
+    reported finished, or when its size has not changed for ``settle_time`` seconds.
+    """
+
+    POLL_INTERVAL = 0.05
+    SETTLE_TIME = 3.0
+    CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, app, frame_pattern, first, last, drawtext_factory, slate_factory=None, encoder_args=(),
+                 frame_rate=24):
+        """
+        Construction
+        :param app: the playblast app, used for logging
+        :param frame_pattern: printf style path of the frames maya writes, eg /tmp/pb.%04d.jpg
+        :param first: first frame of the range
+        :param last: last frame of the range
+        :param drawtext_factory: callable taking the first frame number fed to ffmpeg and
+                                 returning the -vf burn-in string
+        :param slate_factory: optional callable taking the path of the first captured frame
+                              and returning the path of the slate image to prepend
+        :param encoder_args: ffmpeg output args of the encoder profile
+        :param frame_rate: frame rate of the movie, image2pipe would default to 25
+        """
+        super(StreamingEncoder, self).__init__(name='playblast_stream_encoder')
+        self.daemon = True
+        self._app = app
+        self.frame_pattern = frame_pattern
+        self.first = first
+        self.last = last
+        self.drawtext_factory = drawtext_factory
+        self.slate_factory = slate_factory
+        self.encoder_args = list(encoder_args)
+        self.frame_rate = frame_rate
+        self.mov_path = os.path.join(tempfile.mkdtemp(), 'mov.mov')
+        self.frames_encoded = 0
+        self.error = None
+
+        self._runner = None
+        self._capture_done = threading.Event()
+        self._cancelled = threading.Event()
+
+    def capture_finished(self):
+        """
+        Tells the encoder that maya has returned from cmds.playblast, no more frames will land.
+        """
+        self._capture_done.set()
+
+    def cancel(self):
+        """
+        Stops feeding frames, kills ffmpeg and removes the partial mov.
+        """
+        self._cancelled.set()
+        self._capture_done.set()
+        if self._runner:
+            self._runner.cancel()
+        self.join()
+        shutil.rmtree(os.path.dirname(self.mov_path), ignore_errors=True)
+
+    def finish(self, timeout=None):
+        """
+        Waits for the remaining frames to be encoded and returns the finalized mov path.
+        :param timeout: seconds to wait for the encoder, None waits forever
+        :return: path to the encoded mov
+        """
+        self.capture_finished()
+        self.join(timeout)
+        if self.is_alive():
+            raise RuntimeError("Streaming encode did not finish within {} seconds".format(timeout))
+        if self.error:
+            raise self.error
+        self._app.logger.debug("StreamingEncoder: {} frames encoded to {}".format(self.frames_encoded,
+                                                                                 self.mov_path))
+        return self.mov_path
+
+    def run(self):
+        try:
+            self._encode()
+        except Exception as e:
+            self._app.logger.error("Streaming encode failed: {}".format(e))
+            self.error = e
+            if self._runner:
+                self._runner.cancel()
+
+    def _encode(self):
+        first_frame_path = self._wait_for_frame(self.first)
+        if first_frame_path is None:
+            raise RuntimeError("Maya did not write the first frame: {}".format(self.frame_pattern % self.first))
+
+        slate_path = None
+        start_number = self.first
+        if self.slate_factory:
+            slate_path = self.slate_factory(first_frame_path)
+            start_number = self.first - 1
+
+        ffmpeg_args = [ffmpeg,
+                       '-y',
+                       '-loglevel', 'error',
+                       '-f', 'image2pipe',
+                       '-framerate', str(self.frame_rate),
+                       '-vcodec', 'mjpeg',
+                       '-i', '-',
+                       '-vf', self.drawtext_factory(start_number),
+                       ] + self.encoder_args + [self.mov_path]
+        # progress is not emitted from this thread, the emitter may touch Qt widgets
+        self._runner = FFmpegRunner(ffmpeg_args, stdin=True, startupinfo=get_startupinfo(),
+                                    logger=self._app.logger).start()
+
+        if slate_path:
+            self._feed(slate_path)
+        self._feed(first_frame_path)
+        for frame in range(self.first + 1, self.last + 1):
+            frame_path = self._wait_for_frame(frame)
+            if frame_path is None:
+                self._app.logger.warning("StreamingEncoder: frame {} was never written, skipping".format(frame))
+                continue
+            self._feed(frame_path)
+
+        self._runner.stdin.close()
+        self._runner.wait()
+
+    def _wait_for_frame(self, frame):
+        """
+        Blocks until the given frame is completely written.
+        :return: path of the frame, or None if the capture finished without writing it
+        """
+        frame_path = self.frame_pattern % frame
+        next_path = self.frame_pattern % (frame + 1)
+        last_size = -1
+        last_change = time.time()
+
+        while not self._cancelled.is_set():
+            if os.path.exists(frame_path):
+                if frame < self.last and os.path.exists(next_path):
+                    return frame_path
+                if self._capture_done.is_set():
+                    return frame_path
+                size = os.path.getsize(frame_path)
+                if size != last_size:
+                    last_size = size
+                    last_change = time.time()
+                elif time.time() - last_change >= self.SETTLE_TIME:
+                    return frame_path
+            elif self._capture_done.is_set():
+                return None
+            time.sleep(self.POLL_INTERVAL)
+
+        raise RuntimeError("Streaming encode cancelled")
+
+    def _feed(self, image_path):
+        with open(image_path, 'rb') as fh:
+            shutil.copyfileobj(fh, self._runner.stdin, self.CHUNK_SIZE)
+        self.frames_encoded += 1
@@ -0,0 +1,211 @@
+"""
+Stand-ins for the Shotgun connection and toolkit, so the publish code can run without a site.
+
+StubShotgun records every call it receives and answers them from an in-memory table of
+the entities it created. When given a record path it also appends each call to a json
+lines journal, which lets a separate process (eg the publish daemon) be checked. A latency
+makes every call cost a round trip to a hosted site, to measure request counts in time.
+
+StubTk and StubContext count the toolkit calls behind the publish paths, folder creation and
+template fields, with their own latency standing in for the schema walk and path cache.
+"""
+import collections
+import itertools
+import json
+import os
+import threading
+import time
+
+
+class StubShotgun(object):
+    """
+    Records calls and keeps created entities, thread safe.
+    """
+
+    def __init__(self, record_path=None, latency=0.0):
+        """
+        Construction
+        :param record_path: optional json lines file every call is appended to
+        :param latency: seconds every call takes
+        """
+        self.record_path = record_path
+        self.latency = latency
+        self.calls = []
+        self.entities = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def _record(self, method, *args):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.calls.append((method,) + args)
+            if self.record_path:
+                with open(self.record_path, 'a') as fh:
+                    fh.write(json.dumps({'method': method, 'args': args, 'time': time.time()}, default=str) + '\n')
+
+    def _create(self, entity_type, data):
+        with self._lock:
+            entity = dict(data, type=entity_type, id=next(self._ids))
+            self.entities[(entity_type, entity['id'])] = entity
+        return entity
+
+    def create(self, entity_type, data, return_fields=None):
+        self._record('create', entity_type, data)
+        return self._create(entity_type, data)
+
+    def batch(self, requests):
+        """
+        Runs create and update requests in one call, like the site does in one transaction.
+        """
+        self._record('batch', [(request['request_type'], request['entity_type']) for request in requests])
+        results = []
+        for request in requests:
+            if request['request_type'] == 'create':
+                results.append(self._create(request['entity_type'], request['data']))
+            elif request['request_type'] == 'update':
+                with self._lock:
+                    entity = self.entities.setdefault((request['entity_type'], request['entity_id']),
+                                                      {'type': request['entity_type'], 'id': request['entity_id']})
+                    entity.update(request['data'])
+                    results.append(dict(entity))
+            else:
+                raise ValueError("Unsupported batch request {}".format(request['request_type']))
+        return results
+
+    def update(self, entity_type, entity_id, data):
+        self._record('update', entity_type, entity_id, data)
+        with self._lock:
+            entity = self.entities.setdefault((entity_type, entity_id), {'type': entity_type, 'id': entity_id})
+            entity.update(data)
+            return dict(entity)
+
+    def find(self, entity_type, filters, fields=None, order=None, limit=0):
+        self._record('find', entity_type, filters, fields)
+        with self._lock:
+            entities = [dict(entity) for (kind, _), entity in sorted(self.entities.items()) if kind == entity_type]
+        return entities[:limit] if limit else entities
+
+    def find_one(self, entity_type, filters, fields=None, order=None):
+        entities = self.find(entity_type, filters, fields, order, limit=1)
+        return entities[0] if entities else None
+
+    def upload(self, entity_type, entity_id, path, field_name=None):
+        self._record('upload', entity_type, entity_id, path, field_name)
+        return next(self._ids)
+
+    def upload_thumbnail(self, entity_type, entity_id, path):
+        self._record('upload_thumbnail', entity_type, entity_id, path)
+        return next(self._ids)
+
+    def upload_filmstrip_thumbnail(self, entity_type, entity_id, path):
+        self._record('upload_filmstrip_thumbnail', entity_type, entity_id, path)
+        return next(self._ids)
+
+
+class StubTemplate(object):
+    """
+    Template applying its fields with str.format.
+    """
+
+    def __init__(self, name, definition):
+        self.name = name
+        self.definition = definition
+
+    def apply_fields(self, fields):
+        return self.definition.format(**fields)
+
+
+class StubTk(object):
+    """
+    The part of a tk instance the publish code uses, counts its calls.
+    """
+
+    def __init__(self, shotgun=None, latency=0.0, version='v0.19.18', root=None):
+        """
+        Construction
+        :param shotgun: optional StubShotgun
+        :param latency: seconds a folder creation or template field lookup takes
+        :param version: core version the stub stands in for
+        :param root: optional directory the entity folders are created in, none are created without it
+        """
+        self.shotgun = shotgun or StubShotgun()
+        self.version = version
+        self.root = root
+        self.latency = latency
+        self.calls = collections.Counter()
+        self.shotgun_url = 'https://stub.shotgunstudio.com'
+        self.templates = {
+            'playblast_mov': StubTemplate(
+                'playblast_mov', '/show/{Shot}/playblast/v{version:03d}/{Shot}_{pass_type}_v{version:03d}.mov'),
+            'playblast_image': StubTemplate(
+                'playblast_image',
+                '/show/{Shot}/playblast/v{version:03d}/{Shot}_{pass_type}_v{version:03d}.%04d.jpg'),
+        }
+
+    def record(self, method):
+        self.calls[method] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def create_filesystem_structure(self, entity_type, entity_id):
+        self.record('create_filesystem_structure')
+        for path in self.paths_from_entity(entity_type, entity_id):
+            if not os.path.isdir(path):
+                os.makedirs(path)
+        return 3
+
+    def paths_from_entity(self, entity_type, entity_id):
+        if not self.root:
+            return []
+        return [os.path.join(self.root, '{}_{}'.format(entity_type, entity_id))]
+
+
+class StubContext(object):
+    """
+    Shot and task context of a StubTk, counts its template field lookups on the tk.
+    """
+    project = {'type': 'Project', 'id': 2, 'name': 'project'}
+    entity = {'type': 'Shot', 'id': 1, 'name': 'sh010'}
+    step = {'type': 'Step', 'id': 5, 'name': 'Animation'}
+    task = {'type': 'Task', 'id': 4, 'name': 'anim'}
+    user = {'type': 'HumanUser', 'id': 3, 'name': 'artist'}
+
+    def __init__(self, tk):
+        self.sgtk = tk
+
+    def as_template_fields(self, template):
+        self.sgtk.record('as_template_fields')
+        return {'Shot': self.entity['name'], 'pass_type': 'wireframe'}
+
+
+def register_publish(tk, context, path, name, version_number, **kwargs):
+    """
+    Stand-in for sgtk.util.register_publish with the same requests: the PublishedFileType
+    lookup, the PublishedFile creation and its thumbnail upload. With dry_run it returns
+    the PublishedFile data after the lookup, without creating it.
+    """
+    publish_type = kwargs.get('published_file_type')
+    filters = [['code', 'is', publish_type]]
+    published_file_type = tk.shotgun.find_one('PublishedFileType', filters) if publish_type else None
+    if publish_type and not published_file_type:
+        published_file_type = tk.shotgun.create('PublishedFileType', {'code': publish_type})
+    data = {
+        'code': os.path.basename(path),
+        'name': name,
+        'path': {'local_path': path},
+        'version_number': version_number,
+        'entity': context.entity,
+        'project': context.project,
+        'task': context.task,
+        'created_by': context.user,
+        'published_file_type': published_file_type,
+        'version': kwargs.get('version_entity'),
+    }
+    data.update(kwargs.get('sg_fields') or {})
+    if kwargs.get('dry_run'):
+        return dict(data, type='PublishedFile')
+    published_file = tk.shotgun.create('PublishedFile', data)
+    if kwargs.get('thumbnail_path'):
+        tk.shotgun.upload_thumbnail('PublishedFile', published_file['id'], kwargs['thumbnail_path'])
+    return published_file
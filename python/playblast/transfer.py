@@ -0,0 +1,383 @@
+"""
+Zero-copy file transfer for publishing playblast media.
+
+Each transfer tries the cheapest way of getting the bytes to the destination first:
+
+    rename           same volume and the source may be consumed (temp capture output)
+    reflink          copy-on-write clone (FICLONE) on btrfs/xfs/... volumes
+    hardlink         same volume, source kept
+    copy_file_range  kernel side copy, no round trip through user space
+    sendfile         kernel side copy on older kernels
+    copy             plain user space copy
+
+A strategy the volumes do not support (EXDEV, EOPNOTSUPP, ...) is not tried again for
+that pair of volumes, so a sequence only pays for the probing once. Other failures, eg a
+transient EIO or EBUSY, only fall through to the next strategy for that file.
+
+The destination gets the permissions of the transfer unless it is a hardlink: the inode is
+the source's, eg the frame of a previous version, and keeps its permissions.
+
+Whole sequences go through BulkTransfer: the source directory is listed once, the
+source -> destination plan is built in memory and the files are transferred by a
+bounded thread pool, which hides the per-file latency of network storage.
+
+    python transfer.py benchmark --counts 100 1000 10000
+
+transfers the same plan with one thread and with the pool on a tmpfs stand-in, with the same
+simulated latency per file, so the speedup is the one of the concurrency alone.
+"""
+import argparse
+import errno
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    from .compat import futures, replace
+except (ImportError, ValueError):
+    # run as a script
+    from compat import futures, replace
+
+# from linux/fs.h, _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+COPY_BUFFER_SIZE = 1024 * 1024
+KERNEL_COPY_CHUNK = 64 * 1024 * 1024
+
+STRATEGIES = ('rename', 'reflink', 'hardlink', 'copy_file_range', 'sendfile', 'copy')
+# errors telling a strategy can not work between two volumes, as opposed to a failure of one file
+UNSUPPORTED_ERRNOS = frozenset(getattr(errno, name) for name in (
+    'EXDEV', 'EOPNOTSUPP', 'ENOTSUP', 'EPERM', 'ENOSYS', 'EINVAL', 'ENOTTY') if hasattr(errno, name))
+
+# transfers to network storage are latency bound, so more threads than cores pay off
+DEFAULT_WORKERS = 16
+PROGRESS_INTERVAL = 0.5
+
+
+class TransferResult(object):
+    """
+    Outcome of a single file transfer.
+    """
+
+    def __init__(self, source, dest, strategy, size, seconds):
+        self.source = source
+        self.dest = dest
+        self.strategy = strategy
+        self.size = size
+        self.seconds = seconds
+
+    @property
+    def bytes_per_second(self):
+        return self.size / self.seconds if self.seconds > 0 else float(self.size)
+
+    def __repr__(self):
+        return '<TransferResult {} {} bytes via {} at {:.1f} MB/s>'.format(
+            os.path.basename(self.dest), self.size, self.strategy, self.bytes_per_second / 1024.0 ** 2)
+
+
+def is_unsupported_error(error):
+    """
+    True when a strategy failed because the platform or the volumes do not support it.
+    """
+    if isinstance(error, (AttributeError, NotImplementedError)):
+        # eg os.copy_file_range missing from this python
+        return True
+    return getattr(error, 'errno', None) in UNSUPPORTED_ERRNOS
+
+
+class FileTransfer(object):
+    """
+    Transfers files with the cheapest available strategy and keeps statistics.
+    """
+
+    def __init__(self, permissions=0o666, allow_link=True, logger=None):
+        """
+        Construction
+        :param permissions: permissions applied to the destination, as sgtk's copy_file does
+        :param allow_link: allow the destination to share its inode with the source
+        :param logger: optional logger
+        """
+        self.permissions = permissions
+        self.allow_link = allow_link
+        self.logger = logger
+        self.results = []
+        self._unsupported = set()
+        self._devices = {}
+
+    def transfer(self, source, dest, move=False, size=None):
+        """
+        Transfers source to dest.
+        :param source: file to transfer
+        :param dest: destination file, replaced if it exists
+        :param move: the source may be consumed, enables rename
+        :param size: size of the source when already known, saves a stat
+        :return: TransferResult
+        """
+        start = time.time()
+        if size is None:
+            size = os.path.getsize(source)
+        volumes = (self._get_device(source), self._get_device(dest))
+
+        error = None
+        for strategy in STRATEGIES:
+            if (strategy, volumes) in self._unsupported:
+                continue
+            if strategy == 'rename' and not move:
+                continue
+            if strategy == 'hardlink' and not self.allow_link:
+                continue
+            if strategy in ('rename', 'hardlink') and volumes[0] != volumes[1]:
+                continue
+            try:
+                getattr(self, '_' + strategy)(source, dest)
+            except (OSError, IOError, AttributeError, NotImplementedError) as err:
+                error = err
+                if strategy != 'copy' and is_unsupported_error(err):
+                    self._unsupported.add((strategy, volumes))
+                if self.logger:
+                    self.logger.debug("FileTransfer: {} unavailable for {} ({})".format(strategy, dest, err))
+                continue
+            break
+        else:
+            raise error
+
+        if strategy != 'hardlink':
+            try:
+                os.chmod(dest, self.permissions)
+            except OSError:
+                pass
+
+        result = TransferResult(source, dest, strategy, size, time.time() - start)
+        self.results.append(result)
+        return result
+
+    def copy_file(self, source, dest):
+        """
+        Copies without consuming the source. Signature matches sgtk.util.filesystem.copy_file.
+        """
+        return self.transfer(source, dest, move=False)
+
+    def move_file(self, source, dest):
+        """
+        Transfers a file whose source may be consumed.
+        """
+        return self.transfer(source, dest, move=True)
+
+    def summary(self):
+        """
+        Returns a one line report of the strategies used and the achieved throughput.
+        """
+        if not self.results:
+            return 'No files transferred'
+        total_size = sum(result.size for result in self.results)
+        total_seconds = sum(result.seconds for result in self.results)
+        counts = {}
+        for result in self.results:
+            counts[result.strategy] = counts.get(result.strategy, 0) + 1
+        rate = total_size / total_seconds if total_seconds > 0 else float(total_size)
+        return '{} files, {:.1f} MB in {:.2f}s ({:.1f} MB/s) via {}'.format(
+            len(self.results), total_size / 1024.0 ** 2, total_seconds, rate / 1024.0 ** 2,
+            ', '.join('{} x{}'.format(strategy, counts[strategy]) for strategy in STRATEGIES if strategy in counts))
+
+    def _get_device(self, path):
+        """
+        Returns the device of the directory holding path, stat'ed once per directory.
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        if directory not in self._devices:
+            self._devices[directory] = os.stat(directory).st_dev
+        return self._devices[directory]
+
+    @staticmethod
+    def _remove(dest):
+        if os.path.lexists(dest):
+            os.remove(dest)
+
+    def _rename(self, source, dest):
+        replace(source, dest)
+
+    def _reflink(self, source, dest):
+        if not sys.platform.startswith('linux'):
+            raise NotImplementedError('reflink is only implemented on linux')
+        import fcntl
+        with open(source, 'rb') as src:
+            with open(dest, 'wb') as dst:
+                try:
+                    fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+                except (IOError, OSError):
+                    dst.close()
+                    self._remove(dest)
+                    raise
+
+    def _hardlink(self, source, dest):
+        self._remove(dest)
+        os.link(source, dest)
+
+    def _copy_file_range(self, source, dest):
+        self._kernel_copy(source, dest, os.copy_file_range)
+
+    def _sendfile(self, source, dest):
+        if not sys.platform.startswith('linux'):
+            # sendfile only takes a file as output on linux
+            raise NotImplementedError('sendfile to a file is only supported on linux')
+        self._kernel_copy(source, dest, lambda src_fd, dst_fd, count: os.sendfile(dst_fd, src_fd, None, count))
+
+    def _kernel_copy(self, source, dest, copy_function):
+        with open(source, 'rb') as src:
+            with open(dest, 'wb') as dst:
+                try:
+                    while copy_function(src.fileno(), dst.fileno(), KERNEL_COPY_CHUNK):
+                        pass
+                except (IOError, OSError):
+                    dst.close()
+                    self._remove(dest)
+                    raise
+
+    def _copy(self, source, dest):
+        with open(source, 'rb') as src:
+            with open(dest, 'wb') as dst:
+                shutil.copyfileobj(src, dst, COPY_BUFFER_SIZE)
+
+
+def list_files(directory):
+    """
+    Lists a directory once.
+    :return: {name: size} of the files it holds
+    """
+    files = {}
+    if not os.path.isdir(directory):
+        return files
+    scandir = getattr(os, 'scandir', None)
+    if scandir is None:
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if os.path.isfile(path):
+                files[name] = os.path.getsize(path)
+        return files
+    for entry in scandir(directory):
+        if entry.is_file():
+            files[entry.name] = entry.stat().st_size
+    return files
+
+
+def build_transfer_plan(frames, source_pattern, dest_pattern, publish):
+    """
+    Builds the transfer plan of a frame sequence from a single listing of the source directory.
+    :param frames: frame numbers to transfer
+    :param source_pattern: printf style path of the source frames
+    :param dest_pattern: printf style path of the destination frames
+    :param publish: callable(source, dest, size) transferring one frame
+    :return: list of (source, dest, size, publish), frames missing on disk are skipped
+    """
+    source_dir = os.path.dirname(source_pattern)
+    source_name = os.path.basename(source_pattern)
+    files = list_files(source_dir)
+    plan = []
+    for frame in frames:
+        name = source_name % frame
+        if name in files:
+            plan.append((os.path.join(source_dir, name), dest_pattern % frame, files[name], publish))
+    return plan
+
+
+class BulkTransfer(object):
+    """
+    Runs a transfer plan on a bounded thread pool and reports progress.
+    """
+
+    def __init__(self, workers=DEFAULT_WORKERS, emitter=None, label='Publishing frames'):
+        """
+        Construction
+        :param workers: number of transfer threads
+        :param emitter: callable receiving progress messages
+        :param label: progress message prefix
+        """
+        self.workers = workers
+        self.emitter = emitter
+        self.label = label
+        self._done = 0
+        self._lock = threading.Lock()
+        self._last_report = 0
+
+    def run(self, plan):
+        """
+        Transfers every (source, dest, size, publish) of the plan.
+        :return: list of the publish results in plan order
+        """
+        self._done = 0
+        if not plan:
+            return []
+        if self.workers <= 1:
+            return [self._transfer(item, len(plan)) for item in plan]
+
+        with futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return list(executor.map(lambda item: self._transfer(item, len(plan)), plan))
+
+    def _transfer(self, item, total):
+        source, dest, size, publish = item
+        result = publish(source, dest, size)
+        with self._lock:
+            self._done += 1
+            now = time.time()
+            if self.emitter and (self._done == total or now - self._last_report >= PROGRESS_INTERVAL):
+                self._last_report = now
+                self.emitter('{} {}/{}'.format(self.label, self._done, total))
+        return result
+
+
+def _run_benchmark(counts, frame_size, workers, root, latency):
+    print('{:>8} {:>12} {:>12} {:>8}'.format('frames', 'serial (s)', 'pool (s)', 'speedup'))
+    payload = os.urandom(frame_size)
+    for count in counts:
+        work_dir = tempfile.mkdtemp(prefix='transfer_benchmark_', dir=root)
+        try:
+            source_pattern = os.path.join(work_dir, 'capture', 'pb.%05d.jpg')
+            os.makedirs(os.path.dirname(source_pattern))
+            for frame in range(count):
+                with open(source_pattern % frame, 'wb') as fh:
+                    fh.write(payload)
+
+            timings = []
+            for mode, mode_workers in (('serial', 1), ('pool', workers)):
+                dest_pattern = os.path.join(work_dir, mode, 'pb.%05d.jpg')
+                os.makedirs(os.path.dirname(dest_pattern))
+                file_transfer = FileTransfer(allow_link=False)
+
+                def publish(source, dest, size):
+                    # one round trip per file in both modes, only the concurrency differs
+                    time.sleep(latency)
+                    return file_transfer.transfer(source, dest, size=size)
+                start = time.time()
+                BulkTransfer(mode_workers).run(build_transfer_plan(range(count), source_pattern, dest_pattern,
+                                                                   publish))
+                timings.append(time.time() - start)
+            print('{:>8} {:>12.3f} {:>12.3f} {:>7.1f}x'.format(count, timings[0], timings[1],
+                                                               timings[0] / max(timings[1], 1e-6)))
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Playblast media transfer tools.')
+    subparsers = parser.add_subparsers(dest='command')
+    benchmark_parser = subparsers.add_parser('benchmark', help='compare serial and pooled frame transfer')
+    benchmark_parser.add_argument('--counts', type=int, nargs='+', default=[100, 1000, 10000])
+    benchmark_parser.add_argument('--frame-size', type=int, default=200 * 1024)
+    benchmark_parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS)
+    benchmark_parser.add_argument('--root', default='/dev/shm' if os.path.isdir('/dev/shm') else None,
+                                  help='directory to run in, tmpfs by default')
+    benchmark_parser.add_argument('--latency', type=float, default=0.0,
+                                  help='simulated seconds per file system round trip, eg 0.002 for NFS')
+    args = parser.parse_args(argv)
+
+    if args.command != 'benchmark':
+        parser.print_help()
+        return 1
+    _run_benchmark(args.counts, args.frame_size, args.workers, args.root, args.latency)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
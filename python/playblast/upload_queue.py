@@ -0,0 +1,587 @@
+"""
+Persistent Shotgun media upload queue.
+
+Uploads are recorded in a sqlite database before anything is sent, and a background
+worker drains the queue, so a flaky link or a large movie never blocks the artist and a
+failed upload is retried instead of lost:
+
+    pending     waiting for a worker, or for its next attempt after a failure
+    uploading   claimed by a worker, owner and sent record who and how far
+    done        uploaded, the spooled copy is removed
+    failed      gave up after MAX_ATTEMPTS, retry_failed() queues them again
+
+Failed attempts are retried with exponential backoff and jitter. Rows left uploading by a
+process that died are put back in the queue when the next worker starts, so the uploads
+of a crashed or closed maya resume in the next session.
+
+Two transports send the files:
+
+    ShotgunTransport   the Shotgun API, shotgun_api3 already sends large files to S3 in
+                       multipart chunks, an interrupted file starts over
+    HttpTransport      resumable chunked PUTs (Content-Range) against an HTTP endpoint,
+                       the server reports the bytes it has so an upload resumes mid file
+
+The stand-in server speaks the HttpTransport protocol and can drop requests, which lets
+the queue, the backoff and the resume be exercised without a site:
+
+    python upload_queue.py standin --port 8765 --fail-rate 0.3
+    python upload_queue.py demo --files 10 --size 20M --fail-rate 0.3
+"""
+import argparse
+import os
+import random
+import shutil
+import socket
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    from urllib import request as urllib_request
+    from urllib.error import HTTPError
+    from urllib.parse import quote
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    import urllib2 as urllib_request
+    from urllib2 import HTTPError
+    from urllib import quote
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+try:
+    from .frame_store import parse_size
+except (ImportError, ValueError):
+    # run as a script
+    from frame_store import parse_size
+
+PENDING = 'pending'
+UPLOADING = 'uploading'
+DONE = 'done'
+FAILED = 'failed'
+
+BACKOFF_BASE = 5.0
+BACKOFF_MAX = 15 * 60.0
+MAX_ATTEMPTS = 12
+# an uploading row whose owner can not be checked is considered orphaned after this long
+LEASE_TIMEOUT = 2 * 60 * 60.0
+CHUNK_SIZE = 8 * 1024 ** 2
+POLL_INTERVAL = 2.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS uploads (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    site TEXT NOT NULL,
+    method TEXT NOT NULL,
+    entity_type TEXT NOT NULL,
+    entity_id INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    field_name TEXT,
+    spooled INTEGER NOT NULL DEFAULT 0,
+    size INTEGER NOT NULL DEFAULT 0,
+    state TEXT NOT NULL,
+    owner TEXT,
+    sent INTEGER NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL DEFAULT 0,
+    last_error TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS uploads_state ON uploads (site, state, next_attempt);
+"""
+
+COLUMNS = ('id', 'site', 'method', 'entity_type', 'entity_id', 'path', 'field_name', 'spooled', 'size', 'state',
+           'owner', 'sent', 'attempts', 'next_attempt', 'last_error', 'created', 'updated')
+
+
+def get_backoff(attempts, base=BACKOFF_BASE, maximum=BACKOFF_MAX):
+    """
+    Seconds to wait before the next attempt, doubling with every failure. The jitter keeps
+    the workers of several machines from retrying in lockstep after an outage.
+    """
+    return min(maximum, base * 2 ** max(0, attempts - 1)) * random.uniform(0.8, 1.2)
+
+
+def get_owner():
+    return '{}:{}'.format(socket.gethostname(), os.getpid())
+
+
+def _owner_alive(owner, updated):
+    host, _, pid = (owner or '').rpartition(':')
+    if host != socket.gethostname() or os.name == 'nt':
+        return time.time() - updated < LEASE_TIMEOUT
+    try:
+        os.kill(int(pid), 0)
+    except (OSError, ValueError):
+        return False
+    return True
+
+
+class UploadQueue(object):
+    """
+    sqlite backed queue of uploads, safe to share between threads and processes.
+    """
+
+    def __init__(self, path, backoff_base=BACKOFF_BASE, backoff_max=BACKOFF_MAX):
+        """
+        Construction
+        :param path: sqlite database, created when missing. Spooled copies are kept next to it.
+        :param backoff_base: seconds before the first retry, doubled with every failure
+        :param backoff_max: longest wait between two attempts
+        """
+        self.path = path
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.spool_dir = os.path.splitext(path)[0] + '_spool'
+        if not os.path.isdir(os.path.dirname(os.path.abspath(path))):
+            os.makedirs(os.path.dirname(os.path.abspath(path)))
+        with self._connect() as connection:
+            connection.executescript(SCHEMA)
+
+    def _connect(self):
+        # one connection per call, sqlite connections can not be shared between threads
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        connection.execute('PRAGMA journal_mode=WAL')
+        return _Connection(connection)
+
+    def enqueue(self, site, method, entity_type, entity_id, path, field_name=None, spool=False):
+        """
+        Records an upload.
+        :param site: Shotgun site url, workers only upload the rows of their site
+        :param method: upload, upload_thumbnail or upload_filmstrip_thumbnail
+        :param path: file to upload
+        :param spool: copy the file next to the queue first, for files that are deleted after the publish
+        :return: id of the upload
+        """
+        if spool:
+            spool_dir = os.path.join(self.spool_dir, '{:.6f}_{}'.format(time.time(), random.randint(0, 1 << 30)))
+            os.makedirs(spool_dir)
+            spooled_path = os.path.join(spool_dir, os.path.basename(path))
+            shutil.copy2(path, spooled_path)
+            path = spooled_path
+        now = time.time()
+        with self._connect() as connection:
+            cursor = connection.execute(
+                'INSERT INTO uploads (site, method, entity_type, entity_id, path, field_name, spooled, size, state, '
+                'created, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (site, method, entity_type, entity_id, path, field_name, int(spool), os.path.getsize(path), PENDING,
+                 now, now))
+            return cursor.lastrowid
+
+    def claim(self, site, owner=None):
+        """
+        Marks the oldest upload that is due as uploading.
+        :return: the upload as a dict, None when nothing is due
+        """
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute('BEGIN IMMEDIATE')
+            row = connection.execute(
+                'SELECT {} FROM uploads WHERE site = ? AND state = ? AND next_attempt <= ? ORDER BY id LIMIT 1'.format(
+                    ', '.join(COLUMNS)), (site, PENDING, now)).fetchone()
+            if row is None:
+                connection.execute('COMMIT')
+                return None
+            connection.execute('UPDATE uploads SET state = ?, owner = ?, updated = ? WHERE id = ?',
+                               (UPLOADING, owner or get_owner(), now, row[0]))
+            connection.execute('COMMIT')
+        return dict(zip(COLUMNS, row))
+
+    def set_offset(self, upload_id, offset):
+        with self._connect() as connection:
+            connection.execute('UPDATE uploads SET sent = ?, updated = ? WHERE id = ?',
+                               (offset, time.time(), upload_id))
+
+    def complete(self, upload_id):
+        with self._connect() as connection:
+            row = connection.execute('SELECT path, spooled FROM uploads WHERE id = ?', (upload_id,)).fetchone()
+            connection.execute('UPDATE uploads SET state = ?, sent = size, last_error = NULL, updated = ? '
+                               'WHERE id = ?', (DONE, time.time(), upload_id))
+        if row and row[1]:
+            shutil.rmtree(os.path.dirname(row[0]), ignore_errors=True)
+
+    def fail(self, upload_id, error, max_attempts=MAX_ATTEMPTS):
+        """
+        Records a failed attempt and schedules the next one, or gives up after max_attempts.
+        :return: seconds until the next attempt, None when the upload failed for good
+        """
+        with self._connect() as connection:
+            attempts = connection.execute('SELECT attempts FROM uploads WHERE id = ?',
+                                          (upload_id,)).fetchone()[0] + 1
+            delay = get_backoff(attempts, self.backoff_base, self.backoff_max) if attempts < max_attempts else None
+            connection.execute('UPDATE uploads SET state = ?, attempts = ?, next_attempt = ?, last_error = ?, '
+                               'updated = ? WHERE id = ?',
+                               (PENDING if delay is not None else FAILED, attempts,
+                                time.time() + (delay or 0), str(error), time.time(), upload_id))
+        return delay
+
+    def recover(self, site):
+        """
+        Queues again the uploads left uploading by a process that is gone.
+        :return: number of uploads recovered
+        """
+        recovered = 0
+        with self._connect() as connection:
+            rows = connection.execute('SELECT id, owner, updated FROM uploads WHERE site = ? AND state = ?',
+                                      (site, UPLOADING)).fetchall()
+            for upload_id, owner, updated in rows:
+                if owner != get_owner() and not _owner_alive(owner, updated):
+                    connection.execute('UPDATE uploads SET state = ?, next_attempt = 0 WHERE id = ?',
+                                       (PENDING, upload_id))
+                    recovered += 1
+        return recovered
+
+    def retry_failed(self, site=None):
+        with self._connect() as connection:
+            cursor = connection.execute('UPDATE uploads SET state = ?, attempts = 0, next_attempt = 0 '
+                                        'WHERE state = ? AND (? IS NULL OR site = ?)', (PENDING, FAILED, site, site))
+            return cursor.rowcount
+
+    def counts(self, site=None):
+        """
+        Returns {state: number of uploads}.
+        """
+        with self._connect() as connection:
+            rows = connection.execute('SELECT state, COUNT(*) FROM uploads WHERE ? IS NULL OR site = ? GROUP BY state',
+                                      (site, site)).fetchall()
+        return dict(rows)
+
+    def depth(self, site=None):
+        """
+        Number of uploads still to send.
+        """
+        counts = self.counts(site)
+        return counts.get(PENDING, 0) + counts.get(UPLOADING, 0)
+
+    def purge(self, older_than=7 * 24 * 60 * 60.0):
+        with self._connect() as connection:
+            connection.execute('DELETE FROM uploads WHERE state = ? AND updated < ?', (DONE, time.time() - older_than))
+
+
+class _Connection(object):
+    """
+    Closes the sqlite connection on exit, sqlite3 connections used as context managers only commit.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        return self.connection
+
+    def __exit__(self, *exc_info):
+        self.connection.close()
+
+
+class ShotgunTransport(object):
+    """
+    Uploads through the Shotgun API of a tk instance, tk.shotgun hands every thread its own connection.
+    """
+
+    def __init__(self, tk):
+        self.tk = tk
+
+    def upload(self, item, progress=None):
+        args = [item['entity_type'], item['entity_id'], item['path']]
+        if item['field_name']:
+            args.append(item['field_name'])
+        getattr(self.tk.shotgun, item['method'])(*args)
+
+
+class HttpTransport(object):
+    """
+    Resumable chunked upload: a HEAD returns the bytes the server holds in its Upload-Offset
+    header and the rest of the file is sent in PUTs with a Content-Range.
+    """
+
+    def __init__(self, base_url, chunk_size=CHUNK_SIZE, timeout=60):
+        self.base_url = base_url.rstrip('/')
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+
+    def get_url(self, item):
+        return '{}/{}/{}/{}/{}/{}'.format(self.base_url, item['entity_type'], item['entity_id'], item['method'],
+                                          item['id'], quote(os.path.basename(item['path'])))
+
+    def _request(self, url, method, data=None, headers=None):
+        request = urllib_request.Request(url, data=data, headers=headers or {})
+        request.get_method = lambda: method
+        try:
+            response = urllib_request.urlopen(request, timeout=self.timeout)
+        except HTTPError as e:
+            if e.code != 409:
+                raise
+            # the server holds a different offset than we sent, it tells which
+            response = e
+        return int(response.headers.get('Upload-Offset') or 0)
+
+    def upload(self, item, progress=None):
+        url = self.get_url(item)
+        size = os.path.getsize(item['path'])
+        offset = self._request(url, 'HEAD')
+        with open(item['path'], 'rb') as fh:
+            while offset < size:
+                fh.seek(offset)
+                chunk = fh.read(self.chunk_size)
+                offset = self._request(url, 'PUT', chunk, {
+                    'Content-Range': 'bytes {}-{}/{}'.format(offset, offset + len(chunk) - 1, size),
+                    'Content-Type': 'application/octet-stream'})
+                if progress:
+                    progress(offset)
+
+
+class UploadWorker(object):
+    """
+    Drains the uploads of one site with a few threads until stopped.
+    """
+
+    def __init__(self, queue, site, transport, workers=2, emitter=None, logger=None, poll_interval=POLL_INTERVAL,
+                 max_attempts=MAX_ATTEMPTS):
+        """
+        Construction
+        :param queue: the UploadQueue
+        :param site: site whose uploads are sent
+        :param transport: object with an upload(item, progress) method
+        :param workers: uploads sent at once
+        :param emitter: optional callable receiving progress messages, called from the worker threads
+        :param logger: optional logger
+        :param poll_interval: seconds between two looks at an empty queue
+        :param max_attempts: attempts before an upload is marked failed
+        """
+        self.queue = queue
+        self.site = site
+        self.transport = transport
+        self.workers = max(1, workers)
+        self.emitter = emitter
+        self.logger = logger
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.owner = get_owner()
+        self._stop = threading.Event()
+        self._threads = []
+
+    @property
+    def is_alive(self):
+        return any(thread.is_alive() for thread in self._threads)
+
+    def start(self):
+        recovered = self.queue.recover(self.site)
+        if recovered and self.logger:
+            self.logger.info("UploadWorker: resuming {} interrupted uploads".format(recovered))
+        self._stop.clear()
+        self._threads = [threading.Thread(target=self._run, name='playblast_upload_{}'.format(i))
+                         for i in range(self.workers)]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def drain(self, timeout=None):
+        """
+        Waits until nothing is left to upload or timeout seconds have passed.
+        :return: True when the queue is empty
+        """
+        deadline = time.time() + timeout if timeout is not None else None
+        while self.queue.depth(self.site):
+            if deadline is not None and time.time() > deadline:
+                return False
+            time.sleep(min(self.poll_interval, 0.2))
+        return True
+
+    def _run(self):
+        while not self._stop.is_set():
+            item = self.queue.claim(self.site, self.owner)
+            if item is None:
+                self._stop.wait(self.poll_interval)
+                continue
+            self.upload(item)
+
+    def upload(self, item):
+        try:
+            self.transport.upload(item, progress=lambda offset: self.queue.set_offset(item['id'], offset))
+        except Exception as e:
+            delay = self.queue.fail(item['id'], e, self.max_attempts)
+            if self.logger:
+                if delay is None:
+                    self.logger.error("Upload of {} failed for good: {}".format(item['path'], e))
+                else:
+                    self.logger.warning("Upload of {} failed, retrying in {:.0f}s: {}".format(item['path'], delay, e))
+            return False
+        self.queue.complete(item['id'])
+        if self.logger:
+            self.logger.debug("Uploaded {} to {} {}".format(item['path'], item['entity_type'], item['entity_id']))
+        if self.emitter:
+            self.emitter('Uploaded {}'.format(os.path.basename(item['path'])))
+        return True
+
+
+_workers = {}
+_workers_lock = threading.Lock()
+
+
+def start_worker(queue, site, transport, workers=2, logger=None):
+    """
+    Starts the upload worker of a queue and site unless this process already runs one.
+    """
+    key = (os.path.abspath(queue.path), site)
+    with _workers_lock:
+        worker = _workers.get(key)
+        if worker is None or not worker.is_alive:
+            worker = _workers[key] = UploadWorker(queue, site, transport, workers, logger=logger).start()
+    return worker
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """
+    Stand-in upload endpoint: keeps the received bytes of every url under the server root.
+    """
+
+    def log_message(self, format, *args):
+        pass
+
+    def get_path(self):
+        return os.path.join(self.server.root, quote(self.path, safe=''))
+
+    def get_offset(self):
+        path = self.get_path()
+        return os.path.getsize(path) if os.path.exists(path) else 0
+
+    def reply(self, code, offset):
+        self.send_response(code)
+        self.send_header('Upload-Offset', str(offset))
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_HEAD(self):
+        self.reply(200, self.get_offset())
+
+    def do_PUT(self):
+        time.sleep(self.server.latency)
+        length = int(self.headers.get('Content-Length') or 0)
+        start = int(self.headers['Content-Range'].split()[1].split('-')[0])
+        offset = self.get_offset()
+        with self.server.lock:
+            self.server.requests += 1
+        if start != offset:
+            self.rfile.read(length)
+            return self.reply(409, offset)
+
+        data = self.rfile.read(length)
+        if random.random() < self.server.fail_rate:
+            # the link drops half way through the chunk: keep what arrived, like a real server would
+            data = data[:len(data) // 2]
+            with open(self.get_path(), 'ab') as fh:
+                fh.write(data)
+            with self.server.lock:
+                self.server.failures += 1
+            return self.reply(503, offset + len(data))
+        with open(self.get_path(), 'ab') as fh:
+            fh.write(data)
+        self.reply(200, offset + len(data))
+
+
+def serve_standin(root, port=0, fail_rate=0.0, latency=0.0):
+    """
+    Starts the stand-in server on a thread.
+    :return: the server, its url is http://127.0.0.1:<server.server_port>
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', port), StandInHandler)
+    server.root = root
+    server.fail_rate = fail_rate
+    server.latency = latency
+    server.requests = 0
+    server.failures = 0
+    server.lock = threading.Lock()
+    thread = threading.Thread(target=server.serve_forever, name='upload_standin')
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def _run_demo(file_count, size, fail_rate, latency, workers, chunk_size):
+    work_dir = tempfile.mkdtemp(prefix='upload_queue_demo_')
+    try:
+        server_root = os.path.join(work_dir, 'server')
+        os.makedirs(server_root)
+        server = serve_standin(server_root, fail_rate=fail_rate, latency=latency)
+        site = 'http://127.0.0.1:{}'.format(server.server_port)
+        # retry after a fraction of a second instead of the production backoff, to keep the demo short
+        queue = UploadQueue(os.path.join(work_dir, 'queue.sqlite'), backoff_base=0.05)
+        for i in range(file_count):
+            path = os.path.join(work_dir, 'movie_{:03d}.mov'.format(i))
+            with open(path, 'wb') as fh:
+                fh.write(os.urandom(size))
+            queue.enqueue(site, 'upload', 'Version', i + 1, path, 'sg_uploaded_movie')
+
+        start = time.time()
+        worker = UploadWorker(queue, site, HttpTransport(site, chunk_size), workers, poll_interval=0.1)
+        worker.start()
+        worker.drain()
+        worker.stop()
+        seconds = time.time() - start
+        server.shutdown()
+
+        received = sum(os.path.getsize(os.path.join(server_root, name)) for name in os.listdir(server_root))
+        print('{} files, {:.1f} MB in {:.2f}s ({:.1f} MB/s)'.format(file_count, file_count * size / 1024.0 ** 2,
+                                                                  seconds, file_count * size / 1024.0 ** 2 / seconds))
+        print('{} requests, {} dropped, {} bytes received for {} sent'.format(server.requests, server.failures,
+                                                                           received, file_count * size))
+        print('queue: {}'.format(queue.counts()))
+        return 0 if received == file_count * size else 1
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Playblast upload queue tools.')
+    subparsers = parser.add_subparsers(dest='command')
+    standin_parser = subparsers.add_parser('standin', help='run the stand-in upload server')
+    standin_parser.add_argument('--root', default=None, help='directory receiving the uploads')
+    standin_parser.add_argument('--port', type=int, default=8765)
+    standin_parser.add_argument('--fail-rate', type=float, default=0.0)
+    standin_parser.add_argument('--latency', type=float, default=0.0)
+    demo_parser = subparsers.add_parser('demo', help='upload files to a stand-in through the queue')
+    demo_parser.add_argument('--files', type=int, default=10)
+    demo_parser.add_argument('--size', default='20M')
+    demo_parser.add_argument('--fail-rate', type=float, default=0.3)
+    demo_parser.add_argument('--latency', type=float, default=0.0)
+    demo_parser.add_argument('--workers', type=int, default=2)
+    demo_parser.add_argument('--chunk-size', default='1M')
+    status_parser = subparsers.add_parser('status', help='print the state of a queue')
+    status_parser.add_argument('--db', required=True)
+    args = parser.parse_args(argv)
+
+    if args.command == 'standin':
+        root = args.root or tempfile.mkdtemp(prefix='upload_standin_')
+        server = serve_standin(root, args.port, args.fail_rate, args.latency)
+        print('Stand-in upload server on http://127.0.0.1:{}, storing uploads in {}'.format(server.server_port, root))
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            server.shutdown()
+        return 0
+    if args.command == 'demo':
+        return _run_demo(args.files, parse_size(args.size), args.fail_rate, args.latency, args.workers,
+                         parse_size(args.chunk_size))
+    if args.command == 'status':
+        print(UploadQueue(args.db).counts())
+        return 0
+    parser.print_help()
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,286 @@
+"""
+Hands out the version numbers of new playblasts.
+
+Every playblast used to look its version up with an ordered PublishedFile query per output
+path, twice for image sequences, and two playblasts of the same shot made before the first
+one was published, eg with the publish daemon, got the same number.
+
+VersionAllocator keeps, per key (site, entity, publish name, extension, publish type), the
+highest version known to be published or reserved:
+
+    reserve()   the next number, never handed out twice on the machine
+    latest()    the highest number, eg to show the next version without reserving it
+    release()   gives the last reservation back, for captures that failed
+
+Given a database path, reservations are kept in a sqlite file shared by every maya session
+and the publish daemon of the machine. A reservation takes the write lock of the database
+and adds one to the higher of the stored and the published numbers, so two processes never
+reserve the same version. Without a path they are only kept in this process.
+
+The published version is queried once per key, concurrent callers wait for that query
+instead of sending their own. After max_age seconds the next call queries again and keeps
+the higher of the published and reserved numbers, so versions published by other artists
+are picked up. The lookup of a reservation must query Shotgun itself, a cached number
+can miss the versions published since it was cached.
+
+    python version_allocator.py demo --playblasts 8 --latency 0.3 [--processes 4]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    from .compat import futures
+except (ImportError, ValueError):
+    # run as a script
+    from compat import futures
+
+# seconds a queried version is trusted before it is checked again
+MAX_AGE = 60.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reservations (
+    key TEXT PRIMARY KEY,
+    version INTEGER NOT NULL,
+    updated REAL NOT NULL
+);
+"""
+
+
+class VersionAllocator(object):
+    """
+    Thread safe allocator of version numbers.
+    """
+
+    def __init__(self, path=None, max_age=MAX_AGE):
+        """
+        Construction
+        :param path: optional sqlite database sharing the reservations between processes, created when missing
+        :param max_age: seconds a queried version is trusted, None to never query a key again
+        """
+        self.path = path
+        self.max_age = max_age
+        self.queries = 0
+        self._lock = threading.Lock()
+        # key: [highest published or reserved version, time of the last query]
+        self._entries = {}
+        # key: [version published, time of the last query], queried by latest before any reservation
+        self._peeks = {}
+        # (entries, key): Event of the query in flight
+        self._queries = {}
+        if path:
+            if not os.path.isdir(os.path.dirname(os.path.abspath(path))):
+                os.makedirs(os.path.dirname(os.path.abspath(path)))
+            with self._connect() as connection:
+                connection.executescript(SCHEMA)
+
+    def _connect(self):
+        # one connection per call, sqlite connections can not be shared between threads
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        connection.execute('PRAGMA journal_mode=WAL')
+        return _Connection(connection)
+
+    @staticmethod
+    def _serialize_key(key):
+        return json.dumps(list(key) if isinstance(key, tuple) else key)
+
+    def _get_stored(self, connection, key):
+        row = connection.execute('SELECT version FROM reservations WHERE key = ?',
+                                 (self._serialize_key(key),)).fetchone()
+        return row[0] if row else 0
+
+    def _is_fresh(self, entry):
+        return entry is not None and (self.max_age is None or time.time() - entry[1] < self.max_age)
+
+    def _refresh(self, key, lookup, entries=None):
+        entries = self._entries if entries is None else entries
+        query_key = (id(entries), key)
+        while True:
+            with self._lock:
+                if self._is_fresh(entries.get(key)):
+                    return
+                event = self._queries.get(query_key)
+                owner = event is None
+                if owner:
+                    event = self._queries[query_key] = threading.Event()
+            if not owner:
+                # the query of another caller, its result is checked on the next loop
+                event.wait()
+                continue
+
+            try:
+                published = lookup() or 0
+            except Exception:
+                with self._lock:
+                    del self._queries[query_key]
+                event.set()
+                raise
+            with self._lock:
+                self.queries += 1
+                entry = entries.get(key)
+                entries[key] = [max(published, entry[0] if entry else 0), time.time()]
+                del self._queries[query_key]
+            event.set()
+            return
+
+    def reserve(self, key, lookup):
+        """
+        Reserves the next version of a key.
+        :param key: hashable identifying the published file name, eg (site, entity type, entity id, name, ext, type)
+        :param lookup: callable querying Shotgun for the highest published version, 0 when there is none
+        :return: the reserved version
+        """
+        self._refresh(key, lookup)
+        with self._lock:
+            entry = self._entries[key]
+            if not self.path:
+                entry[0] += 1
+                return entry[0]
+            with self._connect() as connection:
+                # the write lock of the database, held until the reservation is stored
+                connection.execute('BEGIN IMMEDIATE')
+                version = max(entry[0], self._get_stored(connection, key)) + 1
+                connection.execute('INSERT OR REPLACE INTO reservations (key, version, updated) VALUES (?, ?, ?)',
+                                   (self._serialize_key(key), version, time.time()))
+                connection.execute('COMMIT')
+            entry[0] = version
+            return version
+
+    def latest(self, key, lookup):
+        """
+        :return: the highest published or reserved version of a key, see reserve
+        :param lookup: callable returning the highest published version, may go through a cache as its result
+                       is never reserved against
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            fresh = self._is_fresh(entry)
+        if not fresh:
+            self._refresh(key, lookup, self._peeks)
+        with self._lock:
+            version = max(self._entries.get(key, [0])[0], 0 if fresh else self._peeks[key][0])
+            if not self.path:
+                return version
+            with self._connect() as connection:
+                return max(version, self._get_stored(connection, key))
+
+    def release(self, key, version):
+        """
+        Gives a reservation back when it is still the last one of its key, in every process.
+        :return: True when released
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                return False
+            if self.path:
+                with self._connect() as connection:
+                    cursor = connection.execute(
+                        'UPDATE reservations SET version = ?, updated = ? WHERE key = ? AND version = ?',
+                        (version - 1, time.time(), self._serialize_key(key), version))
+                if not cursor.rowcount:
+                    # another process reserved after it
+                    return False
+            entry[0] -= 1
+            return True
+
+    def expire(self, key=None):
+        """
+        Makes the next call of a key, or of every key, query again. Reservations are kept.
+        """
+        with self._lock:
+            for entries in (self._entries, self._peeks):
+                for entry_key, entry in entries.items():
+                    if key is None or entry_key == key:
+                        entry[1] = 0.0
+
+
+class _Connection(object):
+    """
+    Closes the sqlite connection on exit, sqlite3 connections used as context managers only commit.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        return self.connection
+
+    def __exit__(self, *exc_info):
+        self.connection.close()
+
+
+_allocators = {}
+_allocators_lock = threading.Lock()
+
+
+def get_allocator(path=None):
+    """
+    Returns the allocator of this process for a reservation database, shared by every playblast of the session.
+    """
+    with _allocators_lock:
+        if path not in _allocators:
+            _allocators[path] = VersionAllocator(path)
+        return _allocators[path]
+
+
+def _reserve_versions(args):
+    path, playblasts, latency = args
+    allocator = VersionAllocator(path)
+
+    def lookup():
+        time.sleep(latency)
+        return 12
+
+    with futures.ThreadPoolExecutor(max_workers=playblasts) as executor:
+        return list(executor.map(lambda _: allocator.reserve(('Shot', 1, 'sh010_anim', 'mov', 'playblast'), lookup),
+                                 range(playblasts))), allocator.queries
+
+
+def _run_demo(playblasts, latency, processes):
+    temp_dir = tempfile.mkdtemp(prefix='version_allocator_')
+    path = os.path.join(temp_dir, 'versions.sqlite')
+    VersionAllocator(path)
+    start = time.time()
+    try:
+        if processes > 1:
+            pool = multiprocessing.Pool(processes)
+            try:
+                results = pool.map(_reserve_versions, [(path, playblasts, latency)] * processes)
+            finally:
+                pool.close()
+        else:
+            results = [_reserve_versions((path, playblasts, latency))]
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+    versions = sorted(version for reserved, _ in results for version in reserved)
+    print('{} processes of {} playblasts reserved {} in {:.2f}s with {} queries, {} duplicates'.format(
+        processes, playblasts, versions, time.time() - start, sum(queries for _, queries in results),
+        len(versions) - len(set(versions))))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Playblast version allocator tools.')
+    subparsers = parser.add_subparsers(dest='command')
+    demo_parser = subparsers.add_parser('demo', help='reserve versions from concurrent playblasts')
+    demo_parser.add_argument('--playblasts', type=int, default=8)
+    demo_parser.add_argument('--latency', type=float, default=0.3, help='seconds the version query takes')
+    demo_parser.add_argument('--processes', type=int, default=1, help='sessions reserving against one database')
+    args = parser.parse_args(argv)
+
+    if args.command != 'demo':
+        parser.print_help()
+        return 1
+    _run_demo(args.playblasts, args.latency, args.processes)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
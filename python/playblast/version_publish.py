@@ -0,0 +1,312 @@
+"""
+Shotgun side of a playblast publish: the Version, its Note, the review media uploads and
+the PublishedFile.
+
+Only needs a tk (for its thread local shotgun connection) and a context, so the same steps
+run in maya and in the publish daemon.
+
+Every request to a hosted site costs a round trip, so once the Version exists its Note and
+PublishedFile are created in a single batch. The PublishedFile data comes from
+register_publish in dry run mode, it is the entity register_publish would have created, and
+its PublishedFileType lookup runs while the Version is created. register_publish takes
+**kwargs, older cores ignore dry_run and create the PublishedFile, so the batch is only used
+from DRY_RUN_CORE_VERSION on and the PublishedFile is registered on its own before it.
+
+    python version_publish.py benchmark --latency 0.3
+
+publishes against a stub site answering every request after the given latency and reports
+the requests and wall time of the sequential and the batched publish.
+"""
+import argparse
+import os
+import re
+import sys
+import time
+
+try:
+    from .compat import futures
+except (ImportError, ValueError):
+    # run as a script
+    from compat import futures
+
+# first core whose register_publish knows dry_run
+DRY_RUN_CORE_VERSION = 'v0.19.0'
+
+
+def is_core_version_at_least(version, minimum):
+    """
+    Compares tk-core versions like v0.19.18, a HEAD or master checkout is newer than any release.
+    :param version: core version, eg tk.version, None or an unparsable version is older than any release
+    """
+    if version in ('HEAD', 'master'):
+        return True
+    numbers = re.findall(r'\d+', version or '')
+    if not numbers:
+        return False
+    return [int(number) for number in numbers] >= [int(number) for number in re.findall(r'\d+', minimum)]
+
+
+class VersionPublisher(object):
+    """
+    Publishes a playblast movie to Shotgun.
+    """
+
+    def __init__(self, tk, context, register_publish, logger=None, emitter=None, upload_queue=None, batch=True):
+        """
+        Construction
+        :param tk: toolkit instance, tk.shotgun hands every thread its own connection
+        :param context: object with entity, project, user and task, eg an sgtk Context
+        :param register_publish: sgtk.util.register_publish or a stand-in with its signature
+        :param logger: optional logger
+        :param emitter: optional callable receiving progress messages
+        :param upload_queue: optional upload_queue.UploadQueue, the media is queued instead of uploaded
+        :param batch: create the Note and the PublishedFile in one batch request, only used on cores from
+                      DRY_RUN_CORE_VERSION on
+        """
+        self.tk = tk
+        self.context = context
+        self.register_publish = register_publish
+        self.logger = logger
+        self.emitter = emitter
+        self.upload_queue = upload_queue
+        self.batch = batch and is_core_version_at_least(getattr(tk, 'version', None), DRY_RUN_CORE_VERSION)
+        if batch and not self.batch:
+            self._debug("core {} has no register_publish dry run, publishing without batch".format(
+                getattr(tk, 'version', None)))
+        self.site = getattr(tk, 'shotgun_url', None) or ''
+
+    def _emit(self, message):
+        if self.emitter:
+            self.emitter(message)
+
+    def _debug(self, message):
+        if self.logger:
+            self.logger.debug(message)
+
+    def create_version(self, movie_path, frames_path, first_frame, last_frame, version_type='Artist Version'):
+        """
+        Creates the Version of a playblast.
+        :return: the Version entity
+        """
+        self._emit('Uploading media to Shotgun entity')
+        return self.tk.shotgun.create(
+            'Version',
+            {
+                'code': os.path.basename(movie_path),
+                'entity': self.context.entity,
+                'project': self.context.project,
+                'user': self.context.user,
+                'sg_path_to_movie': movie_path,
+                'sg_path_to_frames': frames_path,
+                'sg_version_type': version_type,
+                'sg_task': self.context.task or None,
+                'sg_first_frame': first_frame,
+                'sg_last_frame': last_frame
+            }
+        )
+
+    def get_note_data(self, version_entity, movie_path, description, note_type='Artist Version'):
+        return {
+            'note_links': [self.context.entity, version_entity] or None,
+            'project': self.context.project,
+            'subject': 'Playblast from {}'.format(os.path.basename(movie_path)),
+            'content': description,
+            'sg_note_type': note_type
+        }
+
+    def create_note(self, version_entity, movie_path, description, note_type='Artist Version'):
+        return self.tk.shotgun.create('Note', data=self.get_note_data(version_entity, movie_path, description,
+                                                                      note_type))
+
+    def upload_media(self, version_entity, movie_path, review_media=None):
+        """
+        Uploads the review media of a Version in parallel: the web proxy as sg_uploaded_movie,
+        falling back to the movie itself, and the prebuilt thumbnail and filmstrip so Shotgun
+        does not have to generate them.
+        Each upload runs on its own thread, tk.shotgun hands every thread its own connection.
+        With an upload queue the uploads are only recorded, its worker sends them.
+        :param version_entity: the Version to upload to
+        :param movie_path: the review movie
+        :param review_media: optional ReviewMedia of the movie
+        """
+        uploads = [('upload', movie_path, 'sg_uploaded_movie')]
+        if review_media:
+            uploads = [('upload', review_media.proxy_path, 'sg_uploaded_movie'),
+                       ('upload_thumbnail', review_media.thumbnail_path, None),
+                       ('upload_filmstrip_thumbnail', review_media.filmstrip_path, None)]
+
+        if self.upload_queue:
+            for method, path, field_name in uploads:
+                # review media lives in a temp directory removed after the publish, the movie is published
+                self.upload(method, version_entity, path, field_name, spool=review_media is not None)
+            self._emit('{} uploads queued for Version {}'.format(len(uploads), version_entity['id']))
+            return
+
+        with futures.ThreadPoolExecutor(max_workers=len(uploads)) as executor:
+            for job in [executor.submit(self.upload, method, version_entity, path, field_name)
+                        for method, path, field_name in uploads]:
+                job.result()
+
+    def upload(self, method, entity, path, field_name=None, spool=False):
+        """
+        Uploads a file to an entity, or queues it when there is an upload queue.
+        :param method: upload, upload_thumbnail or upload_filmstrip_thumbnail
+        :param spool: the file is temporary, the queue keeps a copy
+        """
+        if self.upload_queue:
+            return self.upload_queue.enqueue(self.site, method, entity['type'], entity['id'], path, field_name,
+                                             spool=spool)
+        args = [entity['type'], entity['id'], path]
+        if field_name:
+            args.append(field_name)
+        getattr(self.tk.shotgun, method)(*args)
+        self._debug("Uploaded {} to {} {}".format(path, entity['type'], entity['id']))
+
+    def register(self, version_entity, movie_path, publish_name, version_number, publish_type, pass_type,
+                 thumbnail_path=None):
+        """
+        Registers the movie as a PublishedFile linked to the Version.
+        """
+        self._emit('Registering playblast on shotgun as PublishedFile..')
+        return self.register_publish(
+            self.tk,
+            self.context,
+            movie_path,
+            publish_name,
+            version_number,
+            published_file_type=publish_type,
+            version_entity=version_entity,
+            thumbnail_path=thumbnail_path,
+            sg_fields={'sg_pass_type': pass_type.lower()}
+        )
+
+    def get_publish_data(self, movie_path, publish_name, version_number, publish_type, pass_type):
+        """
+        Runs register_publish in dry run mode, without a Version so it can run while the Version
+        is created.
+        :return: the PublishedFile data, None without batch, see DRY_RUN_CORE_VERSION
+        """
+        if not self.batch:
+            return None
+        data = self.register_publish(
+            self.tk,
+            self.context,
+            movie_path,
+            publish_name,
+            version_number,
+            published_file_type=publish_type,
+            sg_fields={'sg_pass_type': pass_type.lower()},
+            dry_run=True
+        )
+        return dict((key, value) for key, value in data.items() if key not in ('type', 'id'))
+
+    def create_note_and_publish(self, version_entity, movie_path, publish_name, version_number, publish_type,
+                                pass_type, description=None, note_type='Artist Version', thumbnail_path=None,
+                                publish_data=None):
+        """
+        Creates the Note and the PublishedFile of a Version. In batch mode both are created in one
+        request, otherwise one after the other.
+        :param publish_data: optional result of get_publish_data
+        :return: the PublishedFile entity
+        """
+        if self.batch and publish_data is None:
+            publish_data = self.get_publish_data(movie_path, publish_name, version_number, publish_type, pass_type)
+
+        if not self.batch or publish_data is None:
+            if description:
+                self.create_note(version_entity, movie_path, description, note_type)
+            return self.register(version_entity, movie_path, publish_name, version_number, publish_type, pass_type,
+                                 thumbnail_path=thumbnail_path)
+
+        self._emit('Registering playblast on shotgun as PublishedFile..')
+        requests = [{'request_type': 'create', 'entity_type': 'PublishedFile',
+                     'data': dict(publish_data, version=version_entity)}]
+        if description:
+            requests.append({'request_type': 'create', 'entity_type': 'Note',
+                             'data': self.get_note_data(version_entity, movie_path, description, note_type)})
+        published_file = self.tk.shotgun.batch(requests)[0]
+        if thumbnail_path:
+            self.upload('upload_thumbnail', published_file, thumbnail_path, spool=True)
+        return published_file
+
+    def publish(self, movie_path, frames_path, first_frame, last_frame, publish_name, version_number, publish_type,
+                pass_type, description=None, note_type='Artist Version', review_media=None):
+        """
+        Runs every step of the publish. In batch mode the PublishedFile dry run overlaps the
+        Version creation and the uploads overlap the Note and PublishedFile batch, leaving two
+        round trips on the critical path.
+        :return: the Version entity
+        """
+        review_media = review_media if review_media and review_media.exists else None
+        with futures.ThreadPoolExecutor(max_workers=1) as executor:
+            publish_data = None
+            if self.batch:
+                publish_data = executor.submit(self.get_publish_data, movie_path, publish_name, version_number,
+                                               publish_type, pass_type)
+            version_entity = self.create_version(movie_path, frames_path, first_frame, last_frame)
+            self._debug('version_entity: {}'.format(version_entity))
+            if publish_data:
+                publish_data = publish_data.result()
+
+            uploads = None
+            if self.batch and not self.upload_queue:
+                uploads = executor.submit(self.upload_media, version_entity, movie_path, review_media)
+            else:
+                self.upload_media(version_entity, movie_path, review_media)
+
+            self.create_note_and_publish(version_entity, movie_path, publish_name, version_number, publish_type,
+                                         pass_type, description, note_type,
+                                         thumbnail_path=review_media.thumbnail_path if review_media else None,
+                                         publish_data=publish_data)
+            if uploads:
+                uploads.result()
+        return version_entity
+
+
+class _BenchmarkContext(object):
+    entity = {'type': 'Shot', 'id': 1, 'name': 'sh010'}
+    project = {'type': 'Project', 'id': 2, 'name': 'project'}
+    user = {'type': 'HumanUser', 'id': 3, 'name': 'artist'}
+    task = {'type': 'Task', 'id': 4, 'name': 'anim'}
+
+
+def _run_benchmark(latency, runs):
+    try:
+        from . import stubs
+    except (ImportError, ValueError):
+        import stubs
+
+    print('{:<12} {:>10} {:>12} {:>12}'.format('mode', 'requests', 'entities', 'seconds'))
+    for batch in (False, True):
+        shotgun = stubs.StubShotgun(latency=latency)
+        publisher = VersionPublisher(stubs.StubTk(shotgun), _BenchmarkContext(), stubs.register_publish, batch=batch)
+        start = time.time()
+        for run in range(runs):
+            publisher.publish('/show/sh010/playblast/sh010_v{:03d}.mov'.format(run + 1),
+                              '/show/sh010/playblast/.source/sh010_v{:03d}.%04d.jpg'.format(run + 1),
+                              1001, 1100, 'sh010', run + 1, 'playblast', 'wireframe',
+                              description='Playblast Data')
+        seconds = (time.time() - start) / runs
+        entity_requests = [call for call in shotgun.calls if not call[0].startswith('upload')]
+        print('{:<12} {:>10.1f} {:>12.1f} {:>12.2f}'.format('batch' if batch else 'sequential',
+                                                          len(shotgun.calls) / float(runs),
+                                                          len(entity_requests) / float(runs), seconds))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Playblast Shotgun publish tools.')
+    subparsers = parser.add_subparsers(dest='command')
+    benchmark_parser = subparsers.add_parser('benchmark', help='compare the sequential and the batched publish')
+    benchmark_parser.add_argument('--latency', type=float, default=0.3, help='seconds per request of the stub site')
+    benchmark_parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    if args.command != 'benchmark':
+        parser.print_help()
+        return 1
+    _run_benchmark(args.latency, args.runs)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,67 @@
+"""
+Display settings of the model panel a playblast is captured through.
+
+cmds.playblast draws the panel in focus with its display mode, lighting, shading and
+show flags. get_display_settings reads them from the panel of the interactive session,
+create_capture_panel rebuilds a panel through a camera with the same settings, eg in the
+mayapy workers of a chunked capture, so every chunk is drawn like the interactive capture.
+
+maya.cmds is passed in so the settings can be handed over as json.
+"""
+
+# modelEditor flags copied from the interactive panel, in the order they are applied
+DISPLAY_FLAGS = (
+    'displayAppearance', 'displayLights', 'displayTextures', 'wireframeOnShaded', 'shadows', 'twoSidedLighting',
+    'xray', 'jointXray', 'backfaceCulling', 'useDefaultMaterial', 'smoothWireframe', 'textures', 'grid', 'hud',
+    'nurbsCurves', 'nurbsSurfaces', 'polymeshes', 'subdivSurfaces', 'planes', 'lights', 'cameras', 'joints',
+    'ikHandles', 'deformers', 'dynamics', 'fluids', 'hairSystems', 'follicles', 'nCloths', 'nParticles', 'nRigids',
+    'dynamicConstraints', 'locators', 'dimensions', 'pivots', 'handles', 'strokes', 'motionTrails', 'pluginShapes',
+    'manipulators', 'imagePlane',
+)
+CAPTURE_WINDOW = 'playblastCaptureWindow'
+
+
+def get_display_settings(cmds, panel):
+    """
+    Returns the display settings of a model panel.
+    :return: {modelEditor flag: value}, flags the maya version does not know are left out
+    """
+    settings = {}
+    for flag in DISPLAY_FLAGS:
+        try:
+            settings[flag] = cmds.modelEditor(panel, query=True, **{flag: True})
+        except (RuntimeError, TypeError):
+            continue
+    return settings
+
+
+def apply_display_settings(cmds, panel, settings):
+    """
+    Applies display settings read by get_display_settings to a model panel.
+    """
+    for flag in DISPLAY_FLAGS:
+        if flag not in settings:
+            continue
+        try:
+            cmds.modelEditor(panel, edit=True, **{flag: settings[flag]})
+        except (RuntimeError, TypeError):
+            continue
+
+
+def create_capture_panel(cmds, camera, width, height, settings=None):
+    """
+    Creates a window holding a model panel looking through camera, with the display settings
+    of the interactive panel, and gives it the focus cmds.playblast captures.
+    Raises RuntimeError when the session has no UI to create it in.
+    :return: (window, panel), delete the window once captured
+    """
+    if cmds.window(CAPTURE_WINDOW, exists=True):
+        cmds.deleteUI(CAPTURE_WINDOW)
+    window = cmds.window(CAPTURE_WINDOW, width=width, height=height)
+    cmds.paneLayout()
+    panel = cmds.modelPanel(menuBarVisible=False, camera=camera)
+    cmds.modelEditor(panel, edit=True, camera=camera, activeView=True)
+    apply_display_settings(cmds, panel, settings or {})
+    cmds.showWindow(window)
+    cmds.setFocus(panel)
+    return window, panel
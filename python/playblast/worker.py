@@ -0,0 +1,125 @@
+"""
+Runs the post-capture part of a playblast off maya's main thread.
+
+Once cmds.playblast has returned, copying the frames, slating, encoding and the Shotgun
+publish do not need maya any more. PostCaptureWorker runs PlayblastManager.finish_playblast
+in a QThreadPool thread and reports back through Qt signals, which are queued to the
+dialog's thread, so the artist gets maya back as soon as the last frame is captured.
+
+LookupWorker does the same for the Shotgun lookups of the dialog: each runs on its own pool
+thread as soon as the dialog opens and its result fills the widgets when it arrives.
+"""
+import time
+import traceback
+
+import sgtk
+from sgtk.platform.qt import QtCore
+
+from .ffmpeg_runner import FFmpegCancelled
+from .playblast import PlayblastCancelled
+
+logger = sgtk.platform.get_logger(__name__)
+
+# workers are owned by the pool while running, keep their python side alive until they finish
+_running_workers = set()
+
+
+class PostCaptureSignals(QtCore.QObject):
+    """
+    Signals of a PostCaptureWorker, QRunnable is not a QObject.
+    """
+    progress = QtCore.Signal(str)
+    finished = QtCore.Signal(object)
+    failed = QtCore.Signal(str)
+    cancelled = QtCore.Signal()
+
+
+class PostCaptureWorker(QtCore.QRunnable):
+    """
+    Publishes a captured playblast on a pool thread.
+    """
+
+    def __init__(self, manager, capture):
+        """
+        Construction
+        :param manager: the PlayblastManager that captured the playblast
+        :param capture: the capture state returned by PlayblastManager.capture_playblast
+        """
+        QtCore.QRunnable.__init__(self)
+        self.setAutoDelete(False)
+        self.manager = manager
+        self.capture = capture
+        self.signals = PostCaptureSignals()
+
+    def start(self, pool=None):
+        _running_workers.add(self)
+        (pool or QtCore.QThreadPool.globalInstance()).start(self)
+        return self
+
+    def cancel(self):
+        """
+        Cancels the publish, safe to call from the main thread while run() is going.
+        """
+        self.manager.cancel()
+
+    def run(self):
+        # the manager's emitter may touch widgets, route its messages through the queued signal
+        emitter = self.manager.set_emitter(self.signals.progress.emit)
+        try:
+            result = self.manager.finish_playblast(self.capture)
+        except (PlayblastCancelled, FFmpegCancelled):
+            logger.info("Playblast publish cancelled")
+            self.signals.cancelled.emit()
+        except Exception:
+            message = traceback.format_exc()
+            logger.error("Playblast publish failed:\n{}".format(message))
+            self.signals.failed.emit(message)
+        else:
+            self.signals.finished.emit(result)
+        finally:
+            self.manager.set_emitter(emitter)
+            _running_workers.discard(self)
+
+
+class LookupSignals(QtCore.QObject):
+    """
+    Signals of a LookupWorker: its name with the result or the error, and the seconds it took.
+    """
+    finished = QtCore.Signal(str, object, float)
+    failed = QtCore.Signal(str, str, float)
+
+
+class LookupWorker(QtCore.QRunnable):
+    """
+    Runs one lookup, a callable that only talks to Shotgun, on a pool thread.
+    """
+
+    def __init__(self, name, lookup):
+        """
+        Construction
+        :param name: name of the lookup, passed back with its result
+        :param lookup: callable without arguments, must not call maya
+        """
+        QtCore.QRunnable.__init__(self)
+        self.setAutoDelete(False)
+        self.name = name
+        self.lookup = lookup
+        self.signals = LookupSignals()
+
+    def start(self, pool=None):
+        _running_workers.add(self)
+        (pool or QtCore.QThreadPool.globalInstance()).start(self)
+        return self
+
+    def run(self):
+        start = time.time()
+        try:
+            result = self.lookup()
+        except Exception:
+            message = traceback.format_exc()
+            logger.debug("Lookup {} failed:\n{}".format(self.name, message))
+            self.signals.failed.emit(self.name, message, time.time() - start)
+        else:
+            self.signals.finished.emit(self.name, result, time.time() - start)
+        finally:
+            _running_workers.discard(self)
@@ -0,0 +1,14 @@
+"""
+Loads python/playblast as the playblast package without running its __init__, which
+imports the maya dialog, so the modules that do not need maya can be tested anywhere.
+"""
+import os
+import sys
+import types
+
+PACKAGE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'python', 'playblast')
+
+if 'playblast' not in sys.modules:
+    package = types.ModuleType('playblast')
+    package.__path__ = [PACKAGE_DIR]
+    sys.modules['playblast'] = package
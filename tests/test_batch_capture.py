@@ -0,0 +1,143 @@
+"""
+Tests of batch_capture: the frame range split, the worker count and the chunked capture run
+with --standin workers, which write placeholder frames instead of starting maya.
+"""
+import logging
+import os
+import sys
+import types
+
+import pytest
+
+from playblast import batch_capture
+from playblast.batch_capture import (NO_PANEL_EXIT_CODE, CapturePanelError, ChunkedCapture, pick_worker_count,
+                                     split_frame_range)
+
+GB = 1024 ** 3
+
+
+class App(object):
+    logger = logging.getLogger('test_batch_capture')
+
+
+def make_capture(tmpdir, start=1001, end=1010, workers=3, **kwargs):
+    params = {'startTime': start, 'endTime': end, 'filename': str(tmpdir.join('capture', 'maya_playblast')),
+              'framePadding': 4, 'compression': 'jpg', 'width': 960, 'height': 540}
+    return ChunkedCapture(App(), '/show/sh010/scene.ma', 'shotCam', params, workers=workers, standin=True,
+                          emitter=lambda message: None, **kwargs)
+
+
+@pytest.mark.parametrize('start, end, chunks, expected', [
+    (1001, 1010, 3, [(1001, 1004), (1005, 1007), (1008, 1010)]),
+    (1, 4, 4, [(1, 1), (2, 2), (3, 3), (4, 4)]),
+    (1, 3, 8, [(1, 1), (2, 2), (3, 3)]),
+    (5, 5, 0, [(5, 5)]),
+    (10, 9, 2, []),
+])
+def test_split_frame_range(start, end, chunks, expected):
+    assert split_frame_range(start, end, chunks) == expected
+
+
+def test_split_frame_range_covers_the_range_in_order():
+    ranges = split_frame_range(1001, 1437, 7)
+    frames = [frame for chunk_start, chunk_end in ranges for frame in range(chunk_start, chunk_end + 1)]
+    assert frames == list(range(1001, 1438))
+    sizes = [chunk_end - chunk_start + 1 for chunk_start, chunk_end in ranges]
+    assert max(sizes) - min(sizes) <= 1
+
+
+@pytest.mark.parametrize('frame_count, cpu_count, available_memory, expected', [
+    # half of the cores
+    (1000, 16, 64 * GB, 8),
+    # the memory fits 3 workers
+    (1000, 16, 13 * GB, 3),
+    # 120 frames are worth 3 scene loads
+    (120, 16, 64 * GB, 3),
+    (10, 1, 1 * GB, 1),
+])
+def test_pick_worker_count(frame_count, cpu_count, available_memory, expected):
+    assert pick_worker_count(frame_count, cpu_count=cpu_count, available_memory=available_memory,
+                             worker_memory=4 * GB) == expected
+
+
+def test_standin_chunks_merge_into_one_sequence(tmpdir):
+    capture = make_capture(tmpdir, display_settings={'displayAppearance': 'smoothShaded'}, focal_length=35.0)
+    capture.POLL_INTERVAL = 0.01
+
+    output = capture.run()
+
+    assert output == str(tmpdir.join('capture', 'maya_playblast.####.jpg'))
+    capture_dir = tmpdir.join('capture')
+    assert sorted(os.listdir(str(capture_dir))) == ['maya_playblast.{}.jpg'.format(frame)
+                                                    for frame in range(1001, 1011)]
+    for frame in range(1001, 1011):
+        assert capture_dir.join('maya_playblast.{}.jpg'.format(frame)).read() == \
+            'standin frame {} of /show/sh010/scene.ma\n'.format(frame)
+
+
+def test_worker_args_carry_the_display_settings(tmpdir):
+    capture = make_capture(tmpdir, display_settings={'displayAppearance': 'smoothShaded'}, focal_length=35.0)
+    args = capture.get_worker_args(1001, 1004, '/tmp/chunk_0/maya_playblast')
+    assert args[args.index('--display') + 1] == '{"displayAppearance": "smoothShaded"}'
+    assert args[args.index('--focal-length') + 1] == '35.0'
+    assert '--standin' in args
+
+
+def test_failing_chunk_raises_and_cleans_up(tmpdir, monkeypatch):
+    capture = make_capture(tmpdir)
+    capture.POLL_INTERVAL = 0.01
+    monkeypatch.setattr(capture, 'get_worker_args',
+                        lambda start, end, output: [sys.executable, '-c', 'import sys; sys.exit(2)'])
+
+    with pytest.raises(RuntimeError) as error:
+        capture.run()
+    assert not isinstance(error.value, CapturePanelError)
+    assert os.listdir(str(tmpdir.join('capture'))) == []
+
+
+def test_worker_without_panel_raises_capture_panel_error(tmpdir, monkeypatch):
+    capture = make_capture(tmpdir)
+    capture.POLL_INTERVAL = 0.01
+    monkeypatch.setattr(capture, 'get_worker_args', lambda start, end, output: [
+        sys.executable, '-c', 'import sys; sys.exit({})'.format(NO_PANEL_EXIT_CODE)])
+
+    with pytest.raises(CapturePanelError):
+        capture.run()
+
+
+class NoViewportCmds(object):
+    """
+    maya.cmds of a maya.standalone: no window can be created.
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    def __getattr__(self, name):
+        def call(*args, **kwargs):
+            self.calls.append(name)
+            if name == 'window' and not kwargs.get('exists'):
+                raise RuntimeError('window: no UI in batch mode')
+            return False
+        return call
+
+
+def test_worker_without_panel_fails_instead_of_capturing(tmpdir, monkeypatch):
+    cmds = NoViewportCmds()
+    standalone = types.ModuleType('maya.standalone')
+    standalone.initialize = lambda name=None: None
+    standalone.uninitialize = lambda: None
+    maya = types.ModuleType('maya')
+    maya.cmds = cmds
+    maya.standalone = standalone
+    monkeypatch.setitem(sys.modules, 'maya', maya)
+    monkeypatch.setitem(sys.modules, 'maya.cmds', cmds)
+    monkeypatch.setitem(sys.modules, 'maya.standalone', standalone)
+
+    with pytest.raises(SystemExit) as exit_info:
+        batch_capture.main(['--scene', '/show/sh010/scene.ma', '--camera', 'shotCam', '--start', '1001',
+                            '--end', '1004', '--output', str(tmpdir.join('maya_playblast'))])
+
+    assert exit_info.value.code == NO_PANEL_EXIT_CODE
+    assert 'playblast' not in cmds.calls
+    assert 'setAttr' not in cmds.calls
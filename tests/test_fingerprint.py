@@ -0,0 +1,170 @@
+"""
+Fingerprints and the carry forward step against a mocked maya.cmds.
+"""
+import os
+
+import pytest
+
+from playblast.fingerprint import FingerprintStore, FrameFingerprinter, carry_forward_frames
+
+
+class MockCmds(object):
+    """
+    The maya.cmds calls of the fingerprinter, answered from a scene description.
+    """
+
+    def __init__(self, nodes, values=None, connections=None, keyable=None):
+        """
+        :param nodes: {node: node type}
+        :param values: {plug: value or callable(frame)}, the plugs missing are 0.0
+        :param connections: {source node: [destination plugs]}
+        :param keyable: {node: [keyable attributes]}
+        """
+        self.nodes = nodes
+        self.values = values or {}
+        self.connections = connections or {}
+        self.keyable = keyable or {}
+        self.current_frame = 1
+
+    def _is_type(self, node, node_type):
+        node_type_of = self.nodes[node]
+        if node_type == 'animCurve':
+            return node_type_of.startswith('animCurve')
+        if node_type == 'shape':
+            return node_type_of in ('mesh', 'camera')
+        return node_type_of == node_type
+
+    def ls(self, type=None, shapes=False, materials=False, long=False, noIntermediate=False):
+        types = [type] if isinstance(type, str) else type or []
+        if shapes:
+            types = ['shape']
+        if materials:
+            types = ['lambert']
+        if any(node_type not in ('transform', 'shape', 'lambert', 'animCurve', 'animBlendNodeBase', 'pairBlend',
+                                 'expression', 'geometryFilter', 'cacheFile', 'gpuCache', 'nucleus', 'particle',
+                                 'fluidShape', 'hairSystem') for node_type in types):
+            raise RuntimeError('Unknown object type')
+        return [node for node in sorted(self.nodes) if any(self._is_type(node, t) for t in types)]
+
+    def listConnections(self, node, **kwargs):
+        return list(self.connections.get(node, []))
+
+    def listAttr(self, node, keyable=False, scalar=False):
+        return list(self.keyable.get(node, []))
+
+    def getAttr(self, plug, time=None):
+        value = self.values.get(plug, 0.0)
+        if callable(value):
+            return value(self.current_frame if time is None else time)
+        return value
+
+
+def make_scene(**overrides):
+    nodes = {'ball': 'transform', 'ballShape': 'mesh', 'shotCam': 'transform', 'shotCamShape': 'camera',
+             'ball_translateY': 'animCurveTL', 'blinn1': 'lambert'}
+    values = {'ball.worldMatrix[0]': lambda frame: [1.0] * 12 + [0.0, frame * 0.5, 0.0, 1.0],
+              'shotCam.worldMatrix[0]': [1.0] * 16,
+              'shotCamShape.focalLength': 35.0,
+              'ballShape.boundingBoxMin': [-1.0, -1.0, -1.0],
+              'ballShape.boundingBoxMax': [1.0, 1.0, 1.0],
+              'blinn1.diffuse': 0.8}
+    nodes.update(overrides.pop('nodes', {}))
+    values.update(overrides.pop('values', {}))
+    return MockCmds(nodes, values, connections={'ball_translateY': ['ball.translateY']},
+                    keyable={'blinn1': ['diffuse']}, **overrides)
+
+
+def fingerprint(cmds, start=1, end=10):
+    return FrameFingerprinter(cmds, 'shotCamShape', {'width': 960}).fingerprint_range(start, end)
+
+
+def changed_frames(before, after):
+    return sorted(frame for frame in before if before[frame] != after[frame])
+
+
+def test_fingerprints_are_stable():
+    assert fingerprint(make_scene()) == fingerprint(make_scene())
+
+
+def test_keyed_change_only_changes_its_frames():
+    before = fingerprint(make_scene())
+    after = fingerprint(make_scene(values={'ball.worldMatrix[0]': lambda frame: [1.0] * 12 + [
+        0.0, frame * (0.7 if frame in (4, 5) else 0.5), 0.0, 1.0]}))
+    assert changed_frames(before, after) == [4, 5]
+
+
+def test_constraint_without_anim_curve_is_seen():
+    # a transform driven by a constraint: no anim curve, only its world matrix moves
+    scene = dict(nodes={'box': 'transform', 'box_parentConstraint1': 'parentConstraint'},
+                 values={'box.worldMatrix[0]': lambda frame: [float(frame)] * 16})
+    before = fingerprint(make_scene(**scene))
+    scene['values'] = {'box.worldMatrix[0]': lambda frame: [float(frame) + (frame == 7)] * 16}
+    assert changed_frames(before, fingerprint(make_scene(**scene))) == [7]
+
+
+def test_expression_driven_shader_is_seen():
+    scene = make_scene(nodes={'expression1': 'expression'}, values={'blinn1.color': lambda frame: frame * 0.1})
+    scene.connections['expression1'] = ['blinn1.color']
+    before = fingerprint(scene)
+    scene.values['blinn1.color'] = lambda frame: 1.0 if frame == 2 else frame * 0.1
+    assert changed_frames(before, fingerprint(scene)) == [2]
+
+
+def test_non_keyed_edit_changes_every_frame():
+    before = fingerprint(make_scene())
+    after = fingerprint(make_scene(values={'blinn1.diffuse': 0.5}))
+    assert changed_frames(before, after) == list(range(1, 11))
+
+
+def test_caches_are_always_captured():
+    assert fingerprint(make_scene(nodes={'ocean_cache': 'cacheFile'})) is None
+
+
+def test_unknown_plugin_types_are_ignored():
+    # AlembicNode is not a type while its plugin is not loaded
+    assert fingerprint(make_scene()) is not None
+
+
+def test_split_and_carry_forward(tmp_path):
+    previous_dir = tmp_path / 'v001'
+    capture_dir = tmp_path / 'capture'
+    publish_dir = tmp_path / 'v002'
+    for directory in (previous_dir, capture_dir, publish_dir):
+        directory.mkdir()
+
+    before = fingerprint(make_scene())
+    for frame in before:
+        (previous_dir / 'shot_v001.{:04d}.jpg'.format(frame)).write_text(u'v001 {}'.format(frame))
+    FingerprintStore(before, 'shot_v001.%04d.jpg').save(str(previous_dir))
+
+    after = fingerprint(make_scene(values={'ball.worldMatrix[0]': lambda frame: [1.0] * 12 + [
+        0.0, frame * (0.9 if frame == 3 else 0.5), 0.0, 1.0]}))
+    store = FingerprintStore.load(str(previous_dir))
+    changed, unchanged = store.split_frames(after)
+    assert changed == [3]
+    assert unchanged == [1, 2, 4, 5, 6, 7, 8, 9, 10]
+
+    for frame in changed:
+        (capture_dir / 'pb.{:04d}.jpg'.format(frame)).write_text(u'v002 {}'.format(frame))
+
+    def copy_file(source, dest, size):
+        with open(source) as src, open(dest, 'w') as dst:
+            dst.write(src.read())
+
+    carried = carry_forward_frames(range(1, 11), str(capture_dir / 'pb.%04d.jpg'),
+                                   str(publish_dir / 'shot_v002.%04d.jpg'), copy_file,
+                                   previous_store=store, unchanged=unchanged)
+    assert carried == 9
+    assert (publish_dir / 'shot_v002.0003.jpg').read_text() == u'v002 3'
+    assert (publish_dir / 'shot_v002.0004.jpg').read_text() == u'v001 4'
+
+
+def test_previous_frame_missing_is_captured(tmp_path):
+    fingerprints = fingerprint(make_scene())
+    FingerprintStore(fingerprints, 'shot_v001.%04d.jpg').save(str(tmp_path))
+    for frame in fingerprints:
+        if frame != 6:
+            (tmp_path / 'shot_v001.{:04d}.jpg'.format(frame)).write_text(u'')
+    changed, unchanged = FingerprintStore.load(str(tmp_path)).split_frames(fingerprints)
+    assert changed == [6]
+    assert not os.path.exists(str(tmp_path / 'shot_v001.0006.jpg'))
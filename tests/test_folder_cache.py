@@ -0,0 +1,90 @@
+"""
+Call counts of the output path formatting against stubs.StubTk, with and without folder_cache.FolderCache.
+"""
+import os
+import shutil
+import time
+
+from playblast import stubs
+from playblast.folder_cache import FolderCache, _format_output_paths
+
+
+def make_tk(**kwargs):
+    tk = stubs.StubTk(**kwargs)
+    return tk, stubs.StubContext(tk)
+
+
+def test_uncached_playblast_walks_the_schema_per_path():
+    tk, context = make_tk()
+    _format_output_paths(tk, context, None)
+    assert tk.calls == {'create_filesystem_structure': 2, 'as_template_fields': 2}
+
+
+def test_image_playblast_creates_folders_once_and_reads_fields_once_per_template():
+    tk, context = make_tk()
+    folder_cache = FolderCache(tk, config_paths=[])
+
+    _format_output_paths(tk, context, folder_cache)
+    assert tk.calls == {'create_filesystem_structure': 1, 'as_template_fields': 2}
+
+    for _ in range(4):
+        _format_output_paths(tk, context, folder_cache)
+    assert tk.calls == {'create_filesystem_structure': 1, 'as_template_fields': 2}
+
+
+def test_template_fields_are_copies():
+    tk, context = make_tk()
+    folder_cache = FolderCache(tk, config_paths=[])
+    fields = folder_cache.get_template_fields(context, tk.templates['playblast_mov'])
+    fields['version'] = 3
+    assert 'version' not in folder_cache.get_template_fields(context, tk.templates['playblast_mov'])
+
+
+def test_config_change_drops_the_memo(tmpdir):
+    tk, context = make_tk()
+    path_cache = tmpdir.join('path_cache.db')
+    path_cache.write('')
+    templates = tmpdir.join('templates.yml')
+    templates.write('')
+    folder_cache = FolderCache(tk, config_paths=[str(path_cache), str(templates)])
+    _format_output_paths(tk, context, folder_cache)
+
+    later = time.time() + 10
+    os.utime(str(templates), (later, later))
+    _format_output_paths(tk, context, folder_cache)
+    assert tk.calls == {'create_filesystem_structure': 2, 'as_template_fields': 4}
+
+    os.utime(str(path_cache), (later + 10, later + 10))
+    _format_output_paths(tk, context, folder_cache)
+    assert tk.calls == {'create_filesystem_structure': 3, 'as_template_fields': 6}
+
+
+def test_own_folder_creation_keeps_the_memo(tmpdir, monkeypatch):
+    tk, context = make_tk()
+    path_cache = tmpdir.join('path_cache.db')
+    path_cache.write('')
+    create_filesystem_structure = tk.create_filesystem_structure
+
+    def create_and_register(entity_type, entity_id):
+        # the path cache changes when folders are created
+        later = time.time() + 10
+        os.utime(str(path_cache), (later, later))
+        return create_filesystem_structure(entity_type, entity_id)
+    monkeypatch.setattr(tk, 'create_filesystem_structure', create_and_register)
+
+    folder_cache = FolderCache(tk, config_paths=[str(path_cache)])
+    for _ in range(3):
+        _format_output_paths(tk, context, folder_cache)
+    assert tk.calls == {'create_filesystem_structure': 1, 'as_template_fields': 2}
+
+
+def test_deleted_folders_are_created_again(tmpdir):
+    tk, context = make_tk(root=str(tmpdir))
+    folder_cache = FolderCache(tk, config_paths=[])
+    assert folder_cache.ensure_folders('Task', 4) == 3
+    assert folder_cache.ensure_folders('Task', 4) == 0
+
+    shutil.rmtree(str(tmpdir.join('Task_4')))
+    assert folder_cache.ensure_folders('Task', 4) == 3
+    assert os.path.isdir(str(tmpdir.join('Task_4')))
+    assert tk.calls['create_filesystem_structure'] == 2
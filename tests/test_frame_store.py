@@ -0,0 +1,89 @@
+"""
+Tests of frame_store.FrameStore: dedup, the LRU side files, eviction and a gc racing a link.
+"""
+import os
+import time
+
+import pytest
+
+from playblast.frame_store import FrameStore
+
+OLD = time.time() - 3600
+
+
+def write(path, data):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'wb') as fh:
+        fh.write(data)
+    return path
+
+
+def publish_path(tmpdir, version, name='f.1001.jpg'):
+    # the version directory exists before its frames are published
+    directory = tmpdir.join(version)
+    directory.ensure(dir=True)
+    return str(directory.join(name))
+
+
+@pytest.fixture
+def store(tmpdir):
+    return FrameStore(str(tmpdir.join('store')))
+
+
+def test_link_dedups_identical_frames(tmpdir, store):
+    for version in ('v001', 'v002'):
+        capture = write(str(tmpdir.join('capture', version, 'f.1001.jpg')), b'frame 1001')
+        store.link(capture, publish_path(tmpdir, version), move=True)
+        assert not os.path.exists(capture)
+
+    v001, v002 = str(tmpdir.join('v001', 'f.1001.jpg')), str(tmpdir.join('v002', 'f.1001.jpg'))
+    assert os.path.samefile(v001, v002)
+    assert os.stat(v001).st_nlink == 3
+    assert store.linked == 2 and store.reused == 1
+    assert len(list(store.iter_blobs())) == 1
+
+
+def test_link_keeps_the_published_mtime(tmpdir, store):
+    v001 = publish_path(tmpdir, 'v001')
+    store.link(write(str(tmpdir.join('a.jpg')), b'frame'), v001)
+    os.utime(v001, (OLD, OLD))
+
+    store.link(write(str(tmpdir.join('b.jpg')), b'frame'), publish_path(tmpdir, 'v002'))
+
+    assert os.path.getmtime(v001) == OLD
+    blob_path = next(store.iter_blobs())[0]
+    assert store.get_last_access(blob_path) > OLD
+
+
+def test_evict_removes_only_unlinked_blobs_least_recently_used_first(tmpdir, store):
+    linked = publish_path(tmpdir, 'v001', 'linked.jpg')
+    store.link(write(str(tmpdir.join('linked.jpg')), b'linked' * 10), linked)
+    old_blob = store.add(write(str(tmpdir.join('old.jpg')), b'old' * 10), move=True)
+    new_blob = store.add(write(str(tmpdir.join('new.jpg')), b'new' * 10), move=True)
+    os.utime(store.get_access_path(old_blob), (OLD, OLD))
+
+    assert store.evict(max_size=35) == (1, 30)
+    assert not os.path.exists(old_blob) and not os.path.exists(store.get_access_path(old_blob))
+    assert os.path.exists(new_blob)
+
+    assert store.evict(max_size=0) == (1, 30)
+    assert [os.path.samefile(path, linked) for path, _ in store.iter_blobs()] == [True]
+
+
+def test_link_stores_again_when_gc_evicts_the_blob(tmpdir, store, monkeypatch):
+    blob_path = store.add(write(str(tmpdir.join('unlinked.jpg')), b'frame'), move=True)
+    hash_file = store.hash_file
+
+    def hash_then_gc(path):
+        digest = hash_file(path)
+        assert store.gc(0) == (1, 5)
+        return digest
+    monkeypatch.setattr(store, 'hash_file', hash_then_gc)
+
+    dest = publish_path(tmpdir, 'v002')
+    store.link(write(str(tmpdir.join('capture.jpg')), b'frame'), dest, move=True)
+
+    with open(dest, 'rb') as fh:
+        assert fh.read() == b'frame'
+    assert os.path.samefile(blob_path, dest)
@@ -0,0 +1,86 @@
+"""
+Focal length tables of hud.FocalLengthHUD against a mocked maya.cmds.
+"""
+import pytest
+
+from playblast import hud
+
+
+class MockCmds(object):
+    """
+    The maya.cmds calls of the focal length table, answered from a scene description.
+    """
+
+    def __init__(self, nodes=None, sources=None, value=35.0):
+        """
+        :param nodes: {node: node type}
+        :param sources: nodes connected to the focal length
+        :param value: focal length, or callable(frame)
+        """
+        self.nodes = nodes or {}
+        self.sources = sources or []
+        self.value = value
+        self.get_attr_calls = []
+
+    def listConnections(self, plug, source=True, destination=False, skipConversionNodes=False, type=None):
+        return list(self.sources)
+
+    def nodeType(self, node):
+        return self.nodes[node]
+
+    def getAttr(self, plug, time=None):
+        self.get_attr_calls.append(time)
+        if callable(self.value):
+            return self.value(1 if time is None else time)
+        return self.value
+
+    def currentTime(self, query=True):
+        return 1002.0
+
+
+@pytest.fixture
+def evaluated(monkeypatch):
+    curves = []
+
+    def evaluate(curve, frames):
+        curves.append(curve)
+        return dict((frame, 35.0 + frame - 1001) for frame in frames)
+    monkeypatch.setattr(hud, '_evaluate_time_curve', evaluate)
+    return curves
+
+
+def test_static_focal_length_is_read_once(evaluated):
+    cmds = MockCmds(value=50.0)
+    assert hud.get_focal_length_table(cmds, 'camShape', 1001, 1003) == {1001: 50.0, 1002: 50.0, 1003: 50.0}
+    assert cmds.get_attr_calls == [None]
+    assert not evaluated
+
+
+@pytest.mark.parametrize('curve_type', ['animCurveTL', 'animCurveTA', 'animCurveTU'])
+def test_time_curve_is_evaluated_through_the_api(evaluated, curve_type):
+    cmds = MockCmds({'camShape_focalLength': curve_type}, ['camShape_focalLength'])
+    assert hud.get_focal_length_table(cmds, 'camShape', 1001, 1003) == {1001: 35.0, 1002: 36.0, 1003: 37.0}
+    assert evaluated == ['camShape_focalLength']
+    assert not cmds.get_attr_calls
+
+
+@pytest.mark.parametrize('nodes', [
+    # driven keys
+    {'camShape_focalLength': 'animCurveUL'},
+    {'camShape_focalLength': 'animCurveUU'},
+    # an anim curve through a conversion
+    {'unitConversion1': 'unitConversion'},
+    {'expression1': 'expression'},
+])
+def test_other_inputs_are_read_per_frame(evaluated, nodes):
+    cmds = MockCmds(nodes, list(nodes), value=lambda frame: frame / 10.0)
+    assert hud.get_focal_length_table(cmds, 'camShape', 1001, 1003) == {1001: 100.1, 1002: 100.2, 1003: 100.3}
+    assert cmds.get_attr_calls == [1001, 1002, 1003]
+    assert not evaluated
+
+
+def test_hud_text_looks_the_current_frame_up(evaluated):
+    cmds = MockCmds({'camShape_focalLength': 'animCurveUL'}, ['camShape_focalLength'],
+                    value=lambda frame: frame - 966.5)
+    focal_length_hud = hud.FocalLengthHUD('camShape', 1001, 1003, cmds=cmds)
+    assert focal_length_hud.get_text() == '35.5mm'
@@ -0,0 +1,111 @@
+"""
+The segmented encode against the single process one, on a synthetic sequence.
+
+ffmpeg's framemd5 of both movies are compared frame by frame. Lossless x264 has no
+B-frames, so the picture hashes are compared on lossless encodes, and the timestamps,
+where the B-frame reordering and edit lists of joined segments would drift, on encodes of
+the playblast profile with B-frames, whose pictures are checked with PSNR instead.
+Needs ffmpeg with libx264 on the PATH, or in the FFMPEG environment variable.
+"""
+import os
+import shutil
+import subprocess
+
+import pytest
+
+from playblast import parallel_encode
+
+FRAME_RATE = 24
+FIRST_FRAME = 1001
+FRAME_COUNT = 150
+# lossless, the decoded pictures do not depend on how the encode was split
+LOSSLESS_ARGS = ['-c:v', 'libx264', '-preset', 'veryfast', '-qp', '0', '-pix_fmt', 'yuv420p']
+# the playblast profiles, with B-frames
+PROFILE_ARGS = ['-c:v', 'libx264', '-preset', 'medium', '-crf', '18', '-bf', '3', '-pix_fmt', 'yuv420p']
+# lowest PSNR between the two encodes of a frame, a shift by one frame is far below
+MIN_PSNR = 35.0
+
+FFMPEG = os.environ.get('FFMPEG') or shutil.which('ffmpeg')
+
+pytestmark = pytest.mark.skipif(not FFMPEG, reason='ffmpeg not found')
+
+
+@pytest.fixture(scope='module')
+def sequence(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('sequence')
+    pattern = str(directory / 'frame.%04d.jpg')
+    subprocess.check_call([FFMPEG, '-y', '-loglevel', 'error',
+                           '-f', 'lavfi', '-i', 'testsrc2=size=320x180:rate={}'.format(FRAME_RATE),
+                           '-frames:v', str(FRAME_COUNT),
+                           '-start_number', str(FIRST_FRAME),
+                           '-q:v', '2',
+                           pattern])
+    return pattern
+
+
+def encode(sequence, first, frame_count, mov_path, codec_args):
+    subprocess.check_call([FFMPEG, '-y', '-loglevel', 'error',
+                           '-framerate', str(FRAME_RATE),
+                           '-start_number', str(first),
+                           '-i', sequence,
+                           '-frames:v', str(frame_count)] + codec_args + [mov_path])
+
+
+def framemd5(mov_path):
+    """
+    Returns (pts, duration, md5) of every decoded frame.
+    """
+    output = subprocess.check_output([FFMPEG, '-loglevel', 'error', '-i', mov_path, '-f', 'framemd5', '-'])
+    frames = []
+    for line in output.decode('utf-8').splitlines():
+        if line.startswith('#'):
+            continue
+        stream, dts, pts, duration, size, md5 = [value.strip() for value in line.split(',')]
+        frames.append((int(pts), int(duration), md5))
+    return frames
+
+
+def psnr(mov_path, reference_path):
+    """
+    Returns the PSNR of every frame of a movie against the same frame of a reference.
+    """
+    output = subprocess.check_output([FFMPEG, '-loglevel', 'error', '-i', mov_path, '-i', reference_path,
+                                      '-lavfi', 'psnr=stats_file=-', '-f', 'null', '-'])
+    values = []
+    for line in output.decode('utf-8').splitlines():
+        fields = dict(field.split(':', 1) for field in line.split())
+        values.append(float(fields['psnr_avg']) if fields['psnr_avg'] != 'inf' else float('inf'))
+    return values
+
+
+def encode_both(tmp_path, sequence, segments, gop, encoder_args):
+    single_path = str(tmp_path / 'single.mov')
+    encode(sequence, FIRST_FRAME, FRAME_COUNT, single_path,
+           parallel_encode.get_codec_args(1, gop, encoder_args=encoder_args))
+
+    def encode_segment(start, end, segment_path, codec_args):
+        encode(sequence, FIRST_FRAME + start, end - start + 1, segment_path, codec_args)
+
+    segmented = parallel_encode.SegmentedEncode(encode_segment, FRAME_COUNT, segments, FFMPEG, gop=gop,
+                                                encoder_args=encoder_args)
+    assert len(segmented.ranges) == segments
+    return single_path, segmented.run(str(tmp_path / 'segmented.mov'))
+
+
+@pytest.mark.parametrize('segments, gop', [(3, 12), (4, 24), (7, 5)])
+def test_segmented_encode_matches_single_process(tmp_path, sequence, segments, gop):
+    single_path, segmented_path = encode_both(tmp_path, sequence, segments, gop, LOSSLESS_ARGS)
+
+    single = framemd5(single_path)
+    assert len(single) == FRAME_COUNT
+    assert framemd5(segmented_path) == single
+
+
+@pytest.mark.parametrize('segments, gop', [(3, 12), (4, 24)])
+def test_segmented_encode_with_b_frames_keeps_timestamps(tmp_path, sequence, segments, gop):
+    single_path, segmented_path = encode_both(tmp_path, sequence, segments, gop, PROFILE_ARGS)
+
+    single = framemd5(single_path)
+    assert len(single) == FRAME_COUNT
+    assert [frame[:2] for frame in framemd5(segmented_path)] == [frame[:2] for frame in single]
+    assert min(psnr(segmented_path, single_path)) > MIN_PSNR
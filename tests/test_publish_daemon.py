@@ -0,0 +1,158 @@
+"""
+Tests of publish_daemon.PublishDaemon.serve against stubs.StubShotgun: crash recovery and two daemons
+started on one root.
+
+The jobs start after their movie step, the encode needs OpenImageIO and ffmpeg.
+"""
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+
+from playblast import publish_daemon, stubs
+
+
+@pytest.fixture(autouse=True)
+def fast_daemon(monkeypatch):
+    monkeypatch.setattr(publish_daemon, 'POLL_INTERVAL', 0.02)
+    monkeypatch.setattr(publish_daemon.PublishJob, 'get_review_media',
+                        lambda job: type('NoReviewMedia', (object,), {'exists': False, 'thumbnail_path': None})())
+
+
+@pytest.fixture
+def shotgun():
+    return stubs.StubShotgun(latency=0.01)
+
+
+def make_factory(shotgun):
+    tk = stubs.StubTk(shotgun)
+    return lambda manifest: (tk, publish_daemon.ManifestContext(manifest['context']), stubs.register_publish)
+
+
+def make_manifest(job_id, steps=('frames', 'movie'), version_entity=None):
+    state = {'steps': list(steps)}
+    if version_entity:
+        state['version_entity'] = version_entity
+    return {
+        'manifest_version': publish_daemon.MANIFEST_VERSION,
+        'job_id': job_id,
+        'format': 'qt',
+        'frames': {'first': 1001, 'last': 1010, 'capture_path': '/missing/capture.mov',
+                   'dest_path': '/show/sh010/playblast/{}.mov'.format(job_id)},
+        'publish': {'movie_path': '/show/sh010/playblast/{}.mov'.format(job_id), 'publish_name': job_id,
+                    'version_number': 1, 'publish_type': 'Playblast', 'pass_type': 'wireframe',
+                    'description': 'Playblast Data', 'note_type': 'Artist Version', 'upload_to_sg': True},
+        'settings': {},
+        'context': {'entity': stubs.StubContext.entity, 'project': stubs.StubContext.project,
+                    'user': stubs.StubContext.user, 'task': stubs.StubContext.task},
+        'sgtk': {},
+        'state': state,
+    }
+
+
+def write_running(root, manifest, owner):
+    publish_daemon.make_dirs(root)
+    publish_daemon.write_json(os.path.join(root, 'running', '{}.json'.format(manifest['job_id'])), manifest)
+    with open(os.path.join(root, 'running', '{}.pid'.format(manifest['job_id'])), 'w') as fh:
+        fh.write(str(owner))
+
+
+def get_dead_pid():
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+
+def count_created(shotgun, entity_type):
+    created = [call for call in shotgun.calls if call[0] == 'create' and call[1] == entity_type]
+    batched = [request for call in shotgun.calls if call[0] == 'batch' for request in call[1]
+               if request == ('create', entity_type)]
+    return len(created) + len(batched)
+
+
+def list_jobs(root, folder):
+    return sorted(name for name in os.listdir(os.path.join(root, folder)) if name.endswith('.json'))
+
+
+def test_resumes_jobs_of_a_dead_daemon(tmpdir, shotgun):
+    root = str(tmpdir)
+    dead_pid = get_dead_pid()
+    write_running(root, make_manifest('sh010_a'), dead_pid)
+    # crashed after its Version was created
+    write_running(root, make_manifest('sh010_b', ('frames', 'movie', 'version'), {'type': 'Version', 'id': 99}),
+                  dead_pid)
+
+    daemon = publish_daemon.PublishDaemon(root, idle_timeout=0.1, shotgun_factory=make_factory(shotgun))
+    assert daemon.serve() == 0
+
+    assert list_jobs(root, 'done') == ['sh010_a.json', 'sh010_b.json']
+    assert not os.listdir(os.path.join(root, 'running'))
+    assert count_created(shotgun, 'Version') == 1
+    assert count_created(shotgun, 'PublishedFile') == 2
+    done = publish_daemon.read_json(os.path.join(root, 'done', 'sh010_b.json'))
+    assert done['state']['version_entity'] == {'type': 'Version', 'id': 99}
+    assert publish_daemon.read_status(root)['stopped']
+
+
+def test_leaves_jobs_of_a_live_owner(tmpdir, shotgun):
+    root = str(tmpdir)
+    owner = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(30)'])
+    try:
+        write_running(root, make_manifest('sh010_a'), owner.pid)
+        daemon = publish_daemon.PublishDaemon(root, idle_timeout=0.1, shotgun_factory=make_factory(shotgun))
+        assert daemon.serve() == 0
+    finally:
+        owner.kill()
+        owner.wait()
+
+    assert list_jobs(root, 'running') == ['sh010_a.json']
+    assert count_created(shotgun, 'Version') == 0
+
+
+def test_second_daemon_does_not_serve(tmpdir, shotgun):
+    root = str(tmpdir)
+    publish_daemon.make_dirs(root)
+    job_ids = ['sh010_{}'.format(i) for i in range(6)]
+    for job_id in job_ids:
+        publish_daemon.submit(root, make_manifest(job_id))
+
+    daemons = [publish_daemon.PublishDaemon(root, workers=2, idle_timeout=0.3, shotgun_factory=make_factory(shotgun),
+                                            lock_timeout=0) for _ in range(2)]
+    claimed = []
+    for daemon in daemons:
+        original_claim = daemon.claim
+
+        def claim(original_claim=original_claim, daemon=daemon):
+            job_id = original_claim()
+            if job_id:
+                claimed.append((daemons.index(daemon), job_id))
+            return job_id
+        daemon.claim = claim
+
+    threads = [threading.Thread(target=daemon.serve) for daemon in daemons]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(30)
+
+    assert list_jobs(root, 'done') == sorted('{}.json'.format(job_id) for job_id in job_ids)
+    assert count_created(shotgun, 'Version') == len(job_ids)
+    assert len(set(index for index, _ in claimed)) == 1
+    assert sorted(job_id for _, job_id in claimed) == job_ids
+
+
+def test_lock_waits_for_an_exiting_daemon(tmpdir):
+    root = str(tmpdir)
+    first = publish_daemon.DaemonLock(root)
+    assert first.acquire()
+    assert first.get_owner() == os.getpid()
+    second = publish_daemon.DaemonLock(root)
+    assert not second.acquire(0)
+
+    timer = threading.Timer(0.1, first.release)
+    timer.start()
+    assert second.acquire(5)
+    second.release()
+    timer.join()
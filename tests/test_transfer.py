@@ -0,0 +1,77 @@
+"""
+Tests of transfer.FileTransfer strategies against a temporary directory.
+"""
+import errno
+import os
+import stat
+
+import pytest
+
+from playblast.transfer import FileTransfer
+
+
+def write(path, data=b'frame'):
+    with open(path, 'wb') as fh:
+        fh.write(data)
+    return path
+
+
+def no_reflink(source, dest):
+    raise NotImplementedError('no reflink in the test')
+
+
+def get_mode(path):
+    return stat.S_IMODE(os.stat(path).st_mode)
+
+
+def test_hardlink_keeps_the_source_permissions(tmpdir):
+    source = write(str(tmpdir.join('v001.1001.jpg')))
+    os.chmod(source, 0o444)
+    file_transfer = FileTransfer(permissions=0o666)
+    file_transfer._reflink = no_reflink
+
+    result = file_transfer.transfer(source, str(tmpdir.join('v002.1001.jpg')))
+
+    assert result.strategy == 'hardlink'
+    assert get_mode(source) == 0o444
+
+
+def test_copies_get_the_permissions(tmpdir):
+    source = write(str(tmpdir.join('v001.1001.jpg')))
+    os.chmod(source, 0o444)
+    dest = str(tmpdir.join('v002.1001.jpg'))
+
+    result = FileTransfer(permissions=0o640, allow_link=False).transfer(source, dest)
+
+    assert result.strategy != 'hardlink'
+    assert get_mode(dest) == 0o640
+    assert get_mode(source) == 0o444
+
+
+@pytest.mark.parametrize('error_number, unsupported', [
+    (errno.EXDEV, True),
+    (errno.EOPNOTSUPP, True),
+    (errno.EPERM, True),
+    (errno.EIO, False),
+    (errno.EBUSY, False),
+    (errno.ENOSPC, False),
+])
+def test_only_unsupported_errors_skip_a_strategy(tmpdir, error_number, unsupported):
+    file_transfer = FileTransfer()
+    calls = []
+
+    def failing_hardlink(source, dest):
+        calls.append(dest)
+        if len(calls) == 1:
+            raise OSError(error_number, os.strerror(error_number))
+        os.link(source, dest)
+    file_transfer._reflink = no_reflink
+    file_transfer._hardlink = failing_hardlink
+
+    source = write(str(tmpdir.join('f.1001.jpg')))
+    first = file_transfer.transfer(source, str(tmpdir.join('a.jpg')))
+    second = file_transfer.transfer(source, str(tmpdir.join('b.jpg')))
+
+    assert first.strategy != 'hardlink'
+    assert (second.strategy == 'hardlink') is not unsupported
+    assert len(calls) == (1 if unsupported else 2)
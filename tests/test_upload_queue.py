@@ -0,0 +1,196 @@
+"""
+Tests of upload_queue against the bundled stand-in server: resumed uploads, the retry
+backoff and the recovery of uploads left by a dead process.
+"""
+import os
+import random
+import socket
+import subprocess
+import sys
+
+import pytest
+
+from playblast import upload_queue
+from playblast.upload_queue import (DONE, FAILED, PENDING, UPLOADING, HttpTransport, UploadQueue, UploadWorker,
+                                    get_backoff, serve_standin)
+
+SITE = 'https://stub.shotgunstudio.com'
+
+
+@pytest.fixture
+def server(tmpdir):
+    root = tmpdir.join('server')
+    root.ensure(dir=True)
+    server = serve_standin(str(root))
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def get_url(server):
+    return 'http://127.0.0.1:{}'.format(server.server_port)
+
+
+def get_received(server):
+    names = os.listdir(server.root)
+    assert len(names) == 1
+    with open(os.path.join(server.root, names[0]), 'rb') as fh:
+        return fh.read()
+
+
+def make_queue(tmpdir, **kwargs):
+    return UploadQueue(str(tmpdir.join('queue.sqlite')), **kwargs)
+
+
+def enqueue(queue, tmpdir, data, name='movie.mov', site=SITE):
+    path = tmpdir.join(name)
+    path.write_binary(data)
+    return queue.enqueue(site, 'upload', 'Version', 1, str(path), 'sg_uploaded_movie')
+
+
+def get_row(queue, upload_id):
+    with queue._connect() as connection:
+        row = connection.execute('SELECT {} FROM uploads WHERE id = ?'.format(', '.join(upload_queue.COLUMNS)),
+                                 (upload_id,)).fetchone()
+    return dict(zip(upload_queue.COLUMNS, row))
+
+
+class InterruptingTransport(object):
+    """
+    HttpTransport whose link drops after the first chunk of the first attempt.
+    """
+
+    def __init__(self, transport):
+        self.transport = transport
+        self.attempts = 0
+
+    def upload(self, item, progress=None):
+        self.attempts += 1
+
+        def interrupt(offset):
+            progress(offset)
+            if self.attempts == 1:
+                raise IOError('connection reset')
+        return self.transport.upload(item, progress=interrupt)
+
+
+def test_interrupted_upload_resumes_mid_file(tmpdir, server):
+    data = os.urandom(4 * 1024)
+    queue = make_queue(tmpdir, backoff_base=0.0)
+    upload_id = enqueue(queue, tmpdir, data)
+    transport = InterruptingTransport(HttpTransport(get_url(server), chunk_size=1024))
+    worker = UploadWorker(queue, SITE, transport)
+
+    assert not worker.upload(queue.claim(SITE))
+    row = get_row(queue, upload_id)
+    assert (row['state'], row['sent'], row['attempts']) == (PENDING, 1024, 1)
+
+    assert worker.upload(queue.claim(SITE))
+    assert get_row(queue, upload_id)['state'] == DONE
+    assert get_received(server) == data
+    # one chunk before the drop, the three left after it
+    assert server.requests == 4
+
+
+def test_dropped_chunks_are_resumed_by_the_worker(tmpdir, server):
+    random.seed(7)
+    server.fail_rate = 0.3
+    data = os.urandom(16 * 1024)
+    queue = make_queue(tmpdir, backoff_base=0.01, backoff_max=0.05)
+    upload_id = enqueue(queue, tmpdir, data)
+    worker = UploadWorker(queue, SITE, HttpTransport(get_url(server), chunk_size=1024), poll_interval=0.01,
+                          max_attempts=100)
+
+    worker.start()
+    try:
+        assert worker.drain(timeout=30)
+    finally:
+        worker.stop()
+
+    assert get_row(queue, upload_id)['state'] == DONE
+    assert server.failures
+    assert get_received(server) == data
+
+
+@pytest.mark.parametrize('attempts, low, high', [
+    (1, 4.0, 6.0),
+    (2, 8.0, 12.0),
+    (4, 32.0, 48.0),
+    (20, 0.8 * 900, 1.2 * 900),
+])
+def test_backoff_doubles_with_jitter_up_to_the_maximum(attempts, low, high):
+    for _ in range(20):
+        assert low <= get_backoff(attempts, base=5.0, maximum=900.0) <= high
+
+
+def test_failed_upload_waits_for_its_next_attempt(tmpdir):
+    queue = make_queue(tmpdir, backoff_base=60.0)
+    upload_id = enqueue(queue, tmpdir, b'movie')
+
+    assert queue.claim(SITE)['id'] == upload_id
+    delay = queue.fail(upload_id, IOError('timeout'), max_attempts=3)
+    assert 48.0 <= delay <= 72.0
+    row = get_row(queue, upload_id)
+    assert (row['state'], row['attempts'], row['last_error']) == (PENDING, 1, 'timeout')
+    assert queue.claim(SITE) is None
+
+    for attempts in (2, 3):
+        with queue._connect() as connection:
+            connection.execute('UPDATE uploads SET next_attempt = 0 WHERE id = ?', (upload_id,))
+        assert queue.claim(SITE)['id'] == upload_id
+        delay = queue.fail(upload_id, IOError('timeout'), max_attempts=3)
+    assert delay is None
+    assert get_row(queue, upload_id)['state'] == FAILED
+    assert queue.depth(SITE) == 0
+
+    assert queue.retry_failed(SITE) == 1
+    assert queue.claim(SITE)['id'] == upload_id
+
+
+def test_recovers_only_uploads_of_dead_owners(tmpdir):
+    queue = make_queue(tmpdir)
+    dead = subprocess.Popen([sys.executable, '-c', 'pass'])
+    dead.wait()
+    live = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(30)'])
+    try:
+        hostname = socket.gethostname()
+        dead_id = enqueue(queue, tmpdir, b'dead', 'dead.mov')
+        queue.claim(SITE, '{}:{}'.format(hostname, dead.pid))
+        live_id = enqueue(queue, tmpdir, b'live', 'live.mov')
+        queue.claim(SITE, '{}:{}'.format(hostname, live.pid))
+        # another machine, within its lease
+        remote_id = enqueue(queue, tmpdir, b'remote', 'remote.mov')
+        queue.claim(SITE, 'render42:{}'.format(dead.pid))
+
+        assert queue.recover(SITE) == 1
+    finally:
+        live.kill()
+        live.wait()
+
+    assert get_row(queue, dead_id)['state'] == PENDING
+    assert get_row(queue, live_id)['state'] == UPLOADING
+    assert get_row(queue, remote_id)['state'] == UPLOADING
+    assert queue.claim(SITE)['id'] == dead_id
+
+
+def test_worker_start_resumes_uploads_of_a_dead_session(tmpdir, server):
+    data = os.urandom(3 * 1024)
+    queue = make_queue(tmpdir)
+    upload_id = enqueue(queue, tmpdir, data)
+    dead = subprocess.Popen([sys.executable, '-c', 'pass'])
+    dead.wait()
+    item = queue.claim(SITE, '{}:{}'.format(socket.gethostname(), dead.pid))
+    # the dead session sent its first chunk
+    transport = HttpTransport(get_url(server), chunk_size=1024)
+    transport._request(transport.get_url(item), 'PUT', data[:1024],
+                       {'Content-Range': 'bytes 0-1023/{}'.format(len(data))})
+
+    worker = UploadWorker(queue, SITE, transport, poll_interval=0.01).start()
+    try:
+        assert worker.drain(timeout=30)
+    finally:
+        worker.stop()
+
+    assert get_row(queue, upload_id)['state'] == DONE
+    assert get_received(server) == data
+    assert server.requests == 3
@@ -0,0 +1,61 @@
+"""
+Tests of version_publish against stubs.StubShotgun, on cores with and without the register_publish dry run.
+"""
+from playblast import stubs
+from playblast.version_publish import DRY_RUN_CORE_VERSION, VersionPublisher, is_core_version_at_least
+
+
+class Context(object):
+    entity = {'type': 'Shot', 'id': 1, 'name': 'sh010'}
+    project = {'type': 'Project', 'id': 2, 'name': 'project'}
+    user = {'type': 'HumanUser', 'id': 3, 'name': 'artist'}
+    task = {'type': 'Task', 'id': 4, 'name': 'anim'}
+
+
+def old_core_register_publish(tk, context, path, name, version_number, **kwargs):
+    # cores before the dry run take it in **kwargs and create the PublishedFile anyway
+    kwargs.pop('dry_run', None)
+    return stubs.register_publish(tk, context, path, name, version_number, **kwargs)
+
+
+def publish(tk, register_publish):
+    publisher = VersionPublisher(tk, Context(), register_publish)
+    publisher.publish('/show/sh010/playblast/sh010_v001.mov', '/show/sh010/playblast/.source/sh010_v001.%04d.jpg',
+                      1001, 1100, 'sh010', 1, 'playblast', 'wireframe', description='Playblast Data')
+    return publisher
+
+
+def get_published_files(shotgun):
+    return [entity for (kind, _), entity in shotgun.entities.items() if kind == 'PublishedFile']
+
+
+def test_core_versions():
+    assert is_core_version_at_least('v0.19.18', DRY_RUN_CORE_VERSION)
+    assert is_core_version_at_least('v0.20.1', 'v0.19.0')
+    assert is_core_version_at_least('HEAD', DRY_RUN_CORE_VERSION)
+    assert not is_core_version_at_least('v0.18.172', DRY_RUN_CORE_VERSION)
+    assert not is_core_version_at_least('v0.14.28', DRY_RUN_CORE_VERSION)
+    assert not is_core_version_at_least(None, DRY_RUN_CORE_VERSION)
+    assert not is_core_version_at_least('Undefined', DRY_RUN_CORE_VERSION)
+
+
+def test_new_core_batches_one_published_file():
+    shotgun = stubs.StubShotgun()
+    publisher = publish(stubs.StubTk(shotgun), stubs.register_publish)
+
+    assert publisher.batch
+    published_files = get_published_files(shotgun)
+    assert len(published_files) == 1
+    assert published_files[0]['version']['type'] == 'Version'
+    assert any(call[0] == 'batch' for call in shotgun.calls)
+
+
+def test_old_core_registers_one_published_file():
+    shotgun = stubs.StubShotgun()
+    publisher = publish(stubs.StubTk(shotgun, version='v0.18.120'), old_core_register_publish)
+
+    assert not publisher.batch
+    published_files = get_published_files(shotgun)
+    assert len(published_files) == 1
+    assert published_files[0]['version']['type'] == 'Version'
+    assert not any(call[0] == 'batch' for call in shotgun.calls)